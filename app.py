@@ -1,21 +1,51 @@
-from flask import Flask, request, jsonify
-from flasgger import Swagger # <--- IMPORTANTE: Importamos Swagger
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from flask import Flask, Response, request, jsonify, stream_with_context
+from cache import CacheTTL
+from documentacion import DocumentacionPerezosa
+from metricas import MetricasWSGI, anotar_ruta, exportar as exportar_metricas
+import compresion
+import perfil
+from autoguardado import BufferAutoguardado
+from dibujos import DibujoDemasiadoGrande, DibujoNoValido
 from firestore import (
     db,
-    crear_nota,
-    obtener_notas_usuario,
-    obtener_nota,
+    iterar_notas_usuario,
+    iterar_categorias,
+    obtener_pagina_notas_usuario,
+    MAX_LIMITE_NOTAS,
+    validar_filtros_notas,
+    obtener_nota_versionada,
+    obtener_version_nota,
+    obtener_dibujo,
+    anadir_trazos,
+    DibujoModificado,
+    obtener_version_notas,
+    obtener_cambios_notas,
+    buscar_notas,
+    obtener_etiquetas_usuario,
+    MAX_RESULTADOS_BUSQUEDA,
+    SincronizacionCaducada,
+    RETENCION_ELIMINADAS_DIAS,
     actualizar_nota,
+    nota_existe,
     eliminar_nota,
     obtener_o_crear_categoria_por_nombre,
-    crear_relacion_nota_categoria,
     eliminar_categoria,
     actualizar_categoria,
     realizar_compra_plantilla,
-    plantilla_esta_desbloqueada,
     obtener_plantillas_desbloqueadas_usuario,
     usuario_tiene_feature,
-    realizar_compra_feature
+    realizar_compra_feature,
+    obtener_notas_categoria,
+    obtener_fuentes_desbloqueadas,
+    obtener_fondos_desbloqueados,
+    obtener_resumen_usuario,
+    crear_nota_con_categoria,
+    ejecutar_operaciones_notas,
+    error_no_encontrado
 )
 
 app = Flask(__name__)
@@ -25,7 +55,151 @@ app.config['SWAGGER'] = {
     'title': 'API Wise Agend - Notas y Apuntes',
     'uiversion': 3
 }
-swagger = Swagger(app) # <--- IMPORTANTE: Inicializamos Swagger
+# Métricas de cada petición para /metrics (ver metricas.py). /apidocs queda
+# fuera: se monta con la primera visita (ver documentacion.py)
+app.wsgi_app = MetricasWSGI(app.wsgi_app)
+app.wsgi_app = DocumentacionPerezosa(app)
+
+
+@app.before_request
+def _anotar_ruta_metricas():
+    # Se etiqueta por la regla ("/api/nota/<id_nota>"), no por la URL
+    if request.url_rule is not None:
+        anotar_ruta(request.url_rule.rule)
+
+
+# Con PERFIL_BACKEND=1, cabeceras X-Backend-* y avisos de N+1 (ver perfil.py)
+perfil.registrar(app)
+
+# gzip/brotli en las rutas de notas según Accept-Encoding (ver compresion.py)
+compresion.registrar(app)
+
+# Caché por worker del resumen de desbloqueos (/api/usuarios/<id>/entitlements).
+# Se invalida al completarse una compra en este mismo worker; en los demás
+# caduca como mucho a los CACHE_DESBLOQUEOS_TTL segundos.
+cache_desbloqueos = CacheTTL(
+    max_entradas=int(os.environ.get("CACHE_DESBLOQUEOS_MAX", 10000)),
+    ttl=float(os.environ.get("CACHE_DESBLOQUEOS_TTL", 30))
+)
+
+# Cambios de PUT /api/nota/<id_nota>?autoguardado=1 pendientes de guardar en
+# este worker (ver autoguardado.py). gunicorn.conf.py los guarda al parar
+autoguardado = BufferAutoguardado(lambda id_nota, cambios: actualizar_nota(id_nota, cambios))
+
+# Campos que se pueden autoguardar; el resto (dibujo, categoría) se guarda al momento
+CAMPOS_AUTOGUARDADO = ("titulo", "contenido", "etiquetas", "estado", "favorita",
+                       "animacion_fondo", "color_fondo")
+
+NDJSON = "application/x-ndjson"
+
+
+def _pide_ndjson():
+    # Solo si el cliente lo prefiere explícitamente; "*/*" sigue siendo JSON
+    return request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+
+
+def _respuesta_ndjson(filas):
+    """Respuesta application/x-ndjson (un objeto JSON por línea) que se
+    serializa mientras se recorre 'filas', sin construir la lista completa."""
+    filas = iter(filas)
+    # Se pide la primera fila antes de responder para que un error de la
+    # consulta todavía pueda devolverse como 500
+    primera = next(filas, None)
+
+    def generar():
+        if primera is not None:
+            yield app.json.dumps(primera) + "\n"
+            for fila in filas:
+                yield app.json.dumps(fila) + "\n"
+
+    return Response(stream_with_context(generar()), mimetype=NDJSON)
+
+
+def _respuesta_lista(filas):
+    if _pide_ndjson():
+        return _respuesta_ndjson(filas)
+    return jsonify(list(filas))
+
+
+def _error_actualizar_nota(id_nota, id_categoriaNota):
+    # actualizar_nota devuelve False tanto si falta la nota como la
+    # categoría: solo en ese caso se lee cuál de las dos es
+    if not id_categoriaNota or not nota_existe(id_nota):
+        return jsonify({"error": "Nota no encontrada", "id_nota": id_nota}), 404
+    return jsonify({
+        "error": "La categoría no existe",
+        "id_categoriaNota": id_categoriaNota
+    }), 404
+
+
+def _etag(*partes):
+    return hashlib.sha1("|".join(str(p) for p in partes).encode()).hexdigest()
+
+
+def _no_modificado(etag):
+    """Respuesta 304 si el cliente ya tiene esta versión (If-None-Match);
+    None si hay que generar la respuesta completa."""
+    if request.if_none_match.contains_weak(etag):
+        return _con_etag(Response(status=304), etag)
+    return None
+
+
+def _leer_fecha(texto):
+    """datetime con zona horaria a partir de un texto ISO 8601 (sin zona se
+    toma UTC). Lanza ValueError si no es una fecha válida."""
+    texto = texto.strip().replace("Z", "+00:00")
+    # Un '+' sin codificar en la URL llega como espacio: "...00 00:00"
+    if len(texto) > 6 and texto[-6] == " ":
+        texto = texto[:-6] + "+" + texto[-5:]
+    fecha = datetime.fromisoformat(texto)
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha
+
+
+def _leer_filtros_notas():
+    """Filtros del listado de notas a partir de la query string, ya
+    validados. Lanza ValueError con el mensaje para el cliente."""
+    args = request.args
+    filtros = {}
+    if args.get("estado"):
+        filtros["estado"] = args["estado"]
+    if args.get("favorita"):
+        favorita = args["favorita"].lower()
+        if favorita not in ("true", "false"):
+            raise ValueError("'favorita' debe ser true o false")
+        filtros["favorita"] = favorita == "true"
+
+    # Firestore solo admite un array-contains por consulta
+    etiquetas = args.getlist("etiqueta")
+    if len(etiquetas) > 1:
+        raise ValueError("Solo se puede filtrar por una etiqueta")
+    if etiquetas:
+        filtros["etiqueta"] = etiquetas[0]
+
+    for parametro in ("fecha_desde", "fecha_hasta"):
+        if args.get(parametro):
+            try:
+                filtros[parametro] = _leer_fecha(args[parametro])
+            except ValueError:
+                raise ValueError(f"'{parametro}' debe ser una fecha ISO 8601")
+    if args.get("orden"):
+        filtros["orden"] = args["orden"]
+
+    validar_filtros_notas(filtros)
+    return filtros
+
+
+def _error_dibujo(error):
+    status = 413 if isinstance(error, DibujoDemasiadoGrande) else 400
+    return jsonify({"error": str(error)}), status
+
+
+def _con_etag(respuesta, etag):
+    respuesta.set_etag(etag)
+    # El cliente puede guardar la respuesta pero debe revalidarla siempre
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    return respuesta
 
 
 # =====================================================
@@ -81,11 +255,17 @@ def api_crear_nota():
             color_fondo:
               type: string
               example: "0xFFE0E0E0"
+            dibujo:
+              description: "Dibujo de la nota (cualquier valor JSON; una lista de trazos para poder añadir trazos después)"
     responses:
       200:
         description: Nota creada exitosamente
       400:
-        description: Faltan campos requeridos
+        description: Faltan campos requeridos o el dibujo no es válido
+      404:
+        description: La categoría indicada no existe
+      413:
+        description: El dibujo supera el tamaño máximo
     """
     data = request.json
 
@@ -99,29 +279,35 @@ def api_crear_nota():
     id_categoriaNota = data.get("id_categoriaNota")
     categoria_nombre = data.get("categoria_nombre")
 
-    if categoria_nombre and not id_categoriaNota:
-        id_categoriaNota = obtener_o_crear_categoria_por_nombre(categoria_nombre)
-
-    if not id_categoriaNota:
+    if not id_categoriaNota and not categoria_nombre:
         return jsonify({
             "error": "Debes enviar 'id_categoriaNota' o 'categoria_nombre'"
         }), 400
 
-    # 🔥 ACTUALIZADO: Pasamos los nuevos campos de estilo a la función
-    id_nota = crear_nota(
-        id_usuario=data["id_usuario"],
-        id_plantilla=data["id_plantilla"],
-        titulo=data["titulo"],
-        contenido=data["contenido"],
-        etiquetas=data.get("etiquetas", []),
-        dibujo=data.get("dibujo", None),
-        estado=data.get("estado", "activa"),
-        # Nuevos campos para personalización
-        animacion_fondo=data.get("animacion_fondo"),
-        color_fondo=data.get("color_fondo")
-    )
-
-    crear_relacion_nota_categoria(id_nota, id_categoriaNota)
+    # Nota, relación y (si no existe) categoría se guardan en un solo lote
+    try:
+        id_nota, id_categoriaNota = crear_nota_con_categoria(
+            id_usuario=data["id_usuario"],
+            id_plantilla=data["id_plantilla"],
+            titulo=data["titulo"],
+            contenido=data["contenido"],
+            etiquetas=data.get("etiquetas", []),
+            dibujo=data.get("dibujo", None),
+            estado=data.get("estado", "activa"),
+            # Nuevos campos para personalización
+            animacion_fondo=data.get("animacion_fondo"),
+            color_fondo=data.get("color_fondo"),
+            id_categoriaNota=id_categoriaNota,
+            categoria_nombre=categoria_nombre
+        )
+    except error_no_encontrado():
+        # El contador de la categoría no se pudo actualizar: no existe
+        return jsonify({
+            "error": "La categoría no existe",
+            "id_categoriaNota": id_categoriaNota
+        }), 404
+    except (DibujoNoValido, DibujoDemasiadoGrande) as e:
+        return _error_dibujo(e)
 
     return jsonify({
         "ok": True,
@@ -136,22 +322,243 @@ def api_crear_nota():
 @app.route("/api/notas/<id_usuario>", methods=["GET"])
 def api_get_notas(id_usuario):
     """
-    Obtener todas las notas de un usuario.
+    Obtener las notas de un usuario.
+    Sin 'limit' ni 'cursor' devuelve todas las notas. Con 'limit' devuelve una
+    página, de la más reciente a la más antigua, y la cabecera
+    X-Siguiente-Cursor con el valor a enviar en 'cursor' para la siguiente
+    (no se envía en la última página).
+    Con 'Accept: application/x-ndjson' responde una nota por línea y las va
+    enviando a medida que se leen.
+    Devuelve ETag; con If-None-Match responde 304 si ninguna nota del usuario
+    ha cambiado, comprobando solo su versión de notas.
+    Los filtros y el orden se resuelven en Firestore. fecha_desde/fecha_hasta
+    se aplican a la fecha del orden (creación si no se indica) y no se
+    pueden combinar con orden=titulo.
     ---
     tags:
       - Notas
+    produces:
+      - application/json
+      - application/x-ndjson
     parameters:
       - name: id_usuario
         in: path
         type: string
         required: true
         description: ID del usuario
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Notas por página (máximo 100)
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: Valor de X-Siguiente-Cursor de la página anterior
+      - name: resumen
+        in: query
+        type: boolean
+        required: false
+        description: Si es true omite el contenido (vista de lista). El dibujo nunca se incluye, solo dibujo_info
+      - name: estado
+        in: query
+        type: string
+        required: false
+        example: "activa"
+      - name: favorita
+        in: query
+        type: boolean
+        required: false
+      - name: etiqueta
+        in: query
+        type: string
+        required: false
+        description: Solo notas con esta etiqueta (una sola)
+      - name: fecha_desde
+        in: query
+        type: string
+        required: false
+        description: Fecha ISO 8601, inclusive
+      - name: fecha_hasta
+        in: query
+        type: string
+        required: false
+        description: Fecha ISO 8601, inclusive
+      - name: orden
+        in: query
+        type: string
+        required: false
+        enum: ["-creacion", "creacion", "-modificacion", "modificacion", "titulo"]
     responses:
       200:
         description: Lista de notas
+      304:
+        description: Las notas no han cambiado desde el ETag enviado
+      400:
+        description: limit, cursor o filtros no válidos
     """
-    notas = obtener_notas_usuario(id_usuario)
-    return jsonify(notas)
+    try:
+        filtros = _leer_filtros_notas()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # La versión se lee antes que las notas: si cambian entre medias el
+    # ETag queda viejo y la siguiente petición simplemente no obtiene 304
+    etag = _etag(id_usuario, obtener_version_notas(id_usuario),
+                 request.full_path, _pide_ndjson())
+    no_modificado = _no_modificado(etag)
+    if no_modificado:
+        return no_modificado
+
+    resumen = request.args.get("resumen", "").lower() in ("1", "true", "si")
+    limite = request.args.get("limit")
+    cursor = request.args.get("cursor")
+
+    if limite is None and cursor is None:
+        notas = iterar_notas_usuario(id_usuario, resumen, filtros)
+        return _con_etag(_respuesta_lista(notas), etag)
+
+    try:
+        limite = int(limite) if limite is not None else MAX_LIMITE_NOTAS
+    except ValueError:
+        limite = 0
+    if not 1 <= limite <= MAX_LIMITE_NOTAS:
+        return jsonify({
+            "error": f"'limit' debe ser un entero entre 1 y {MAX_LIMITE_NOTAS}"
+        }), 400
+
+    try:
+        notas, siguiente = obtener_pagina_notas_usuario(id_usuario, limite, cursor,
+                                                        resumen, filtros)
+    except ValueError:
+        return jsonify({"error": "'cursor' no válido"}), 400
+
+    respuesta = _respuesta_lista(notas)
+    if siguiente:
+        respuesta.headers["X-Siguiente-Cursor"] = siguiente
+    return _con_etag(respuesta, etag)
+
+
+# =====================================================
+# -----------    CAMBIOS DESDE UNA FECHA    --------------
+# =====================================================
+@app.route("/api/notas/<id_usuario>/cambios", methods=["GET"])
+def api_cambios_notas(id_usuario):
+    """
+    Sincronización incremental: notas creadas o modificadas y notas
+    eliminadas después de 'desde'.
+    El cliente guarda 'hasta' de la respuesta y lo envía como 'desde' en la
+    siguiente sincronización. Sin 'desde' devuelve todas las notas.
+    ---
+    tags:
+      - Notas
+    parameters:
+      - name: id_usuario
+        in: path
+        type: string
+        required: true
+      - name: desde
+        in: query
+        type: string
+        required: false
+        description: Fecha ISO 8601 ('hasta' de la sincronización anterior)
+    responses:
+      200:
+        description: Cambios desde la fecha indicada
+        schema:
+          type: object
+          properties:
+            notas:
+              type: array
+              items:
+                type: object
+            eliminadas:
+              type: array
+              items:
+                type: string
+            hasta:
+              type: string
+              example: "2025-01-31T18:22:05.123456+00:00"
+      304:
+        description: No hay cambios desde el ETag enviado
+      400:
+        description: "'desde' no es una fecha válida"
+      410:
+        description: "'desde' es anterior a la retención de notas eliminadas; hay que descargar todas las notas"
+    """
+    desde = request.args.get("desde")
+    try:
+        desde = _leer_fecha(desde) if desde else None
+    except ValueError:
+        return jsonify({"error": "'desde' debe ser una fecha ISO 8601"}), 400
+
+    etag = _etag(id_usuario, obtener_version_notas(id_usuario), request.full_path)
+    no_modificado = _no_modificado(etag)
+    if no_modificado:
+        return no_modificado
+
+    try:
+        cambios = obtener_cambios_notas(id_usuario, desde)
+    except SincronizacionCaducada:
+        return jsonify({
+            "error": f"Solo se conservan las notas eliminadas de los últimos "
+                     f"{RETENCION_ELIMINADAS_DIAS} días; descarga todas las notas"
+        }), 410
+
+    return _con_etag(jsonify(cambios), etag)
+
+
+# =====================================================
+# -----------    BUSCAR NOTAS    -------------------------
+# =====================================================
+@app.route("/api/notas/<id_usuario>/buscar", methods=["GET"])
+def api_buscar_notas(id_usuario):
+    """
+    Búsqueda de texto en el título, el contenido y las etiquetas de las notas
+    del usuario. No distingue mayúsculas ni tildes, ignora palabras vacías
+    ("de", "la", ...) y trata igual singular y plural.
+    Los resultados van de más a menos relevantes: primero las notas con más
+    palabras de la búsqueda, y el título pesa más que las etiquetas y estas
+    más que el contenido. Cada nota viene sin contenido ni dibujo.
+    ---
+    tags:
+      - Notas
+    parameters:
+      - name: id_usuario
+        in: path
+        type: string
+        required: true
+      - name: q
+        in: query
+        type: string
+        required: true
+        example: "lista de la compra"
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Número máximo de resultados (por defecto 20, máximo 50)
+    responses:
+      200:
+        description: Notas encontradas, cada una con su "puntuacion"
+      400:
+        description: Falta 'q' o 'limit' no es válido
+    """
+    texto = request.args.get("q", "").strip()
+    if not texto:
+        return jsonify({"error": "Falta 'q'"}), 400
+
+    try:
+        limite = int(request.args.get("limit", 20))
+    except ValueError:
+        limite = 0
+    if not 1 <= limite <= MAX_RESULTADOS_BUSQUEDA:
+        return jsonify({
+            "error": f"'limit' debe ser un entero entre 1 y {MAX_RESULTADOS_BUSQUEDA}"
+        }), 400
+
+    return jsonify(buscar_notas(id_usuario, texto, limite))
 
 
 # =====================================================
@@ -160,7 +567,9 @@ def api_get_notas(id_usuario):
 @app.route("/api/nota/<id_nota>", methods=["GET"])
 def api_get_nota(id_nota):
     """
-    Obtener el detalle de una nota específica.
+    Obtener el detalle de una nota específica, con su dibujo completo.
+    Incluye los cambios autoguardados que este servidor aún no ha guardado.
+    Devuelve ETag; con If-None-Match responde 304 si la nota no ha cambiado.
     ---
     tags:
       - Notas
@@ -169,16 +578,42 @@ def api_get_nota(id_nota):
         in: path
         type: string
         required: true
+      - name: dibujo
+        in: query
+        type: boolean
+        required: false
+        description: Si es false no incluye el dibujo, solo dibujo_info (se obtiene con /api/nota/{id_nota}/dibujo)
     responses:
       200:
         description: Objeto de la nota
+      304:
+        description: La nota no ha cambiado desde el ETag enviado
       404:
         description: Nota no encontrada
     """
-    nota = obtener_nota(id_nota)
-    if nota:
-        return jsonify({**nota, "id": id_nota})
-    return jsonify({"error": "Nota no encontrada"}), 404
+    con_dibujo = request.args.get("dibujo", "").lower() not in ("0", "false", "no")
+    pendientes = autoguardado.pendientes(id_nota)
+
+    def etag_de(version):
+        return _etag(id_nota, version, con_dibujo,
+                     sorted(pendientes.items()) if pendientes else "")
+
+    # Con If-None-Match se compara primero la versión, sin leer la nota ni
+    # los trozos del dibujo: un 304 cuesta una lectura vacía
+    if request.if_none_match:
+        version = obtener_version_nota(id_nota)
+        if version is None:
+            return jsonify({"error": "Nota no encontrada"}), 404
+        no_modificado = _no_modificado(etag_de(version))
+        if no_modificado:
+            return no_modificado
+
+    nota, version = obtener_nota_versionada(id_nota, con_dibujo)
+    if not nota:
+        return jsonify({"error": "Nota no encontrada"}), 404
+
+    etag = etag_de(version)
+    return _con_etag(jsonify({**nota, **pendientes, "id": id_nota}), etag)
 
 
 # =====================================================
@@ -196,6 +631,17 @@ def api_update_nota(id_nota):
         in: path
         type: string
         required: true
+      - name: autoguardado
+        in: query
+        type: boolean
+        required: false
+        description: >
+          Autoguardado del editor. Los cambios se acumulan y se guardan juntos
+          unos segundos después (responde 202). Solo titulo, contenido,
+          etiquetas, estado, favorita, animacion_fondo y color_fondo; con
+          otros campos la nota se guarda al momento. Un PUT sin autoguardado
+          guarda también los cambios pendientes. Solo si el servidor tiene
+          AUTOGUARDADO=1; si no, se guarda al momento.
       - name: body
         in: body
         required: true
@@ -209,22 +655,48 @@ def api_update_nota(id_nota):
             categoria_nombre:
               type: string
               description: Si se envía, actualiza la categoría
+            dibujo:
+              description: Sustituye el dibujo entero (null lo elimina)
     responses:
       200:
         description: Actualización exitosa
+      202:
+        description: Cambios aceptados para autoguardado, pendientes de guardar
+      400:
+        description: El dibujo no es válido
+      404:
+        description: La nota o la categoría no existen
+      413:
+        description: El dibujo supera el tamaño máximo
     """
     cambios = request.json or {}
 
+    autoguardar = request.args.get("autoguardado", "").lower() in ("1", "true", "si")
+    if (autoguardar and autoguardado.activo and cambios
+            and all(c in CAMPOS_AUTOGUARDADO for c in cambios)):
+        # Como en el guardado al momento, una nota que no existe es un 404. Si
+        # ya tiene cambios pendientes se comprobó al anotar el primero
+        if not autoguardado.pendientes(id_nota) and not nota_existe(id_nota):
+            return jsonify({"error": "Nota no encontrada", "id_nota": id_nota}), 404
+        autoguardado.anotar(id_nota, cambios)
+        return jsonify({"ok": True, "pendiente": True}), 202
+
     categoria_nombre = cambios.get("categoria_nombre")
     id_categoriaNota = cambios.get("id_categoriaNota")
 
-    if categoria_nombre or id_categoriaNota:
-        if categoria_nombre:
-            id_categoriaNota = obtener_o_crear_categoria_por_nombre(categoria_nombre)
-
-        crear_relacion_nota_categoria(id_nota, id_categoriaNota)
+    if categoria_nombre:
+        id_categoriaNota = obtener_o_crear_categoria_por_nombre(categoria_nombre)
 
-    actualizar_nota(id_nota, cambios)
+    # Cambios y movimiento de categoría (con sus contadores) en una
+    # transacción, junto con los autoguardados pendientes de la nota
+    try:
+        actualizada = autoguardado.guardar_nota(
+            id_nota,
+            lambda pendientes: actualizar_nota(id_nota, {**pendientes, **cambios}, id_categoriaNota))
+    except (DibujoNoValido, DibujoDemasiadoGrande) as e:
+        return _error_dibujo(e)
+    if not actualizada:
+        return _error_actualizar_nota(id_nota, id_categoriaNota)
 
     return jsonify({"ok": True})
 
@@ -248,10 +720,183 @@ def api_delete_nota(id_nota):
       200:
         description: Nota eliminada
     """
+    autoguardado.descartar(id_nota)
     eliminar_nota(id_nota)
     return jsonify({"ok": True})
 
 
+# =====================================================
+# -----------    DIBUJO DE UNA NOTA    -------------------
+# =====================================================
+@app.route("/api/nota/<id_nota>/dibujo", methods=["GET"])
+def api_get_dibujo(id_nota):
+    """
+    Obtener el dibujo de una nota y su dibujo_info (trozos, tamaño y hash).
+    El ETag es el hash del dibujo; con If-None-Match responde 304 sin leer
+    el dibujo si no ha cambiado.
+    ---
+    tags:
+      - Notas
+    parameters:
+      - name: id_nota
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: "{id_nota, dibujo, dibujo_info}; dibujo es null si la nota no tiene"
+      304:
+        description: El dibujo no ha cambiado desde el ETag enviado
+      404:
+        description: Nota no encontrada
+    """
+    # Con la respuesta comprimida el cliente devuelve el ETag como débil
+    resultado = obtener_dibujo(id_nota, request.if_none_match.as_set(include_weak=True))
+    if resultado is None:
+        return jsonify({"error": "Nota no encontrada"}), 404
+
+    dibujo, info = resultado
+    etag = info["hash"] if info else _etag(id_nota, "sin dibujo")
+    return _no_modificado(etag) or _con_etag(jsonify({
+        "id_nota": id_nota,
+        "dibujo": dibujo,
+        "dibujo_info": info
+    }), etag)
+
+
+@app.route("/api/nota/<id_nota>/dibujo/trazos", methods=["POST"])
+def api_anadir_trazos(id_nota):
+    """
+    Añadir trazos al final del dibujo de una nota sin volver a enviarlo
+    entero. Solo se guardan los trazos nuevos.
+    ---
+    tags:
+      - Notas
+    parameters:
+      - name: id_nota
+        in: path
+        type: string
+        required: true
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - trazos
+          properties:
+            trazos:
+              type: array
+              description: Trazos a añadir, en el mismo formato que los del dibujo
+              items:
+                type: object
+            hash_base:
+              type: string
+              description: "Hash del dibujo del que parte el cliente (dibujo_info.hash); si ya no es el actual responde 409"
+    responses:
+      200:
+        description: "{ok, dibujo_info} con el nuevo hash"
+      400:
+        description: "'trazos' no es una lista o el dibujo actual no es una lista de trazos"
+      404:
+        description: Nota no encontrada
+      409:
+        description: El dibujo ha cambiado desde hash_base
+      413:
+        description: El dibujo supera el tamaño máximo
+    """
+    data = request.json or {}
+
+    try:
+        info = anadir_trazos(id_nota, data.get("trazos"), data.get("hash_base"))
+    except (DibujoNoValido, DibujoDemasiadoGrande) as e:
+        return _error_dibujo(e)
+    except DibujoModificado:
+        return jsonify({"error": "El dibujo ha cambiado; vuelve a obtenerlo"}), 409
+    if info is None:
+        return jsonify({"error": "Nota no encontrada"}), 404
+
+    return jsonify({"ok": True, "dibujo_info": info})
+
+
+# =====================================================
+# -----------    OPERACIONES MASIVAS    ------------------
+# =====================================================
+# Máximo de operaciones aceptadas en una sola petición
+MAX_OPERACIONES_BATCH = 1000
+
+
+@app.route("/api/notas/batch", methods=["POST"])
+def api_notas_batch():
+    """
+    Ejecutar muchas operaciones sobre notas en una sola petición
+    (sincronización de clientes sin conexión).
+    ---
+    tags:
+      - Notas
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          required:
+            - operaciones
+          properties:
+            operaciones:
+              type: array
+              description: "Cada elemento lleva 'op' (crear, obtener, actualizar o eliminar)"
+              items:
+                type: object
+              example:
+                - op: "crear"
+                  datos:
+                    id_usuario: "user123"
+                    id_plantilla: "plantilla_basica"
+                    titulo: "Nota offline"
+                    contenido: "..."
+                    categoria_nombre: "General"
+                - op: "actualizar"
+                  id_nota: "abc123"
+                  cambios:
+                    titulo: "Nuevo título"
+                - op: "eliminar"
+                  id_nota: "def456"
+                - op: "obtener"
+                  id_nota: "abc123"
+    responses:
+      200:
+        description: Un resultado por operación, en el mismo orden (ok, status, id_nota, error)
+      400:
+        description: Cuerpo inválido o demasiadas operaciones
+    """
+    data = request.json or {}
+    operaciones = data.get("operaciones")
+
+    if not isinstance(operaciones, list) or not operaciones:
+        return jsonify({"error": "Falta 'operaciones' (lista)"}), 400
+
+    if len(operaciones) > MAX_OPERACIONES_BATCH:
+        return jsonify({
+            "error": f"Máximo {MAX_OPERACIONES_BATCH} operaciones por petición"
+        }), 400
+
+    try:
+        # Los autoguardados pendientes de estas notas van antes que las operaciones
+        for op in operaciones:
+            if isinstance(op, dict) and isinstance(op.get("id_nota"), str):
+                autoguardado.guardar_nota(op["id_nota"])
+        resultados = ejecutar_operaciones_notas(operaciones)
+    except Exception as e:
+        print("ERROR en operaciones masivas:", e)
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+    return jsonify({
+        "ok": all(r["ok"] for r in resultados),
+        "resultados": resultados
+    })
+
+
 # =====================================================
 # -----------    FAVORITOS    ----------------------------
 # =====================================================
@@ -283,6 +928,8 @@ def api_toggle_favorita(id_nota):
         description: Estado actualizado
       400:
         description: Falta campo favorita
+      404:
+        description: Nota no encontrada
     """
     data = request.json or {}
     nueva_fav = data.get("favorita")
@@ -290,14 +937,13 @@ def api_toggle_favorita(id_nota):
     if nueva_fav is None:
         return jsonify({"error": "Falta 'favorita': true/false"}), 400
 
-    actualizar_nota(id_nota, {"favorita": nueva_fav})
-
     if nueva_fav:
         id_categoria = obtener_o_crear_categoria_por_nombre("Favoritos")
     else:
         id_categoria = obtener_o_crear_categoria_por_nombre("General")
 
-    crear_relacion_nota_categoria(id_nota, id_categoria)
+    if not actualizar_nota(id_nota, {"favorita": nueva_fav}, id_categoria):
+        return _error_actualizar_nota(id_nota, id_categoria)
 
     return jsonify({
         "ok": True,
@@ -313,9 +959,13 @@ def api_toggle_favorita(id_nota):
 def api_get_categorias():
     """
     Listar categorías filtradas por usuario.
+    Con 'Accept: application/x-ndjson' responde una categoría por línea.
     ---
     tags:
       - Categorías
+    produces:
+      - application/json
+      - application/x-ndjson
     parameters:
       - name: usuarioId
         in: query
@@ -323,32 +973,15 @@ def api_get_categorias():
         description: ID del usuario para filtrar sus categorías
     responses:
       200:
-        description: Lista de categorías del usuario
+        description: Lista de categorías del usuario con su número de notas (num_notas)
     """
     # 1. Obtenemos el ID del usuario desde los parámetros de la URL (?usuarioId=...)
     usuario_id = request.args.get('usuarioId')
 
     try:
-        ref = db.collection("categoriaNota")
-        
-        # 2. Si nos envían un usuario, filtramos por él
-        if usuario_id:
-            docs = ref.where("id_usuario", "==", usuario_id).stream()
-        else:
-            # Opcional: Si no envían ID, ¿quieres devolver todas o ninguna? 
-            # Devolvemos todas por defecto (comportamiento anterior) o una lista vacía.
-            docs = ref.stream()
-
-        categorias = []
-        for d in docs:
-            data = d.to_dict()
-            if data:
-                categorias.append({
-                    "id": d.id,
-                    "nombre": data.get("nombre", ""),
-                    "usuarioId": data.get("id_usuario", "") # Devolvemos también el ID
-                })
-        return jsonify(categorias)
+        # 2. Si nos envían un usuario, filtramos por él; si no, se devuelven
+        # todas (comportamiento anterior)
+        return _respuesta_lista(iterar_categorias(usuario_id))
 
     except Exception as e:
         print("ERROR al obtener categorías:", e)
@@ -428,21 +1061,9 @@ def api_get_notas_por_categoria(id_usuario, id_categoria):
       200:
         description: Lista de notas filtrada
     """
-    rels = db.collection("notas_categoriaNota")\
-             .where("id_categoriaNota", "==", id_categoria)\
-             .stream()
-
-    ids_notas = [r.to_dict().get("id_nota") for r in rels]
-
-    if not ids_notas:
-        return jsonify([])
-
-    notas = []
-    for id_nota in ids_notas:
-        nota = obtener_nota(id_nota)
-        if nota and nota["id_usuario"] == id_usuario:
-            nota["id"] = id_nota
-            notas.append(nota)
+    # Lectura por lotes: solo viajan las notas que pertenecen al usuario.
+    # Con FIRESTORE_ASINCRONO=1 los lotes se piden a la vez
+    notas = obtener_notas_categoria(id_usuario, id_categoria)
 
     return jsonify(notas)
 
@@ -486,17 +1107,12 @@ def api_update_categoria(id_categoria):
         return jsonify({"error": "Falta 'nombre'"}), 400
 
     try:
-        doc_ref = db.collection("categoriaNota").document(id_categoria)
-        doc = doc_ref.get()
-
-        if not doc.exists:
+        if not actualizar_categoria(id_categoria, nuevo_nombre):
             return jsonify({
                 "error": "La categoría no existe",
                 "id_categoria": id_categoria
             }), 404
 
-        doc_ref.update({"nombre": nuevo_nombre})
-
         return jsonify({"ok": True})
 
     except Exception as e:
@@ -526,35 +1142,23 @@ def api_delete_categoria(id_categoria):
         description: No se puede eliminar porque tiene notas
     """
     try:
-        # Verificar si la categoría existe
-        doc_ref = db.collection("categoriaNota").document(id_categoria)
-        doc = doc_ref.get()
+        # Solo se elimina si existe y no tiene notas (contador num_notas)
+        eliminada = eliminar_categoria(id_categoria)
 
-        if not doc.exists:
+        if eliminada is None:
             return jsonify({
                 "error": "La categoría no existe",
                 "id_categoria": id_categoria
             }), 404
 
-        # 🔴 Verificar si alguna nota usa esta categoría
-        notas_relacionadas = db.collection("notas") \
-            .where("id_categoriaNota", "==", id_categoria) \
-            .stream()
-
-        tiene_notas = False
-        for _ in notas_relacionadas:
-            tiene_notas = True
-            break  # Con una que exista basta
-
-        if tiene_notas:
+        # 🔴 Alguna nota usa esta categoría
+        if not eliminada:
             return jsonify({
                 "ok": False,
                 "error": "La categoría no puede eliminarse porque tiene notas relacionadas"
             }), 400
 
-        # 🟢 Si no tiene notas → eliminar categoría
-        doc_ref.delete()
-
+        # 🟢 No tenía notas → categoría eliminada
         return jsonify({
             "ok": True,
             "msg": "Categoría eliminada correctamente"
@@ -565,6 +1169,78 @@ def api_delete_categoria(id_categoria):
         return jsonify({"error": "Error interno del servidor"}), 500
 
 
+# =====================================================
+# -----------    ETIQUETAS    ----------------------------
+# =====================================================
+@app.route("/api/etiquetas/<id_usuario>", methods=["GET"])
+def api_etiquetas(id_usuario):
+    """
+    Etiquetas del usuario con cuántas notas tiene cada una, de más a menos
+    usada (nube de etiquetas). Con 'prefijo' sirve para autocompletar: no
+    distingue mayúsculas ni tildes. Cuesta una consulta a las partes del
+    índice de etiquetas (ETIQUETAS_PARTES lecturas como mucho).
+    ---
+    tags:
+      - Notas
+    parameters:
+      - name: id_usuario
+        in: path
+        type: string
+        required: true
+      - name: prefijo
+        in: query
+        type: string
+        required: false
+        example: "tra"
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Número máximo de etiquetas
+      - name: notas
+        in: query
+        type: boolean
+        required: false
+        description: Si es true incluye los ids de las notas de cada etiqueta
+    responses:
+      200:
+        description: Lista de etiquetas
+        schema:
+          type: array
+          items:
+            type: object
+            properties:
+              etiqueta:
+                type: string
+                example: "trabajo"
+              num_notas:
+                type: integer
+                example: 12
+      400:
+        description: limit no válido
+    """
+    incluir_notas = request.args.get("notas", "").lower() in ("1", "true", "si")
+    limite = request.args.get("limit")
+    try:
+        limite = int(limite) if limite is not None else None
+    except ValueError:
+        limite = 0
+    if limite is not None and limite < 1:
+        return jsonify({"error": "'limit' debe ser un entero positivo"}), 400
+
+    try:
+        etiquetas = obtener_etiquetas_usuario(id_usuario, request.args.get("prefijo"),
+                                              incluir_notas)
+    except Exception as e:
+        print("ERROR al obtener etiquetas:", e)
+        return jsonify({"error": "Error interno del servidor"}), 500
+
+    respuesta = jsonify(etiquetas[:limite])
+    respuesta.add_etag()
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    return respuesta.make_conditional(request)
+
+
 # =====================================================
 # -----------    COMPRAS Y USUARIOS    ----------------
 # =====================================================
@@ -598,14 +1274,12 @@ def api_comprar_plantilla():
     id_plantilla = data.get("id_plantilla")
     costo = 200
 
-    # 1. VALIDACIÓN: Evitar cobrar de nuevo si ya la tiene
-    if plantilla_esta_desbloqueada(id_usuario, id_plantilla):
-        return jsonify({"ok": True, "mensaje": "Ya tienes esta plantilla"}), 200
-
-    # 2. PROCESAR COMPRA
+    # PROCESAR COMPRA: si ya la tiene no se cobra de nuevo (se comprueba en
+    # la misma transacción)
     exito, mensaje = realizar_compra_plantilla(id_usuario, id_plantilla, costo)
     
     if exito:
+        cache_desbloqueos.invalidar(id_usuario)
         return jsonify({"ok": True, "mensaje": mensaje})
     else:
         return jsonify({"ok": False, "error": mensaje}), 400
@@ -688,17 +1362,82 @@ def api_comprar_feature():
     
     # MODIFICACIÓN: Leer el costo del JSON, si no viene, usar 150 por defecto
     costo = data.get("costo", 150) 
-    
-    if usuario_tiene_feature(id_usuario, feature):
-        return jsonify({"ok": True, "mensaje": "Ya lo tienes"}), 200
 
-    # Ahora pasamos el costo dinámico a la función de firestore
+    # Ahora pasamos el costo dinámico a la función de firestore (si ya lo
+    # tiene no se cobra: se comprueba en la misma transacción)
     exito, mensaje = realizar_compra_feature(id_usuario, feature, costo)
     
     if exito:
+        cache_desbloqueos.invalidar(id_usuario)
         return jsonify({"ok": True, "mensaje": mensaje})
     return jsonify({"ok": False, "error": mensaje}), 400
 
+@app.route("/api/usuarios/<id_usuario>/entitlements", methods=["GET"])
+def api_entitlements(id_usuario):
+    """
+    Resumen de todo lo que el usuario tiene: monedas, plantillas y features.
+    Sustituye a las llamadas separadas de monedas, plantillas, fuentes, fondos
+    y check_feature al abrir la app.
+    Devuelve ETag; con If-None-Match responde 304 si nada ha cambiado.
+    ---
+    tags:
+      - Usuarios y Compras
+    parameters:
+      - name: id_usuario
+        in: path
+        type: string
+        required: true
+    responses:
+      200:
+        description: Monedas, plantillas y features agrupadas por tipo
+        schema:
+          type: object
+          properties:
+            monedas:
+              type: integer
+              example: 350
+            plantillas:
+              type: array
+              items:
+                type: string
+              example: ["plantilla_basica"]
+            features:
+              type: object
+              properties:
+                fuentes:
+                  type: array
+                  items:
+                    type: string
+                  example: ["Lora"]
+                fondos:
+                  type: array
+                  items:
+                    type: string
+                  example: ["assets/animations/fire.json"]
+                otras:
+                  type: array
+                  items:
+                    type: string
+                  example: ["multimedia_images"]
+      304:
+        description: El resumen no ha cambiado desde el ETag enviado
+    """
+    resumen = cache_desbloqueos.obtener(id_usuario)
+    if resumen is None:
+        try:
+            resumen = obtener_resumen_usuario(id_usuario)
+        except Exception as e:
+            print("ERROR al obtener entitlements:", e)
+            return jsonify({"error": "Error interno del servidor"}), 500
+        cache_desbloqueos.guardar(id_usuario, resumen)
+
+    # El ETag sale del propio contenido: viene de la caché, así que es barato
+    respuesta = jsonify(resumen)
+    respuesta.add_etag()
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    return respuesta.make_conditional(request)
+
+
 @app.route("/api/usuarios/fonts_unlocked/<id_usuario>", methods=["GET"])
 def api_fonts_unlocked(id_usuario):
     """
@@ -716,17 +1455,8 @@ def api_fonts_unlocked(id_usuario):
         description: Lista de nombres de fuentes
     """
     try:
-        # Buscamos todas las features del usuario
-        docs = db.collection("usuarios_features")\
-                  .where("id_usuario", "==", id_usuario)\
-                  .stream()
-        
-        unlocked_fonts = []
-        for d in docs:
-            feature_name = d.to_dict().get("feature", "")
-            # Si la feature empieza con 'font_', extraemos el nombre
-            if feature_name.startswith("font_"):
-                unlocked_fonts.append(feature_name.replace("font_", ""))
+        # Una lectura del resumen de desbloqueos; se quita el prefijo 'font_'
+        unlocked_fonts = obtener_fuentes_desbloqueadas(id_usuario)
         
         return jsonify(unlocked_fonts) # Retorna ej: ["Lora", "Pacifico"]
     except Exception as e:
@@ -754,22 +1484,31 @@ def api_get_unlocked_backgrounds(id_usuario):
         description: Lista de paths de assets desbloqueados
     """
     try:
-        # Buscamos en la colección usuarios_features
-        docs = db.collection("usuarios_features")\
-                  .where("id_usuario", "==", id_usuario)\
-                  .stream()
-        
-        unlocked_backgrounds = []
-        for d in docs:
-            feature_name = d.to_dict().get("feature", "")
-            # Filtramos solo aquellos que sean assets de animaciones
-            if feature_name.startswith("assets/animations/"):
-                unlocked_backgrounds.append(feature_name)
+        # Solo las features que son assets de animaciones
+        unlocked_backgrounds = obtener_fondos_desbloqueados(id_usuario)
         
         return jsonify(unlocked_backgrounds)
     except Exception as e:
         print("Error al obtener fondos desbloqueados:", e)
         return jsonify([]), 500
+
+
+# =====================================================
+# -----------    MÉTRICAS    -----------------------------
+# =====================================================
+@app.route("/metrics", methods=["GET"])
+def api_metricas():
+    """
+    Métricas en formato Prometheus de todos los workers.
+    ---
+    tags:
+      - Operación
+    responses:
+      200:
+        description: Latencia, códigos de estado, tamaño de respuesta y documentos de Firestore por ruta
+    """
+    cuerpo, content_type = exportar_metricas()
+    return Response(cuerpo, content_type=content_type)
     
     
 # =====================================================
@@ -0,0 +1,73 @@
+"""
+Bucle de eventos en segundo plano para las lecturas asíncronas de Firestore.
+
+Flask atiende cada petición en un hilo (workers gthread de gunicorn). Las
+funciones async de firestore.py no corren en ese hilo sino en un único bucle
+de eventos por proceso, en un hilo propio y con el cliente asíncrono de
+Firestore; el hilo de la petición solo espera el resultado con ejecutar().
+Así las lecturas independientes de una petición salen a la vez, y mientras
+esperan respuesta el bucle atiende las de las demás peticiones del worker.
+
+Se activa con FIRESTORE_ASINCRONO=1; sin ella todo se lee con el cliente
+síncrono como hasta ahora.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+
+
+def modo_asincrono():
+    return os.environ.get("FIRESTORE_ASINCRONO", "0").strip().lower() in ("1", "true", "si")
+
+
+class BucleAsincrono:
+    """Hilo con un bucle de eventos y el cliente asíncrono que vive en él.
+
+    Ambos se crean la primera vez que se usan, y de nuevo si el proceso es
+    un fork (gunicorn --preload): los hilos no sobreviven al fork.
+    """
+
+    def __init__(self, crear_cliente):
+        self._crear_cliente = crear_cliente
+        self._lock = threading.Lock()
+        self._pid = None
+        self._bucle = None
+        self._cliente = None
+
+    @property
+    def activo(self):
+        return modo_asincrono()
+
+    def _bucle_actual(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._bucle = asyncio.new_event_loop()
+                self._cliente = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._bucle.run_forever,
+                                 name="firestore-asincrono", daemon=True).start()
+            return self._bucle
+
+    async def cliente(self):
+        # Solo se llama desde el bucle, así que no hace falta el lock: el
+        # cliente gRPC asíncrono queda ligado a este bucle
+        if self._cliente is None:
+            self._cliente = self._crear_cliente()
+        return self._cliente
+
+    def ejecutar(self, corutina, timeout=None):
+        """Ejecuta la corutina en el bucle y espera su resultado desde el
+        hilo de la petición. La corutina ve las mismas variables de contexto
+        que el hilo (por ejemplo la medición de metricas.py)."""
+        en_contexto = _con_contexto(corutina, contextvars.copy_context())
+        futuro = asyncio.run_coroutine_threadsafe(en_contexto, self._bucle_actual())
+        return futuro.result(timeout)
+
+
+async def _con_contexto(corutina, contexto):
+    # La tarea tiene su propia copia del contexto del bucle; las tareas que
+    # lance (asyncio.gather) copian la suya, ya con estos valores
+    for variable, valor in contexto.items():
+        variable.set(valor)
+    return await corutina
@@ -0,0 +1,309 @@
+"""
+Autoguardado de notas con escrituras agrupadas.
+
+El editor guarda la nota cada pocos segundos mientras se escribe. Con
+PUT /api/nota/<id_nota>?autoguardado=1 esos cambios no se escriben en el
+momento: se acumulan por nota en el proceso (los de la misma nota se
+fusionan y gana el último valor de cada campo) y se guardan con una sola
+escritura cuando la nota lleva AUTOGUARDADO_ESPERA segundos sin cambios, o
+AUTOGUARDADO_ESPERA_MAX segundos después del primer cambio pendiente, para
+que escribir sin parar no retrase el guardado indefinidamente. Caben
+AUTOGUARDADO_MAX_NOTAS notas pendientes; al llenarse se guarda ya la más
+antigua.
+
+Está desactivado salvo con AUTOGUARDADO=1: un 202 se da antes de guardar
+en Firestore.
+
+Garantías:
+  - Durabilidad: cada cambio aceptado se anota con fsync en un diario en
+    AUTOGUARDADO_DIR (un fichero por proceso) antes de responder. Si el
+    worker muere, otro worker adopta su diario y guarda lo pendiente, y al
+    apagarse el worker (worker_exit en gunicorn.conf.py o al salir el
+    proceso) se guarda todo. El diario solo sobrevive a lo que sobreviva
+    AUTOGUARDADO_DIR: por defecto es el directorio temporal, que en Render
+    se pierde al reiniciar o desplegar la instancia, así que si el proceso
+    muere sin apagarse bien lo pendiente se pierde. Para no perderlo hay
+    que apuntar AUTOGUARDADO_DIR a un disco persistente.
+  - Leer lo escrito: GET /api/nota/<id_nota> en el mismo worker ve los
+    cambios pendientes. Los demás workers los ven cuando se guardan.
+  - Orden: un guardado explícito (PUT sin autoguardado) lleva los cambios
+    pendientes de la nota en la misma escritura, y nunca coincide con el
+    guardado en segundo plano de la misma nota.
+  - Existencia: un autoguardado de una nota que no existe responde 404, como
+    el guardado al momento.
+"""
+import atexit
+import glob
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def autoguardado_activo():
+    return os.environ.get("AUTOGUARDADO", "0").strip().lower() in ("1", "true", "si")
+
+
+def _proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _leer_diario(ruta):
+    """{id_nota: cambios} con los cambios del diario fusionados en orden.
+    Una última línea a medio escribir (el proceso murió) se ignora."""
+    pendientes = {}
+    with open(ruta, encoding="utf-8") as f:
+        for linea in f:
+            try:
+                anotacion = json.loads(linea)
+            except ValueError:
+                continue
+            pendientes.setdefault(anotacion["id_nota"], {}).update(anotacion["cambios"])
+    return pendientes
+
+
+class _Entrada:
+    def __init__(self, cambios=None, momento=None):
+        self.cambios = dict(cambios or {})
+        self.primera = self.ultima = momento if momento is not None else time.monotonic()
+
+
+class BufferAutoguardado:
+    """Cambios pendientes por nota de este proceso, su diario y el hilo que
+    los guarda. guardar(id_nota, cambios) escribe los cambios y devuelve
+    False si la nota no existe."""
+
+    def __init__(self, guardar, directorio=None):
+        self._guardar = guardar
+        self.directorio = directorio or os.environ.get(
+            "AUTOGUARDADO_DIR", os.path.join(tempfile.gettempdir(), "autoguardado_notas"))
+        self.espera = float(os.environ.get("AUTOGUARDADO_ESPERA", 5))
+        self.espera_max = float(os.environ.get("AUTOGUARDADO_ESPERA_MAX", 30))
+        self.max_notas = int(os.environ.get("AUTOGUARDADO_MAX_NOTAS", 1000))
+        self._condicion = threading.Condition()
+        # Por orden de llegada del primer cambio: la primera es la más antigua
+        self._pendientes = OrderedDict()
+        # Cambios que se están escribiendo ahora, por nota
+        self._guardando = {}
+        self._pid = None
+        self._ruta_diario = None
+        self._diario = None
+        self._ultima_adopcion = 0
+
+    @property
+    def activo(self):
+        return autoguardado_activo()
+
+    def iniciar(self):
+        """Abre el diario de este proceso, adopta los de procesos que ya no
+        existen y arranca el hilo de guardado. Basta con el primer uso;
+        gunicorn lo llama al arrancar cada worker para adoptar cuanto antes."""
+        with self._condicion:
+            if self._pid == os.getpid():
+                return
+            # Tras un fork los hilos no sobreviven: todo se crea de nuevo
+            self._pid = os.getpid()
+            self._pendientes.clear()
+            self._guardando.clear()
+            os.makedirs(self.directorio, exist_ok=True)
+            self._ruta_diario = os.path.join(self.directorio, f"autoguardado-{self._pid}.jsonl")
+            # Un diario con nuestro pid es de un proceso anterior con el mismo
+            if os.path.exists(self._ruta_diario):
+                self._incorporar(_leer_diario(self._ruta_diario))
+            self._reescribir_diario()
+            threading.Thread(target=self._bucle, name="autoguardado", daemon=True).start()
+        atexit.register(self.vaciar)
+        self._adoptar_huerfanos()
+
+    # ---------- DIARIO ---------- #
+
+    def _anotar_diario(self, id_nota, cambios):
+        linea = json.dumps({"id_nota": id_nota, "cambios": cambios}, ensure_ascii=False)
+        self._diario.write(linea + "\n")
+        self._diario.flush()
+        os.fsync(self._diario.fileno())
+
+    def _reescribir_diario(self):
+        """Deja en el diario solo lo que sigue sin guardar. Se escribe aparte
+        y se sustituye, así nunca queda un diario a medias."""
+        if self._diario:
+            self._diario.close()
+        temporal = self._ruta_diario + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            for id_nota, cambios in self._sin_guardar().items():
+                f.write(json.dumps({"id_nota": id_nota, "cambios": cambios},
+                                   ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporal, self._ruta_diario)
+        self._diario = open(self._ruta_diario, "a", encoding="utf-8")
+
+    def _sin_guardar(self):
+        resultado = {i: dict(c) for i, c in self._guardando.items()}
+        for id_nota, entrada in self._pendientes.items():
+            resultado.setdefault(id_nota, {}).update(entrada.cambios)
+        return resultado
+
+    def _incorporar(self, pendientes):
+        """Añade cambios de un diario anterior, por debajo de los actuales,
+        para guardarlos en la siguiente vuelta."""
+        vencida = time.monotonic() - self.espera_max
+        for id_nota, cambios in pendientes.items():
+            entrada = self._pendientes.get(id_nota)
+            if entrada:
+                entrada.cambios = {**cambios, **entrada.cambios}
+                entrada.primera = vencida
+            else:
+                self._pendientes[id_nota] = _Entrada(cambios, vencida)
+                self._pendientes.move_to_end(id_nota, last=False)
+
+    def _adoptar_huerfanos(self):
+        self._ultima_adopcion = time.monotonic()
+        for ruta in glob.glob(os.path.join(self.directorio, "autoguardado-*.jsonl*")):
+            if ruta.endswith(".tmp"):
+                continue
+            # autoguardado-<pid>.jsonl o, a medio adoptar, ...jsonl.adoptado-<pid>
+            pid = int(re.findall(r"\d+", os.path.basename(ruta))[-1])
+            if pid == os.getpid() or _proceso_vivo(pid):
+                continue
+            propia = ruta.split(".jsonl")[0] + f".jsonl.adoptado-{os.getpid()}"
+            try:
+                # Solo un proceso consigue renombrarlo
+                os.rename(ruta, propia)
+            except OSError:
+                continue
+            with self._condicion:
+                self._incorporar(_leer_diario(propia))
+                self._reescribir_diario()
+                self._condicion.notify_all()
+            os.remove(propia)
+            print(f"Autoguardado: adoptado el diario del proceso {pid}")
+
+    # ---------- CAMBIOS PENDIENTES ---------- #
+
+    def anotar(self, id_nota, cambios):
+        """Acumula 'cambios' de la nota para guardarlos más tarde."""
+        self.iniciar()
+        expulsada = None
+        with self._condicion:
+            entrada = self._pendientes.get(id_nota)
+            if entrada is None:
+                if len(self._pendientes) >= self.max_notas:
+                    expulsada = next(iter(self._pendientes))
+                entrada = self._pendientes[id_nota] = _Entrada()
+            entrada.cambios.update(cambios)
+            entrada.ultima = time.monotonic()
+            self._anotar_diario(id_nota, cambios)
+            self._condicion.notify_all()
+        if expulsada:
+            self.guardar_nota(expulsada)
+
+    def pendientes(self, id_nota):
+        """Cambios de la nota aún sin guardar en este proceso ({} si no hay)."""
+        with self._condicion:
+            if self._pid != os.getpid():
+                return {}
+            cambios = dict(self._guardando.get(id_nota, {}))
+            entrada = self._pendientes.get(id_nota)
+            if entrada:
+                cambios.update(entrada.cambios)
+            return cambios
+
+    def descartar(self, id_nota):
+        """Olvida los cambios pendientes de la nota (se va a borrar)."""
+        with self._condicion:
+            if self._pid == os.getpid() and self._pendientes.pop(id_nota, None):
+                self._reescribir_diario()
+
+    def guardar_nota(self, id_nota, guardar=None):
+        """Guarda ya los cambios pendientes de la nota y devuelve lo que
+        devuelva guardar. Con 'guardar' (guardado explícito) se llama a
+        guardar(pendientes) para que los escriba junto con los suyos.
+
+        Si la nota se está guardando en otro hilo espera a que termine. Si
+        falla, o el guardado explícito devuelve False, los cambios siguen
+        pendientes."""
+        with self._condicion:
+            while id_nota in self._guardando:
+                self._condicion.wait()
+            entrada = self._pendientes.pop(id_nota, None) if self._pid == os.getpid() else None
+            if entrada is None and guardar is None:
+                return True
+            cambios = entrada.cambios if entrada else {}
+            self._guardando[id_nota] = cambios
+
+        guardado = False
+        try:
+            if guardar is not None:
+                resultado = guardar(dict(cambios))
+                guardado = bool(resultado)
+            else:
+                resultado = self._guardar(id_nota, cambios)
+                guardado = True
+                if not resultado:
+                    print(f"Autoguardado: la nota {id_nota} ya no existe; se descartan sus cambios")
+            return resultado
+        finally:
+            with self._condicion:
+                del self._guardando[id_nota]
+                if entrada is not None:
+                    if guardado:
+                        self._reescribir_diario()
+                    else:
+                        self._devolver(id_nota, entrada)
+                self._condicion.notify_all()
+
+    def _devolver(self, id_nota, entrada):
+        # Se reintenta pasado AUTOGUARDADO_ESPERA, por debajo de los cambios
+        # que hayan llegado mientras tanto
+        entrada.primera = entrada.ultima = time.monotonic()
+        posterior = self._pendientes.get(id_nota)
+        if posterior:
+            posterior.cambios = {**entrada.cambios, **posterior.cambios}
+        else:
+            self._pendientes[id_nota] = entrada
+            self._pendientes.move_to_end(id_nota, last=False)
+
+    def vaciar(self):
+        """Guarda todos los cambios pendientes (al apagar el proceso)."""
+        if self._pid != os.getpid():
+            return
+        with self._condicion:
+            ids = list(self._pendientes)
+        for id_nota in ids:
+            try:
+                self.guardar_nota(id_nota)
+            except Exception as e:
+                print(f"ERROR al guardar los cambios pendientes de la nota {id_nota}:", e)
+
+    # ---------- HILO DE GUARDADO ---------- #
+
+    def _vence(self, entrada):
+        return min(entrada.ultima + self.espera, entrada.primera + self.espera_max)
+
+    def _bucle(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            with self._condicion:
+                ahora = time.monotonic()
+                vencidas = [i for i, e in self._pendientes.items() if self._vence(e) <= ahora]
+                if not vencidas:
+                    proxima = min((self._vence(e) for e in self._pendientes.values()),
+                                  default=ahora + self.espera_max)
+                    self._condicion.wait(max(proxima - ahora, 0.01))
+            for id_nota in vencidas:
+                try:
+                    self.guardar_nota(id_nota)
+                except Exception as e:
+                    print(f"ERROR en el autoguardado de la nota {id_nota}:", e)
+            if time.monotonic() - self._ultima_adopcion >= self.espera_max:
+                self._adoptar_huerfanos()
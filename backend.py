@@ -0,0 +1,539 @@
+"""
+Selección del motor de datos.
+
+firestore.py trabaja siempre contra un par (db, firestore): el cliente y el
+módulo que aporta SERVER_TIMESTAMP, transactional, Increment, etc. Aquí se
+decide cuál se usa según la variable de entorno BACKEND_DATOS:
+
+    firestore  (por defecto) Firestore real con serviceAccountKey.json
+    memoria    motor local de backend_memoria.py, sin red ni credenciales
+
+El cliente de Firestore no se crea al importar: 'db' es un ClientePorProceso
+que lo crea la primera vez que se usa en cada proceso. Con gunicorn
+--preload el maestro importa la app antes de hacer fork, y un canal gRPC
+creado antes del fork no se puede usar desde los workers. Tampoco se importa
+el SDK (firebase_admin.firestore, lo más lento del arranque) hasta la
+primera llamada que lo necesita.
+
+Opciones del canal gRPC (variables de entorno):
+
+    FIRESTORE_KEEPALIVE_MS     ping de keepalive del canal (por defecto 30000)
+    FIRESTORE_MAX_MENSAJE_MB   tamaño máximo de mensaje enviado y recibido
+                               (por defecto sin límite, como la librería)
+    FIRESTORE_CANALES          canales gRPC por proceso, cada uno con su
+                               conexión; las llamadas se reparten por turnos
+                               (por defecto 1)
+
+Un canal es una conexión HTTP/2 que lleva muchas llamadas a la vez, pero el
+servidor limita las simultáneas por conexión (unas 100). Con GUNICORN_HILOS
+hilos por worker un canal basta; FIRESTORE_CANALES sirve si se suben mucho
+los hilos. El cliente asíncrono (FIRESTORE_ASINCRONO) usa siempre un canal:
+reparte sus lotes en él y el transporte de la librería no admite otro tipo
+de canal.
+
+Cada llamada al motor (con su forma, documentos y duración) se avisa a las
+funciones registradas con observar_llamadas(): las métricas de metricas.py
+y el perfil de perfil.py. En Firestore lo hacen interceptores sobre el
+canal gRPC y en el motor en memoria el propio motor.
+"""
+import importlib
+import itertools
+import os
+import re
+import threading
+import time
+
+BACKENDS = ("firestore", "memoria")
+
+RUTA_CREDENCIALES = "serviceAccountKey.json"
+
+
+def nombre_backend():
+    nombre = os.environ.get("BACKEND_DATOS", "firestore").strip().lower()
+    if nombre not in BACKENDS:
+        raise ValueError(
+            f"BACKEND_DATOS='{nombre}' no es válido. Opciones: {', '.join(BACKENDS)}"
+        )
+    return nombre
+
+
+class ClientePorProceso:
+    """Delega en un cliente que se crea al primer uso, uno por proceso.
+
+    Tras un fork el proceso hijo crea el suyo en lugar de heredar el del
+    padre. Con recrear_tras_fork=False se conserva (el motor en memoria no
+    tiene conexiones y sus datos deben seguir ahí).
+    """
+
+    def __init__(self, crear, recrear_tras_fork=True):
+        self._crear = crear
+        self._recrear_tras_fork = recrear_tras_fork
+        self._lock = threading.Lock()
+        self._pid = None
+        self._cliente = None
+
+    def obtener(self):
+        pid = os.getpid()
+        if self._cliente is None or (self._recrear_tras_fork and self._pid != pid):
+            with self._lock:
+                if self._cliente is None or (self._recrear_tras_fork and self._pid != pid):
+                    self._cliente = self._crear()
+                    self._pid = pid
+        return self._cliente
+
+    def reiniciar(self):
+        """Descarta el cliente actual; el siguiente uso crea otro."""
+        with self._lock:
+            self._cliente = None
+            self._pid = None
+
+    def __getattr__(self, nombre):
+        return getattr(self.obtener(), nombre)
+
+
+class ModuloPerezoso:
+    """Importa el módulo la primera vez que se accede a uno de sus
+    atributos."""
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        return getattr(self._modulo, atributo)
+
+
+# ---------- RUTAS DE CAMPOS ---------- #
+
+_SEGMENTO_SIMPLE = re.compile(r"[_a-zA-Z][_a-zA-Z0-9]*")
+
+
+def ruta_campo(*partes):
+    """Ruta de campo de Firestore ("pesos.`2024`") a partir de sus partes.
+    Las que no son identificadores simples (empiezan por un dígito, llevan
+    guiones...) van entre comillas invertidas, como hace FieldPath sin
+    tener que importar el SDK."""
+    segmentos = []
+    for parte in partes:
+        if _SEGMENTO_SIMPLE.fullmatch(parte):
+            segmentos.append(parte)
+        else:
+            segmentos.append("`" + parte.replace("\\", "\\\\").replace("`", "\\`") + "`")
+    return ".".join(segmentos)
+
+
+# ---------- LLAMADAS AL MOTOR ---------- #
+
+# Funciones a las que se avisa de cada llamada (RPC) al motor con
+# (tipo, forma, documentos, segundos):
+#   tipo        "lectura", "consulta", "escritura" u "otra"
+#   forma       la llamada sin valores: "RunQuery notas where id_usuario == ..."
+#   documentos  documentos leídos, recibidos o escritos
+#   segundos    hasta la respuesta (en consultas, hasta el último documento)
+_observadores = []
+
+
+def observar_llamadas(funcion):
+    _observadores.append(funcion)
+
+
+def _notificar(tipo, forma, documentos, segundos):
+    for observador in _observadores:
+        observador(tipo, forma, documentos, segundos)
+
+
+def coleccion_de(ruta):
+    """'notas/abc' -> 'notas'; 'usuarios/u1/fotos/f1' -> 'usuarios/fotos'."""
+    return "/".join(ruta.split("/")[0:-1:2])
+
+
+def forma_consulta(coleccion, filtros, ordenes, limite):
+    """Forma de una consulta: colección, campos filtrados con su operador y
+    orden, sin los valores. Dos consultas con la misma forma solo se
+    diferencian en los valores."""
+    forma = f"RunQuery {coleccion}"
+    if filtros:
+        forma += " where " + ", ".join(f"{campo} {op}" for campo, op in filtros)
+    if ordenes:
+        forma += " order " + ", ".join(f"{campo} {direccion}" for campo, direccion in ordenes)
+    if limite:
+        forma += " limit"
+    return forma
+
+
+_RPC_LECTURA = "/google.firestore.v1.Firestore/BatchGetDocuments"
+_RPC_CONSULTA = "/google.firestore.v1.Firestore/RunQuery"
+_RPC_ESCRITURA = "/google.firestore.v1.Firestore/Commit"
+
+_TIPOS_RPC = {_RPC_LECTURA: "lectura", _RPC_CONSULTA: "consulta", _RPC_ESCRITURA: "escritura"}
+
+# Operadores de los filtros de una consulta como se escriben en where()
+_OPERADORES = {
+    "EQUAL": "==", "NOT_EQUAL": "!=", "LESS_THAN": "<", "LESS_THAN_OR_EQUAL": "<=",
+    "GREATER_THAN": ">", "GREATER_THAN_OR_EQUAL": ">=", "IN": "in", "NOT_IN": "not-in",
+    "ARRAY_CONTAINS": "array_contains", "ARRAY_CONTAINS_ANY": "array_contains_any",
+    "IS_NAN": "== nan", "IS_NULL": "== null", "IS_NOT_NAN": "!= nan", "IS_NOT_NULL": "!= null",
+}
+
+
+def _ruta_documento(nombre):
+    return nombre.split("/documents/", 1)[-1]
+
+
+def _filtros(filtro):
+    if "composite_filter" in filtro:
+        return [f for hijo in filtro.composite_filter.filters for f in _filtros(hijo)]
+    if "field_filter" in filtro:
+        f = filtro.field_filter
+        return [(f.field.field_path, _OPERADORES.get(f.op.name, f.op.name))]
+    if "unary_filter" in filtro:
+        f = filtro.unary_filter
+        return [(f.field.field_path, _OPERADORES.get(f.op.name, f.op.name))]
+    return []
+
+
+def _forma_rpc(metodo, peticion):
+    if metodo == _RPC_CONSULTA:
+        q = peticion.structured_query
+        return forma_consulta(
+            q.from_[0].collection_id if q.from_ else "",
+            _filtros(q.where) if "where" in q else [],
+            [(o.field.field_path, o.direction.name) for o in q.order_by],
+            "limit" in q,
+        )
+    if metodo == _RPC_LECTURA:
+        rutas = peticion.documents
+    elif metodo == _RPC_ESCRITURA:
+        rutas = [w.update.name if "update" in w else (w.delete or w.transform.document)
+                 for w in peticion.writes]
+    else:
+        rutas = []
+    nombre = metodo.rsplit("/", 1)[-1]
+    colecciones = sorted({coleccion_de(_ruta_documento(r)) for r in rutas})
+    return f"{nombre} {', '.join(colecciones)}" if colecciones else nombre
+
+
+def _documentos_respuesta(metodo, respuesta):
+    # Cada documento de un BatchGet (exista o no) se cobra como una lectura;
+    # de una consulta, cada documento que llega
+    if metodo == _RPC_LECTURA:
+        return 1
+    if metodo == _RPC_CONSULTA and "document" in respuesta:
+        return 1
+    return 0
+
+
+class _LlamadaEnCurso:
+    """Acumula los documentos de una llamada y la avisa una sola vez."""
+
+    def __init__(self, detalles, peticion):
+        metodo = detalles.method
+        self.metodo = metodo.decode() if isinstance(metodo, bytes) else metodo
+        self.peticion = peticion
+        self.documentos = len(peticion.writes) if self.metodo == _RPC_ESCRITURA else 0
+        self.inicio = time.perf_counter()
+        self.avisada = False
+
+    def respuesta(self, respuesta):
+        self.documentos += _documentos_respuesta(self.metodo, respuesta)
+
+    def terminar(self):
+        if not self.avisada and _observadores:
+            self.avisada = True
+            _notificar(_TIPOS_RPC.get(self.metodo, "otra"), _forma_rpc(self.metodo, self.peticion),
+                       self.documentos, time.perf_counter() - self.inicio)
+
+
+def _interceptar(canal):
+    """Envuelve un canal gRPC síncrono para avisar de sus llamadas."""
+    import grpc
+
+    class Respuestas:
+        # Iterador de respuestas que las va contando y se comporta como la
+        # llamada original para todo lo demás
+        def __init__(self, llamada, en_curso):
+            self._llamada = llamada
+            self._en_curso = en_curso
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            try:
+                respuesta = next(self._llamada)
+            except StopIteration:
+                self._en_curso.terminar()
+                raise
+            self._en_curso.respuesta(respuesta)
+            return respuesta
+
+        def __getattr__(self, nombre):
+            return getattr(self._llamada, nombre)
+
+        def __del__(self):
+            # Consulta que no se leyó hasta el final
+            self._en_curso.terminar()
+
+    class Interceptor(grpc.UnaryUnaryClientInterceptor, grpc.UnaryStreamClientInterceptor):
+        def intercept_unary_unary(self, continuacion, detalles, peticion):
+            en_curso = _LlamadaEnCurso(detalles, peticion)
+            try:
+                return continuacion(detalles, peticion)
+            finally:
+                en_curso.terminar()
+
+        def intercept_unary_stream(self, continuacion, detalles, peticion):
+            en_curso = _LlamadaEnCurso(detalles, peticion)
+            return Respuestas(continuacion(detalles, peticion), en_curso)
+
+    return grpc.intercept_channel(canal, Interceptor())
+
+
+def _interceptores_asincronos():
+    """Interceptores equivalentes para un canal grpc.aio (se pasan al
+    crearlo)."""
+    from grpc import aio
+
+    class Unario(aio.UnaryUnaryClientInterceptor):
+        async def intercept_unary_unary(self, continuacion, detalles, peticion):
+            en_curso = _LlamadaEnCurso(detalles, peticion)
+            try:
+                llamada = await continuacion(detalles, peticion)
+                await llamada
+                return llamada
+            finally:
+                en_curso.terminar()
+
+    class Flujo(aio.UnaryStreamClientInterceptor):
+        async def intercept_unary_stream(self, continuacion, detalles, peticion):
+            en_curso = _LlamadaEnCurso(detalles, peticion)
+            llamada = await continuacion(detalles, peticion)
+
+            async def respuestas():
+                try:
+                    async for respuesta in llamada:
+                        en_curso.respuesta(respuesta)
+                        yield respuesta
+                finally:
+                    en_curso.terminar()
+
+            return respuestas()
+
+    return [Unario(), Flujo()]
+
+
+# ---------- CLIENTES ---------- #
+
+# Versión mayor de google-cloud-firestore con la que se ha probado la
+# sustitución de _firestore_api_helper (interno de la librería). Con otra se
+# usa el cliente tal cual. requirements.txt la fija
+VERSION_MAYOR_FIRESTORE = 2
+
+
+def _opciones_canal(conexion_propia=False):
+    # Mismas opciones por defecto que la librería: sin límite de tamaño de
+    # mensaje (gRPC limitaría a 4 MiB lo recibido: lecturas por lotes
+    # grandes, trozos de dibujos)
+    max_mensaje = os.environ.get("FIRESTORE_MAX_MENSAJE_MB")
+    max_bytes = int(max_mensaje) * 1024 * 1024 if max_mensaje else -1
+    opciones = [
+        ("grpc.keepalive_time_ms", int(os.environ.get("FIRESTORE_KEEPALIVE_MS", 30000))),
+        ("grpc.max_send_message_length", max_bytes),
+        ("grpc.max_receive_message_length", max_bytes),
+    ]
+    if conexion_propia:
+        # Sin esto gRPC reutiliza la conexión de otro canal con las mismas
+        # opciones y todos los canales irían por la misma
+        opciones.append(("grpc.use_local_subchannel_pool", 1))
+    return opciones
+
+
+def _numero_canales():
+    return max(int(os.environ.get("FIRESTORE_CANALES", 1)), 1)
+
+
+def _canal_repartido(canales):
+    """Un grpc.Channel que reparte cada llamada entre 'canales' por turnos."""
+    import grpc
+
+    turno = itertools.count()
+
+    class Llamable:
+        # Un multicallable por canal; se elige en cada llamada
+        def __init__(self, llamables):
+            self._llamables = llamables
+
+        def _elegir(self):
+            return self._llamables[next(turno) % len(self._llamables)]
+
+        def __call__(self, *args, **kwargs):
+            return self._elegir()(*args, **kwargs)
+
+        def with_call(self, *args, **kwargs):
+            return self._elegir().with_call(*args, **kwargs)
+
+        def future(self, *args, **kwargs):
+            return self._elegir().future(*args, **kwargs)
+
+    def repartir(tipo):
+        def crear(self, metodo, *args, **kwargs):
+            # grpc.intercept_channel lo pide en cada llamada: se reutiliza
+            clave = (tipo, metodo)
+            if clave not in self._llamables:
+                self._llamables[clave] = Llamable(
+                    [getattr(c, tipo)(metodo, *args, **kwargs) for c in canales])
+            return self._llamables[clave]
+        return crear
+
+    class Canal(grpc.Channel):
+        def __init__(self):
+            self._llamables = {}
+
+        unary_unary = repartir("unary_unary")
+        unary_stream = repartir("unary_stream")
+        stream_unary = repartir("stream_unary")
+        stream_stream = repartir("stream_stream")
+
+        def subscribe(self, callback, try_to_connect=False):
+            for c in canales:
+                c.subscribe(callback, try_to_connect)
+
+        def unsubscribe(self, callback):
+            for c in canales:
+                c.unsubscribe(callback)
+
+        def close(self):
+            for c in canales:
+                c.close()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            self.close()
+            return False
+
+    return Canal()
+
+
+def _admite_canal_propio(clase):
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        mayor = int(version("google-cloud-firestore").split(".")[0])
+    except (PackageNotFoundError, ValueError):
+        return False
+    return (mayor == VERSION_MAYOR_FIRESTORE
+            and callable(getattr(clase, "_firestore_api_helper", None)))
+
+
+def _credenciales():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    # Inicializar Firebase solo una vez
+    # Asegúrate de que el archivo serviceAccountKey.json esté en la misma carpeta
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(RUTA_CREDENCIALES))
+
+    # Credenciales propias de cada cliente: así el token tampoco se comparte
+    # entre procesos
+    cred = credentials.Certificate(RUTA_CREDENCIALES)
+    return cred.get_credential(), cred.project_id
+
+
+def _crear_cliente_firestore(clase):
+    cred, proyecto = _credenciales()
+    if not _admite_canal_propio(clase):
+        print("AVISO: versión de google-cloud-firestore no probada: se usa su canal "
+              "por defecto, sin las opciones FIRESTORE_* ni las llamadas observadas")
+        return clase(project=proyecto, credentials=cred)
+
+    # Igual que el cliente de la librería, pero el canal gRPC se crea con
+    # _opciones_canal() en lugar de las opciones fijas y cuenta documentos
+    class Cliente(clase):
+        def _firestore_api_helper(self, transport, client_class, client_module):
+            if self._firestore_api_internal is None:
+                asincrono = "AsyncIO" in transport.__name__
+                if self._emulator_host is not None:
+                    canal = self._emulator_channel(transport)
+                elif asincrono:
+                    canal = transport.create_channel(
+                        self._target, credentials=self._credentials,
+                        options=_opciones_canal(), interceptors=_interceptores_asincronos()
+                    )
+                else:
+                    n = _numero_canales()
+                    canales = [
+                        transport.create_channel(
+                            self._target, credentials=self._credentials,
+                            options=_opciones_canal(conexion_propia=n > 1)
+                        )
+                        for _ in range(n)
+                    ]
+                    canal = canales[0] if n == 1 else _canal_repartido(canales)
+                if not asincrono:
+                    canal = _interceptar(canal)
+                self._transport = transport(host=self._target, channel=canal)
+                self._firestore_api_internal = client_class(
+                    transport=self._transport, client_options=self._client_options
+                )
+                client_module._client_info = self._client_info
+            return super()._firestore_api_helper(transport, client_class, client_module)
+
+    return Cliente(project=proyecto, credentials=cred)
+
+
+def _crear_firestore():
+    firestore = ModuloPerezoso("firebase_admin.firestore")
+    return ClientePorProceso(lambda: _crear_cliente_firestore(firestore.Client)), firestore
+
+
+def _crear_memoria():
+    import backend_memoria
+
+    def crear():
+        cliente = backend_memoria.client()
+        cliente.observador = _notificar
+        return cliente
+
+    return ClientePorProceso(crear, recrear_tras_fork=False), backend_memoria
+
+
+def obtener_backend():
+    if nombre_backend() == "memoria":
+        return _crear_memoria()
+    return _crear_firestore()
+
+
+def obtener_cliente_asincrono(db):
+    """Cliente asíncrono sobre los mismos datos que 'db'. Debe crearse dentro
+    del bucle de eventos que lo va a usar."""
+    if nombre_backend() == "memoria":
+        from backend_memoria import AsyncClient
+        return AsyncClient(db)
+
+    from google.cloud.firestore import AsyncClient
+    return _crear_cliente_firestore(AsyncClient)
+
+
+def error_no_encontrado():
+    """Clase de excepción que lanza el motor al actualizar un documento que
+    no existe. Se llama en el propio except, no al importar: con Firestore
+    importa google.api_core y con él grpc."""
+    if nombre_backend() == "memoria":
+        from backend_memoria import NotFound
+    else:
+        from google.api_core.exceptions import NotFound
+    return NotFound
+
+
+def error_precondicion():
+    """Clase de excepción que lanza el motor cuando no se cumple la
+    precondición de una escritura (write_option(last_update_time=...))."""
+    if nombre_backend() == "memoria":
+        from backend_memoria import FailedPrecondition
+    else:
+        from google.api_core.exceptions import FailedPrecondition
+    return FailedPrecondition
@@ -0,0 +1,779 @@
+"""
+Motor de datos en memoria con la misma forma que el cliente de Firestore.
+
+Implementa solo el subconjunto de la API que usa firestore.py (colecciones,
+consultas con where/order_by/limit, documentos, lotes, transacciones y los
+valores especiales como SERVER_TIMESTAMP), de modo que la aplicación pueda
+ejecutarse y medirse sin credenciales ni red.
+
+Se activa con la variable de entorno BACKEND_DATOS=memoria (ver backend.py).
+"""
+import copy
+import functools
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from backend import _SEGMENTO_SIMPLE, coleccion_de, forma_consulta
+
+
+# ---------- VALORES ESPECIALES ---------- #
+
+class _Centinela:
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def __repr__(self):
+        return self.nombre
+
+
+SERVER_TIMESTAMP = _Centinela("SERVER_TIMESTAMP")
+DELETE_FIELD = _Centinela("DELETE_FIELD")
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class ArrayRemove:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+# ---------- ERRORES ---------- #
+
+class NotFound(Exception):
+    pass
+
+
+class AlreadyExists(Exception):
+    pass
+
+
+class FailedPrecondition(Exception):
+    pass
+
+
+# ---------- UTILIDADES ---------- #
+
+def _ahora():
+    return datetime.now(timezone.utc)
+
+
+def _nuevo_id():
+    return uuid.uuid4().hex[:20]
+
+
+def _forma_rpc(nombre, refs):
+    # Misma forma que avisan los interceptores de backend.py
+    colecciones = sorted({coleccion_de(ref.path) for ref in refs})
+    return f"{nombre} {', '.join(colecciones)}" if colecciones else nombre
+
+
+@functools.lru_cache(maxsize=4096)
+def _partes_ruta(ruta):
+    """Partes de una ruta de campo con la misma sintaxis que Firestore: las
+    que no son identificadores simples tienen que ir entre comillas
+    invertidas ("pesos.`2024`"); si no, ValueError como el SDK."""
+    partes, i = [], 0
+    while True:
+        if ruta.startswith("`", i):
+            parte, i = [], i + 1
+            while i < len(ruta) and ruta[i] != "`":
+                if ruta[i] == "\\":
+                    i += 1
+                parte.append(ruta[i:i + 1])
+                i += 1
+            if i >= len(ruta):
+                raise ValueError(f"Path {ruta} not consumed, residue: {ruta}")
+            partes.append("".join(parte))
+            i += 1
+        else:
+            simple = _SEGMENTO_SIMPLE.match(ruta, i)
+            if simple is None:
+                raise ValueError(f"Path {ruta} not consumed, residue: {ruta[i:]}")
+            partes.append(simple.group())
+            i = simple.end()
+        if i == len(ruta):
+            return tuple(partes)
+        if ruta[i] != ".":
+            raise ValueError(f"Path {ruta} not consumed, residue: {ruta[i:]}")
+        i += 1
+
+
+def _resolver_campo(data, ruta):
+    actual = data
+    for parte in _partes_ruta(ruta):
+        if not isinstance(actual, dict) or parte not in actual:
+            raise KeyError(ruta)
+        actual = actual[parte]
+    return actual
+
+
+def _aplicar_valor(destino, clave, valor, ahora):
+    """Escribe 'valor' en destino[clave] resolviendo los valores especiales."""
+    if valor is DELETE_FIELD:
+        destino.pop(clave, None)
+    elif valor is SERVER_TIMESTAMP:
+        destino[clave] = ahora
+    elif isinstance(valor, Increment):
+        anterior = destino.get(clave)
+        if not isinstance(anterior, (int, float)) or isinstance(anterior, bool):
+            anterior = 0
+        destino[clave] = anterior + valor.value
+    elif isinstance(valor, ArrayUnion):
+        actual = destino.get(clave)
+        actual = list(actual) if isinstance(actual, list) else []
+        for v in valor.values:
+            if v not in actual:
+                actual.append(v)
+        destino[clave] = actual
+    elif isinstance(valor, ArrayRemove):
+        actual = destino.get(clave)
+        actual = list(actual) if isinstance(actual, list) else []
+        destino[clave] = [v for v in actual if v not in valor.values]
+    elif isinstance(valor, dict):
+        destino[clave] = _materializar(valor, ahora)
+    else:
+        destino[clave] = copy.deepcopy(valor)
+
+
+def _materializar(data, ahora, base=None):
+    resultado = base if base is not None else {}
+    for clave, valor in data.items():
+        _aplicar_valor(resultado, clave, valor, ahora)
+    return resultado
+
+
+def _fusionar(destino, data, ahora):
+    """set(..., merge=True): los mapas anidados se fusionan en lugar de
+    reemplazarse."""
+    for clave, valor in data.items():
+        if isinstance(valor, dict) and isinstance(destino.get(clave), dict):
+            _fusionar(destino[clave], valor, ahora)
+        else:
+            _aplicar_valor(destino, clave, valor, ahora)
+
+
+def _actualizar_rutas(destino, cambios, ahora):
+    """update(): las claves con puntos se interpretan como rutas anidadas."""
+    for ruta, valor in cambios.items():
+        partes = _partes_ruta(ruta)
+        actual = destino
+        for parte in partes[:-1]:
+            if not isinstance(actual.get(parte), dict):
+                actual[parte] = {}
+            actual = actual[parte]
+        _aplicar_valor(actual, partes[-1], valor, ahora)
+
+
+def _orden_tipo(valor):
+    # Orden entre tipos equivalente al de Firestore para los casos habituales
+    if valor is None:
+        return (0, 0)
+    if isinstance(valor, bool):
+        return (1, valor)
+    if isinstance(valor, (int, float)):
+        return (2, valor)
+    if isinstance(valor, datetime):
+        return (3, valor)
+    if isinstance(valor, str):
+        return (4, valor)
+    if isinstance(valor, bytes):
+        return (5, valor)
+    if isinstance(valor, DocumentReference):
+        return (6, valor.path)
+    return (7, repr(valor))
+
+
+def _comparar(op, actual, valor):
+    if op == "==":
+        return actual == valor
+    if op == "!=":
+        return actual != valor and actual is not None
+    if op == "in":
+        return actual in valor
+    if op == "not-in":
+        return actual not in valor and actual is not None
+    if op == "array-contains":
+        return isinstance(actual, list) and valor in actual
+    if op == "array-contains-any":
+        return isinstance(actual, list) and any(v in actual for v in valor)
+
+    a, b = _orden_tipo(actual), _orden_tipo(valor)
+    if a[0] != b[0]:
+        return False
+    if op == "<":
+        return a < b
+    if op == "<=":
+        return a <= b
+    if op == ">":
+        return a > b
+    if op == ">=":
+        return a >= b
+    raise ValueError(f"Operador no soportado: {op}")
+
+
+# ---------- DOCUMENTOS ---------- #
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, create_time=None, update_time=None,
+                 read_time=None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        return copy.deepcopy(self._data)
+
+    def get(self, campo):
+        if self._data is None:
+            return None
+        return copy.deepcopy(_resolver_campo(self._data, campo))
+
+
+class DocumentReference:
+    def __init__(self, cliente, ruta_coleccion, id_doc):
+        self._cliente = cliente
+        self._ruta_coleccion = ruta_coleccion
+        self.id = id_doc
+
+    @property
+    def path(self):
+        return f"{self._ruta_coleccion}/{self.id}"
+
+    @property
+    def parent(self):
+        return CollectionReference(self._cliente, self._ruta_coleccion)
+
+    def __eq__(self, otro):
+        return isinstance(otro, DocumentReference) and otro.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    def collection(self, nombre):
+        return CollectionReference(self._cliente, f"{self.path}/{nombre}")
+
+    def get(self, field_paths=None, transaction=None):
+        inicio = time.perf_counter()
+        snapshot = self._cliente._leer(self, field_paths)
+        self._cliente._contar("lecturas", 1, _forma_rpc("BatchGetDocuments", [self]), inicio)
+        return snapshot
+
+    def set(self, data, merge=False):
+        self._cliente._escribir_contando([("set", self, data, merge)])
+
+    def create(self, data):
+        self._cliente._escribir_contando([("create", self, data, None)])
+
+    def update(self, data, option=None):
+        self._cliente._escribir_contando([("update", self, data, option)])
+
+    def delete(self, option=None):
+        self._cliente._escribir_contando([("delete", self, None, option)])
+
+
+# ---------- CONSULTAS ---------- #
+
+class Query:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+    def __init__(self, cliente, ruta_coleccion, filtros=(), ordenes=(),
+                 limite=None, despues_de=None, campos=None):
+        self._cliente = cliente
+        self._ruta_coleccion = ruta_coleccion
+        self._filtros = tuple(filtros)
+        self._ordenes = tuple(ordenes)
+        self._limite = limite
+        self._despues_de = despues_de
+        self._campos = campos
+
+    def _copiar(self, **cambios):
+        valores = {
+            "filtros": self._filtros,
+            "ordenes": self._ordenes,
+            "limite": self._limite,
+            "despues_de": self._despues_de,
+            "campos": self._campos,
+        }
+        valores.update(cambios)
+        return Query(self._cliente, self._ruta_coleccion, **valores)
+
+    def where(self, field_path, op_string, value):
+        return self._copiar(filtros=self._filtros + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copiar(ordenes=self._ordenes + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copiar(limite=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copiar(despues_de=document_fields_or_snapshot)
+
+    def select(self, field_paths):
+        return self._copiar(campos=list(field_paths))
+
+    def _valor(self, id_doc, data, campo):
+        if campo == "__name__":
+            return DocumentReference(self._cliente, self._ruta_coleccion, id_doc)
+        return _resolver_campo(data, campo)
+
+    def _coincide(self, id_doc, data):
+        for campo, op, valor in self._filtros:
+            try:
+                actual = self._valor(id_doc, data, campo)
+            except KeyError:
+                return False
+            if campo == "__name__":
+                valor = self._normalizar_referencias(valor)
+            if not _comparar(op, actual, valor):
+                return False
+        return True
+
+    def _normalizar_referencias(self, valor):
+        def a_ref(v):
+            if isinstance(v, str):
+                return DocumentReference(self._cliente, self._ruta_coleccion, v)
+            return v
+        if isinstance(valor, (list, tuple)):
+            return [a_ref(v) for v in valor]
+        return a_ref(valor)
+
+    def _clave_orden(self, id_doc, data):
+        clave = []
+        for campo, _ in self._ordenes:
+            clave.append(_orden_tipo(self._valor(id_doc, data, campo)))
+        return clave
+
+    def _resolver(self):
+        registros = self._cliente._documentos(self._ruta_coleccion)
+        candidatos = []
+        campos_orden = [c for c, _ in self._ordenes if c != "__name__"]
+        for id_doc, registro in registros:
+            data = registro["data"]
+            if not self._coincide(id_doc, data):
+                continue
+            # Firestore excluye los documentos sin el campo de ordenación
+            try:
+                for campo in campos_orden:
+                    _resolver_campo(data, campo)
+            except KeyError:
+                continue
+            candidatos.append((id_doc, registro))
+
+        candidatos.sort(key=lambda c: c[0])
+        for campo, direccion in reversed(self._ordenes):
+            candidatos.sort(
+                key=lambda c: _orden_tipo(self._valor(c[0], c[1]["data"], campo)),
+                reverse=direccion == Query.DESCENDING,
+            )
+
+        if self._despues_de is not None:
+            candidatos = self._recortar_cursor(candidatos)
+        if self._limite is not None:
+            candidatos = candidatos[:self._limite]
+        return candidatos
+
+    def _recortar_cursor(self, candidatos):
+        cursor = self._despues_de
+        if isinstance(cursor, DocumentSnapshot):
+            id_cursor = cursor.id
+            data_cursor = cursor._data or {}
+        else:
+            # Cursor por valores: "__name__" puede venir como id o referencia
+            nombre = cursor.get("__name__")
+            id_cursor = getattr(nombre, "id", nombre)
+            data_cursor = cursor
+
+        for i, (id_doc, registro) in enumerate(candidatos):
+            if id_doc == id_cursor:
+                return candidatos[i + 1:]
+        # El documento del cursor ya no está: se compara por valores
+        for i, (id_doc, registro) in enumerate(candidatos):
+            if self._posterior(id_doc, registro["data"], id_cursor, data_cursor):
+                return candidatos[i:]
+        return []
+
+    def _posterior(self, id_doc, data, id_cursor, data_cursor):
+        for campo, direccion in self._ordenes:
+            if campo == "__name__":
+                if id_cursor is None:
+                    return True
+                a, b = id_doc, id_cursor
+            else:
+                a = _orden_tipo(_resolver_campo(data, campo))
+                try:
+                    b = _orden_tipo(_resolver_campo(data_cursor, campo))
+                except KeyError:
+                    return True
+            if a == b:
+                continue
+            return (a < b) if direccion == Query.DESCENDING else (a > b)
+        return id_cursor is not None and id_doc > id_cursor
+
+    def _proyectar(self, data):
+        if self._campos is None:
+            return data
+        proyectado = {}
+        for campo in self._campos:
+            try:
+                valor = _resolver_campo(data, campo)
+            except KeyError:
+                continue
+            _actualizar_rutas(proyectado, {campo: valor}, None)
+        return proyectado
+
+    def _forma(self):
+        return forma_consulta(
+            coleccion_de(f"{self._ruta_coleccion}/_"),
+            [(campo, op) for campo, op, _ in self._filtros],
+            self._ordenes,
+            self._limite is not None,
+        )
+
+    def stream(self, transaction=None):
+        inicio = time.perf_counter()
+        with self._cliente._lock:
+            candidatos = self._resolver()
+            ahora = _ahora()
+            snapshots = [
+                DocumentSnapshot(
+                    DocumentReference(self._cliente, self._ruta_coleccion, id_doc),
+                    copy.deepcopy(self._proyectar(registro["data"])),
+                    registro["create_time"], registro["update_time"], ahora,
+                )
+                for id_doc, registro in candidatos
+            ]
+        # Una consulta vacía también se cobra como una lectura
+        self._cliente._contar("lecturas", max(1, len(snapshots)), self._forma(), inicio,
+                              consulta=True)
+        for s in snapshots:
+            yield s
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class CollectionReference(Query):
+    def __init__(self, cliente, ruta_coleccion):
+        super().__init__(cliente, ruta_coleccion)
+
+    @property
+    def id(self):
+        return self._ruta_coleccion.rsplit("/", 1)[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._cliente, self._ruta_coleccion,
+                                 document_id or _nuevo_id())
+
+    def add(self, document_data, document_id=None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return ref._cliente._leer(ref).update_time, ref
+
+
+# ---------- LOTES Y TRANSACCIONES ---------- #
+
+class WriteBatch:
+    # Mismo límite de operaciones por commit que Firestore
+    MAX_OPERACIONES = 500
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._operaciones = []
+
+    def __len__(self):
+        return len(self._operaciones)
+
+    def _agregar(self, operacion):
+        if len(self._operaciones) >= self.MAX_OPERACIONES:
+            raise ValueError("Un lote admite como máximo 500 operaciones")
+        self._operaciones.append(operacion)
+
+    def set(self, reference, document_data, merge=False):
+        self._agregar(("set", reference, document_data, merge))
+
+    def create(self, reference, document_data):
+        self._agregar(("create", reference, document_data, None))
+
+    # En update y delete el último elemento es la precondición (write_option)
+    def update(self, reference, field_updates, option=None):
+        self._agregar(("update", reference, field_updates, option))
+
+    def delete(self, reference, option=None):
+        self._agregar(("delete", reference, None, option))
+
+    def commit(self):
+        self._cliente._escribir_contando(self._operaciones)
+        self._operaciones = []
+
+
+class Transaction(WriteBatch):
+    def __init__(self, cliente, read_only=False):
+        super().__init__(cliente)
+        self._read_only = read_only
+
+    def _agregar(self, operacion):
+        if self._read_only:
+            raise ValueError("Una transacción de solo lectura no admite escrituras")
+        super()._agregar(operacion)
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def get_all(self, references):
+        return self._cliente.get_all(references, transaction=self)
+
+
+def transactional(to_wrap):
+    """Equivalente a firestore.transactional: ejecuta la función con el
+    almacén bloqueado y aplica sus escrituras al final, todas o ninguna."""
+    @functools.wraps(to_wrap)
+    def envoltura(transaction, *args, **kwargs):
+        cliente = transaction._cliente
+        with cliente._lock:
+            transaction._operaciones = []
+            resultado = to_wrap(transaction, *args, **kwargs)
+            transaction.commit()
+        return resultado
+    return envoltura
+
+
+# ---------- CLIENTE ---------- #
+
+class OpcionEscritura:
+    """Equivalente a client.write_option(): la escritura solo se aplica si
+    el documento existe (exists) o no ha cambiado desde last_update_time."""
+
+    def __init__(self, exists=None, last_update_time=None):
+        self.exists = exists
+        self.last_update_time = last_update_time
+
+    def comprobar(self, ref, registro):
+        if self.exists is True and registro is None:
+            raise NotFound(f"No existe el documento {ref.path}")
+        if self.exists is False and registro is not None:
+            raise AlreadyExists(f"Ya existe el documento {ref.path}")
+        if self.last_update_time is not None and (
+                registro is None or registro["update_time"] != self.last_update_time):
+            raise FailedPrecondition(f"El documento {ref.path} ha cambiado")
+
+
+class Client:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._colecciones = {}
+        self.estadisticas = {}
+        # Función (tipo, forma, documentos, segundos) a la que se avisa cada
+        # llamada, como hacen los interceptores gRPC con Firestore (ver
+        # backend.py)
+        self.observador = None
+
+    def _contar(self, tipo, cantidad, forma, inicio, consulta=False):
+        # Cada llamada equivale a una operación (RPC) contra el almacén
+        with self._lock:
+            e = self.estadisticas
+            e["operaciones"] = e.get("operaciones", 0) + 1
+            e[tipo] = e.get(tipo, 0) + cantidad
+        if self.observador is not None:
+            if tipo == "escrituras":
+                tipo_llamada = "escritura"
+            else:
+                tipo_llamada = "consulta" if consulta else "lectura"
+            self.observador(tipo_llamada, forma, cantidad, time.perf_counter() - inicio)
+
+    def _escribir_contando(self, operaciones):
+        inicio = time.perf_counter()
+        try:
+            self._escribir(operaciones)
+        finally:
+            self._contar("escrituras", len(operaciones),
+                         _forma_rpc("Commit", [op[1] for op in operaciones]), inicio)
+
+    def reiniciar_estadisticas(self):
+        anteriores = self.estadisticas
+        self.estadisticas = {}
+        return anteriores
+
+    def _documentos(self, ruta_coleccion):
+        return list(self._colecciones.get(ruta_coleccion, {}).items())
+
+    def _leer(self, ref, field_paths=None):
+        with self._lock:
+            registro = self._colecciones.get(ref._ruta_coleccion, {}).get(ref.id)
+            if registro is None:
+                return DocumentSnapshot(ref, None, read_time=_ahora())
+            data = copy.deepcopy(registro["data"])
+            if field_paths is not None:
+                data = Query(self, ref._ruta_coleccion, campos=list(field_paths))._proyectar(data)
+            return DocumentSnapshot(ref, data, registro["create_time"],
+                                    registro["update_time"], _ahora())
+
+    def _escribir(self, operaciones):
+        """Aplica las operaciones de forma atómica: si alguna falla (o no se
+        cumple la precondición de un update o delete) no se guarda ninguna."""
+        with self._lock:
+            ahora = _ahora()
+            cambios = {}
+
+            def registro_de(ref):
+                clave = (ref._ruta_coleccion, ref.id)
+                if clave not in cambios:
+                    actual = self._colecciones.get(ref._ruta_coleccion, {}).get(ref.id)
+                    cambios[clave] = copy.deepcopy(actual)
+                return clave, cambios[clave]
+
+            for tipo, ref, data, merge in operaciones:
+                clave, registro = registro_de(ref)
+                if tipo in ("update", "delete") and merge is not None:
+                    merge.comprobar(ref, registro)
+                if tipo == "delete":
+                    cambios[clave] = None
+                    continue
+                if tipo == "create" and registro is not None:
+                    raise AlreadyExists(f"Ya existe el documento {ref.path}")
+                if tipo == "update" and registro is None:
+                    raise NotFound(f"No existe el documento {ref.path}")
+
+                if registro is None:
+                    registro = {"data": {}, "create_time": ahora}
+                if tipo == "update":
+                    _actualizar_rutas(registro["data"], data, ahora)
+                elif tipo == "set" and merge:
+                    _fusionar(registro["data"], data, ahora)
+                else:
+                    registro["data"] = _materializar(data, ahora)
+                registro["update_time"] = ahora
+                cambios[clave] = registro
+
+            for (ruta, id_doc), registro in cambios.items():
+                coleccion = self._colecciones.setdefault(ruta, {})
+                if registro is None:
+                    coleccion.pop(id_doc, None)
+                else:
+                    coleccion[id_doc] = registro
+
+    def collection(self, ruta):
+        return CollectionReference(self, ruta)
+
+    def document(self, ruta):
+        ruta_coleccion, id_doc = ruta.rsplit("/", 1)
+        return DocumentReference(self, ruta_coleccion, id_doc)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        inicio = time.perf_counter()
+        snapshots = [self._leer(ref, field_paths) for ref in references]
+        self._contar("lecturas", len(references), _forma_rpc("BatchGetDocuments", references), inicio)
+        yield from snapshots
+
+    def batch(self):
+        return WriteBatch(self)
+
+    @staticmethod
+    def write_option(**kwargs):
+        return OpcionEscritura(**kwargs)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return Transaction(self, read_only=read_only)
+
+    def collections(self):
+        return [CollectionReference(self, ruta)
+                for ruta in self._colecciones if "/" not in ruta]
+
+
+# ---------- CLIENTE ASÍNCRONO ---------- #
+
+def _sincrono(valor):
+    """Referencia síncrona equivalente (también dentro de listas)."""
+    if isinstance(valor, (list, tuple)):
+        return [_sincrono(v) for v in valor]
+    return getattr(valor, "_sincrona", valor)
+
+
+class AsyncDocumentReference:
+    def __init__(self, sincrona):
+        self._sincrona = sincrona
+
+    def __getattr__(self, nombre):
+        return getattr(self._sincrona, nombre)
+
+    async def get(self, field_paths=None, transaction=None):
+        return self._sincrona.get(field_paths)
+
+
+class AsyncQuery:
+    def __init__(self, sincrona):
+        self._sincrona = sincrona
+
+    def where(self, field_path, op_string, value):
+        return AsyncQuery(self._sincrona.where(field_path, op_string, _sincrono(value)))
+
+    def order_by(self, field_path, direction=Query.ASCENDING):
+        return AsyncQuery(self._sincrona.order_by(field_path, direction))
+
+    def limit(self, count):
+        return AsyncQuery(self._sincrona.limit(count))
+
+    def start_after(self, document_fields_or_snapshot):
+        return AsyncQuery(self._sincrona.start_after(document_fields_or_snapshot))
+
+    def select(self, field_paths):
+        return AsyncQuery(self._sincrona.select(field_paths))
+
+    def document(self, document_id=None):
+        return AsyncDocumentReference(self._sincrona.document(document_id))
+
+    async def stream(self, transaction=None):
+        for d in self._sincrona.stream():
+            yield d
+
+    async def get(self, transaction=None):
+        return self._sincrona.get()
+
+
+class AsyncClient:
+    """Equivalente a firestore.AsyncClient sobre los datos de un Client. Las
+    lecturas no se solapan de verdad (el almacén está en memoria), pero la
+    interfaz es la misma."""
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+
+    def collection(self, ruta):
+        return AsyncQuery(self._cliente.collection(ruta))
+
+    def document(self, ruta):
+        return AsyncDocumentReference(self._cliente.document(ruta))
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        for d in self._cliente.get_all(_sincrono(list(references)), field_paths):
+            yield d
+
+
+def client():
+    return Client()
@@ -0,0 +1,105 @@
+"""
+Benchmark del arranque en frío de la app.
+
+Cada repetición es un proceso de Python nuevo que importa app.py y hace su
+primera petición, su segunda petición y su primera visita a la
+documentación (/apispec_1.json). Se guarda en JSON la mediana, p95 y
+mínimo de cada tiempo y qué módulos pesados quedaron cargados tras el
+import, para detectar regresiones del arranque entre commits.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.arranque --repeticiones 10 --salida arranque.json
+
+Con --backend firestore solo se mide el import y la documentación: las
+peticiones necesitarían credenciales.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from benchmarks.endpoints import commit_actual, percentil
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos cuya carga durante el import de la app es una regresión
+MODULOS_PESADOS = ("firebase_admin", "google.cloud.firestore", "grpc", "flasgger")
+
+# Se ejecuta en cada proceso hijo; imprime un JSON con los tiempos en ms
+_MEDICION = """
+import json, sys, time
+t0 = time.perf_counter()
+from app import app
+tiempos = {"importacion_ms": (time.perf_counter() - t0) * 1000}
+modulos = {m: m in sys.modules for m in MODULOS_PESADOS}
+cliente = app.test_client()
+
+def medir(ruta):
+    t = time.perf_counter()
+    r = cliente.get(ruta)
+    assert r.status_code < 500, (ruta, r.status_code)
+    return (time.perf_counter() - t) * 1000
+
+if PETICIONES:
+    tiempos["primera_peticion_ms"] = medir(RUTA)
+    tiempos["segunda_peticion_ms"] = medir(RUTA)
+tiempos["primera_documentacion_ms"] = medir("/apispec_1.json")
+print(json.dumps({"tiempos": tiempos, "modulos": modulos}))
+"""
+
+
+def medir_proceso(backend, ruta):
+    entorno = dict(os.environ, BACKEND_DATOS=backend)
+    codigo = (f"MODULOS_PESADOS = {MODULOS_PESADOS!r}\n"
+              f"PETICIONES = {backend == 'memoria'!r}\n"
+              f"RUTA = {ruta!r}\n" + _MEDICION)
+    salida = subprocess.run(
+        [sys.executable, "-c", codigo],
+        cwd=RAIZ, env=entorno, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--backend", choices=("memoria", "firestore"), default="memoria")
+    parser.add_argument("--ruta", default="/api/categorias",
+                        help="ruta de la primera petición")
+    parser.add_argument("--salida", default="bench_resultados_arranque.json")
+    args = parser.parse_args(argv)
+
+    medidas = [medir_proceso(args.backend, args.ruta) for _ in range(args.repeticiones)]
+
+    resultados = {}
+    for clave in medidas[0]["tiempos"]:
+        valores = [m["tiempos"][clave] for m in medidas]
+        resultados[clave] = {
+            "p50": round(percentil(valores, 50), 2),
+            "p95": round(percentil(valores, 95), 2),
+            "min": round(min(valores), 2),
+        }
+        print(f"{clave:28s} p50 {resultados[clave]['p50']:>9} ms  "
+              f"p95 {resultados[clave]['p95']:>9} ms  min {resultados[clave]['min']:>9} ms")
+
+    cargados = sorted(m for m, cargado in medidas[0]["modulos"].items() if cargado)
+    print(f"Módulos pesados cargados al importar: {', '.join(cargados) or 'ninguno'}")
+
+    informe = {
+        "commit": commit_actual(),
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "parametros": vars(args),
+        "tiempos": resultados,
+        "modulos_cargados_al_importar": cargados,
+    }
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Benchmark de la compresión de respuestas y del contenido guardado.
+
+Crea notas por la API sobre el motor en memoria, con contenidos de varios
+tamaños y dibujos de trazos, y mide:
+
+  - los bytes enviados por las rutas de notas sin comprimir, con gzip y con
+    brotli (si está instalado) y lo que tarda cada petición;
+  - los bytes que ocupa el contenido en Firestore sin comprimir y con
+    CONTENIDO_COMPRIMIDO_DESDE, y los del dibujo en JSON y en trozos.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.compresion --notas 200 --salida bench_resultados_compresion.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timezone
+
+# El benchmark nunca debe tocar Firestore real
+os.environ["BACKEND_DATOS"] = "memoria"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import firestore  # noqa: E402
+from app import app  # noqa: E402
+from benchmarks.endpoints import commit_actual, percentil  # noqa: E402
+from compresion import CODIFICACIONES  # noqa: E402
+
+USUARIO = "bench_compresion"
+
+VOCABULARIO = """
+reunion proyecto cliente entrega revisar enviar llamar comprar receta
+harina azucar huevos mantequilla horno minutos tarea pendiente viaje hotel
+vuelo maleta pasaporte museo playa idea borrador capitulo resumen examen
+tema apuntes formula ejercicio pagina lunes martes miercoles jueves viernes
+semana manana tarde noche importante urgente recordar correo presupuesto
+factura pago banco medico cita farmacia gimnasio entrenamiento correr
+""".split() + ["de", "la", "el", "en", "y", "que", "para", "con", "los", "las", "del", "por"]
+
+
+# ---------- DATOS ---------- #
+
+def texto(rng, palabras):
+    frases = []
+    while palabras > 0:
+        n = min(palabras, rng.randint(6, 18))
+        frase = " ".join(rng.choice(VOCABULARIO) for _ in range(n))
+        frases.append(frase.capitalize() + ".")
+        palabras -= n
+    return " ".join(frases)
+
+
+def dibujo(rng, trazos, puntos):
+    """Trazos a mano alzada: cada punto se mueve poco respecto al anterior."""
+    resultado = []
+    for _ in range(trazos):
+        x, y = rng.uniform(0, 1080), rng.uniform(0, 1920)
+        recorrido = []
+        for _ in range(rng.randint(puntos // 2, puntos)):
+            x += rng.uniform(-6, 6)
+            y += rng.uniform(-6, 6)
+            recorrido.append([round(x, 1), round(y, 1)])
+        resultado.append({
+            "puntos": recorrido,
+            "color": rng.choice(["#000000", "#1E88E5", "#E53935", "#43A047"]),
+            "grosor": rng.choice([2, 4, 8]),
+        })
+    return resultado
+
+
+def sembrar(cliente, args, rng):
+    ids = []
+    for n in range(args.notas):
+        # La mayoría de notas son cortas; unas pocas son muy largas
+        palabras = int(rng.paretovariate(1.2) * args.palabras)
+        cuerpo = {
+            "id_usuario": USUARIO,
+            "id_plantilla": "plantilla_basica",
+            "titulo": f"Nota {n}",
+            "contenido": texto(rng, palabras),
+            "categoria_nombre": "Benchmark",
+        }
+        if rng.random() < args.con_dibujo:
+            cuerpo["dibujo"] = dibujo(rng, rng.randint(1, args.trazos), args.puntos)
+        r = cliente.post("/api/notas/nueva", json=cuerpo)
+        assert r.status_code == 200, r.get_data(as_text=True)
+        ids.append(r.json["id_nota"])
+    return ids
+
+
+# ---------- MEDICIÓN ---------- #
+
+def medir_ruta(cliente, urls, codificacion, cabeceras=None):
+    cabeceras = dict(cabeceras or {}, **{"Accept-Encoding": codificacion})
+    latencias = []
+    enviados = 0
+    for url in urls:
+        t0 = time.perf_counter()
+        r = cliente.get(url, headers=cabeceras)
+        datos = r.get_data()
+        latencias.append((time.perf_counter() - t0) * 1000)
+        assert r.status_code == 200, (url, r.status_code)
+        usada = r.headers.get("Content-Encoding", "identity")
+        assert usada == codificacion or len(datos) < 1024, (url, usada)
+        enviados += len(datos)
+    return {
+        "bytes_por_peticion": round(enviados / len(urls), 1),
+        "p50_ms": round(percentil(latencias, 50), 3),
+        "p95_ms": round(percentil(latencias, 95), 3),
+    }
+
+
+def medir_respuestas(cliente, ids, args, rng):
+    escenarios = {
+        "GET /api/notas/<id_usuario>": ([f"/api/notas/{USUARIO}"], None),
+        "GET /api/notas/<id_usuario> (ndjson)": (
+            [f"/api/notas/{USUARIO}"], {"Accept": "application/x-ndjson"}),
+        "GET /api/notas/<id_usuario> (página resumen)": (
+            [f"/api/notas/{USUARIO}?limit=20&resumen=true"], None),
+        "GET /api/nota/<id_nota>": (
+            [f"/api/nota/{rng.choice(ids)}" for _ in range(args.iteraciones)], None),
+        "GET /api/nota/<id_nota>/dibujo": (
+            [f"/api/nota/{rng.choice(ids)}/dibujo" for _ in range(args.iteraciones)], None),
+    }
+    resultados = {}
+    for nombre, (urls, cabeceras) in escenarios.items():
+        # Las rutas de una sola URL se repiten para tener tiempos estables
+        if len(urls) == 1:
+            urls = urls * max(1, args.iteraciones // 10)
+        por_codificacion = {c: medir_ruta(cliente, urls, c, cabeceras)
+                            for c in ("identity",) + CODIFICACIONES}
+        sin_comprimir = por_codificacion["identity"]["bytes_por_peticion"]
+        for r in por_codificacion.values():
+            r["ahorro"] = round(1 - r["bytes_por_peticion"] / sin_comprimir, 3)
+        resultados[nombre] = por_codificacion
+    return resultados
+
+
+def _bytes_valor(valor):
+    if isinstance(valor, bytes):
+        return len(valor)
+    return len(json.dumps(valor, ensure_ascii=False).encode()) if valor is not None else 0
+
+
+def medir_almacenamiento(ids):
+    notas = firestore.leer_notas(ids)
+    contenido = sum(_bytes_valor(d.to_dict().get("contenido")) for d in notas.values())
+    comprimidas = sum(isinstance(d.to_dict().get("contenido"), bytes) for d in notas.values())
+    infos = [d.to_dict().get("dibujo_info") for d in notas.values()]
+    infos = [i for i in infos if i]
+    return {
+        "contenido_bytes": contenido,
+        "notas_con_contenido_comprimido": comprimidas,
+        "dibujo_json_bytes": sum(i["bytes"] for i in infos),
+        "dibujo_guardado_bytes": sum(i["comprimido"] for i in infos),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--notas", type=int, default=100)
+    parser.add_argument("--palabras", type=int, default=80,
+                        help="palabras mínimas del contenido (la media es unas 6 veces más)")
+    parser.add_argument("--con-dibujo", type=float, default=0.3,
+                        help="fracción de notas con dibujo")
+    parser.add_argument("--trazos", type=int, default=40, help="trazos máximos por dibujo")
+    parser.add_argument("--puntos", type=int, default=120, help="puntos máximos por trazo")
+    parser.add_argument("--umbral", type=int, default=2048,
+                        help="CONTENIDO_COMPRIMIDO_DESDE para la segunda siembra")
+    parser.add_argument("--iteraciones", type=int, default=100)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--salida", default="bench_resultados_compresion.json")
+    args = parser.parse_args(argv)
+
+    cliente = app.test_client()
+
+    # Misma siembra dos veces: contenido sin comprimir y comprimido
+    almacenamiento = {}
+    for nombre, umbral in (("sin_comprimir", 0), ("comprimido", args.umbral)):
+        firestore.CONTENIDO_COMPRIMIDO_DESDE = umbral
+        ids = sembrar(cliente, args, random.Random(args.semilla))
+        almacenamiento[nombre] = medir_almacenamiento(ids)
+        if nombre == "sin_comprimir":
+            for i in ids:
+                firestore.eliminar_nota(i)
+    almacenamiento["ahorro_contenido"] = round(
+        1 - almacenamiento["comprimido"]["contenido_bytes"]
+        / almacenamiento["sin_comprimir"]["contenido_bytes"], 3)
+    print(f"Contenido guardado: {almacenamiento['sin_comprimir']['contenido_bytes']} -> "
+          f"{almacenamiento['comprimido']['contenido_bytes']} bytes "
+          f"({almacenamiento['ahorro_contenido']:.1%} menos)")
+    dibujos = almacenamiento["comprimido"]
+    print(f"Dibujos: {dibujos['dibujo_json_bytes']} bytes en JSON -> "
+          f"{dibujos['dibujo_guardado_bytes']} en trozos")
+
+    respuestas = medir_respuestas(cliente, ids, args, random.Random(args.semilla))
+    for nombre, por_codificacion in respuestas.items():
+        resumen = "  ".join(f"{c} {r['bytes_por_peticion']:>10} B {r['p50_ms']:>7} ms"
+                            for c, r in por_codificacion.items())
+        print(f"{nombre:45s} {resumen}")
+
+    informe = {
+        "commit": commit_actual(),
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "parametros": vars(args),
+        "almacenamiento": almacenamiento,
+        "respuestas": respuestas,
+    }
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+"""
+Benchmark de las rutas de app.py sobre el motor en memoria.
+
+Siembra usuarios con notas, categorías, relaciones y features, recorre cada
+ruta con el cliente de pruebas de Flask y guarda en JSON el rendimiento
+(peticiones/s), la latencia p50/p95/p99 y las operaciones de backend por
+petición, para comparar ejecuciones entre commits.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.endpoints --usuarios 20 --notas 200 --salida bench.json
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+# El benchmark nunca debe tocar Firestore real
+os.environ["BACKEND_DATOS"] = "memoria"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app  # noqa: E402
+from firestore import db  # noqa: E402
+from mantenimiento import (  # noqa: E402
+    compactar_relaciones,
+    migrar_desbloqueos,
+    recalcular_contadores,
+    reconstruir_busqueda,
+    reconstruir_etiquetas,
+)
+
+CATEGORIA_COMPARTIDA = "Favoritos"
+
+
+# ---------- SIEMBRA DE DATOS ---------- #
+
+class _Escritor:
+    """Agrupa escrituras en lotes de 500 operaciones."""
+
+    def __init__(self):
+        self.lote = db.batch()
+        self.pendientes = 0
+
+    def set(self, ref, data):
+        self.lote.set(ref, data)
+        self.pendientes += 1
+        if self.pendientes == 500:
+            self.cerrar()
+
+    def cerrar(self):
+        if self.pendientes:
+            self.lote.commit()
+        self.lote = db.batch()
+        self.pendientes = 0
+
+
+def sembrar(args, rng):
+    escritor = _Escritor()
+    datos = {"usuarios": [], "notas": {}, "categorias": {}}
+
+    compartida = db.collection("categoriaNota").document()
+    escritor.set(compartida, {"nombre": CATEGORIA_COMPARTIDA})
+    datos["compartida"] = compartida.id
+
+    for u in range(args.usuarios):
+        id_usuario = f"bench_usuario_{u}"
+        datos["usuarios"].append(id_usuario)
+        escritor.set(db.collection("usuarios").document(id_usuario),
+                     {"monedas": 10 ** 9})
+
+        categorias = []
+        for c in range(args.categorias):
+            ref = db.collection("categoriaNota").document()
+            escritor.set(ref, {"nombre": f"Categoria {c}", "id_usuario": id_usuario})
+            categorias.append(ref.id)
+        datos["categorias"][id_usuario] = categorias
+
+        notas = []
+        for n in range(args.notas):
+            ref = db.collection("notas").document()
+            escritor.set(ref, {
+                "id_usuario": id_usuario,
+                "id_plantilla": "plantilla_basica",
+                "titulo": f"Nota {n}",
+                "contenido": "lorem ipsum " * rng.randint(5, 60),
+                "etiquetas": rng.sample(["trabajo", "casa", "ideas", "compras", "viaje"], 2),
+                "dibujo": "x" * args.dibujo if args.dibujo else None,
+                "estado": "activa",
+                "favorita": False,
+                "animacion_fondo": None,
+                "color_fondo": None,
+                "fecha_creacion": datetime.now(timezone.utc),
+                "fecha_modificacion": datetime.now(timezone.utc),
+            })
+            notas.append(ref.id)
+
+            # Cada nota tiene una o más relaciones (las repetidas simulan el
+            # historial de cambios de categoría)
+            destinos = [rng.choice(categorias)] if categorias else []
+            destinos += [rng.choice(categorias) for _ in range(args.relaciones - 1)
+                         if categorias]
+            if rng.random() < args.favoritas:
+                destinos.append(datos["compartida"])
+            for id_categoria in destinos:
+                escritor.set(db.collection("notas_categoriaNota").document(),
+                             {"id_nota": ref.id, "id_categoriaNota": id_categoria})
+        datos["notas"][id_usuario] = notas
+
+        for f in range(args.features):
+            nombre = ["font_", "assets/animations/", "multimedia_"][f % 3] + f"bench{f}"
+            escritor.set(db.collection("usuarios_features").document(), {
+                "id_usuario": id_usuario,
+                "feature": nombre,
+                "fecha_compra": datetime.now(timezone.utc),
+            })
+            escritor.set(db.collection("usuarios_plantillas").document(), {
+                "id_usuario": id_usuario,
+                "id_plantilla": f"plantilla_{f}",
+                "fecha_compra": datetime.now(timezone.utc),
+            })
+
+    escritor.cerrar()
+
+    # Las compras sembradas se reflejan en el resumen de desbloqueos
+    migrar_desbloqueos()
+    if args.compactar:
+        compactar_relaciones()
+    recalcular_contadores()
+    reconstruir_busqueda()
+    reconstruir_etiquetas()
+    datos["sembrado"] = datetime.now(timezone.utc).isoformat()
+    return datos
+
+
+# ---------- ESCENARIOS ---------- #
+
+def _usuario(datos, rng):
+    return rng.choice(datos["usuarios"])
+
+
+def _nota(datos, rng):
+    u = _usuario(datos, rng)
+    return u, rng.choice(datos["notas"][u])
+
+
+def _categoria_propia(d, r):
+    u = _usuario(d, r)
+    return "GET", f"/api/notas/categoria/{u}/{r.choice(d['categorias'][u])}", None
+
+
+def _crear_nota(d, r):
+    u = _usuario(d, r)
+    return "POST", "/api/notas/nueva", {
+        "id_usuario": u,
+        "id_plantilla": "plantilla_basica",
+        "titulo": "Nota de benchmark",
+        "contenido": "contenido " * 20,
+        "id_categoriaNota": r.choice(d["categorias"][u]),
+    }
+
+
+def _comprar_feature(d, r):
+    # Una feature nueva en cada petición para medir siempre la compra completa
+    d["compras"] = d.get("compras", 0) + 1
+    return "POST", "/api/usuarios/comprar_feature", {
+        "id_usuario": _usuario(d, r),
+        "feature": f"font_compra{d['compras']}",
+        "costo": 1,
+    }
+
+
+def _sincronizar_lote(d, r):
+    # Reconexión de un cliente offline: 50 ediciones pendientes de golpe
+    u = _usuario(d, r)
+    notas = r.sample(d["notas"][u], min(40, len(d["notas"][u])))
+    operaciones = [{"op": "actualizar", "id_nota": n, "cambios": {"titulo": "Editada offline"}}
+                   for n in notas[:30]]
+    operaciones += [{"op": "obtener", "id_nota": n} for n in notas[30:]]
+    operaciones += [{"op": "crear", "datos": {
+        "id_usuario": u,
+        "id_plantilla": "plantilla_basica",
+        "titulo": "Creada offline",
+        "contenido": "contenido " * 20,
+        "id_categoriaNota": r.choice(d["categorias"][u]),
+    }} for _ in range(10)]
+    return "POST", "/api/notas/batch", {"operaciones": operaciones}
+
+
+# Cada escenario devuelve (método, url, cuerpo_json)
+ESCENARIOS = {
+    "GET /api/notas/<id_usuario>": lambda d, r: (
+        "GET", f"/api/notas/{_usuario(d, r)}", None),
+    "GET /api/notas/<id_usuario> (página resumen)": lambda d, r: (
+        "GET", f"/api/notas/{_usuario(d, r)}?limit=20&resumen=true", None),
+    "GET /api/notas/<id_usuario>/cambios": lambda d, r: (
+        "GET", f"/api/notas/{_usuario(d, r)}/cambios?desde={quote(d['sembrado'])}", None),
+    "GET /api/notas/<id_usuario>/buscar": lambda d, r: (
+        "GET", f"/api/notas/{_usuario(d, r)}/buscar?q={r.choice(['viaje', 'ideas compras'])}",
+        None),
+    "GET /api/nota/<id_nota>": lambda d, r: (
+        "GET", f"/api/nota/{_nota(d, r)[1]}", None),
+    "GET /api/notas/categoria (propia)": _categoria_propia,
+    "GET /api/notas/categoria (compartida)": lambda d, r: (
+        "GET", f"/api/notas/categoria/{_usuario(d, r)}/{d['compartida']}", None),
+    "GET /api/etiquetas/<id_usuario>": lambda d, r: (
+        "GET", f"/api/etiquetas/{_usuario(d, r)}?prefijo=tra", None),
+    "GET /api/categorias": lambda d, r: (
+        "GET", f"/api/categorias?usuarioId={_usuario(d, r)}", None),
+    "GET /api/usuarios/plantillas_desbloqueadas": lambda d, r: (
+        "GET", f"/api/usuarios/plantillas_desbloqueadas/{_usuario(d, r)}", None),
+    "GET /api/usuarios/check_feature": lambda d, r: (
+        "GET", f"/api/usuarios/check_feature/{_usuario(d, r)}/font_bench0", None),
+    "GET /api/usuarios/fonts_unlocked": lambda d, r: (
+        "GET", f"/api/usuarios/fonts_unlocked/{_usuario(d, r)}", None),
+    "GET /api/usuarios/unlocked_backgrounds": lambda d, r: (
+        "GET", f"/api/usuarios/unlocked_backgrounds/{_usuario(d, r)}", None),
+    "GET /api/usuarios/<id_usuario>/entitlements": lambda d, r: (
+        "GET", f"/api/usuarios/{_usuario(d, r)}/entitlements", None),
+    "POST /api/notas/nueva": _crear_nota,
+    "PUT /api/nota/<id_nota>": lambda d, r: (
+        "PUT", f"/api/nota/{_nota(d, r)[1]}", {"titulo": "Título editado"}),
+    "POST /api/usuarios/comprar_feature": _comprar_feature,
+    "POST /api/notas/batch (50 operaciones)": _sincronizar_lote,
+}
+
+
+# ---------- MEDICIÓN ---------- #
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def medir(cliente, nombre, escenario, datos, rng, iteraciones, calentamiento):
+    for _ in range(calentamiento):
+        metodo, url, cuerpo = escenario(datos, rng)
+        cliente.open(url, method=metodo, json=cuerpo)
+
+    latencias = []
+    errores = 0
+    bytes_respuesta = 0
+    db.reiniciar_estadisticas()
+    inicio = time.perf_counter()
+    for _ in range(iteraciones):
+        metodo, url, cuerpo = escenario(datos, rng)
+        t0 = time.perf_counter()
+        resp = cliente.open(url, method=metodo, json=cuerpo)
+        latencias.append((time.perf_counter() - t0) * 1000)
+        bytes_respuesta += len(resp.get_data())
+        if resp.status_code >= 400:
+            errores += 1
+    total = time.perf_counter() - inicio
+    estadisticas = db.reiniciar_estadisticas()
+
+    return {
+        "peticiones": iteraciones,
+        "errores": errores,
+        "peticiones_por_segundo": round(iteraciones / total, 2) if total else None,
+        "media_ms": round(sum(latencias) / len(latencias), 3),
+        "p50_ms": round(percentil(latencias, 50), 3),
+        "p95_ms": round(percentil(latencias, 95), 3),
+        "p99_ms": round(percentil(latencias, 99), 3),
+        "bytes_por_peticion": round(bytes_respuesta / iteraciones, 1),
+        "backend_por_peticion": {
+            clave: round(valor / iteraciones, 2)
+            for clave, valor in sorted(estadisticas.items())
+        },
+    }
+
+
+def commit_actual():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--usuarios", type=int, default=10)
+    parser.add_argument("--notas", type=int, default=100, help="notas por usuario")
+    parser.add_argument("--categorias", type=int, default=5, help="categorías por usuario")
+    parser.add_argument("--relaciones", type=int, default=1,
+                        help="relaciones nota-categoría por nota")
+    parser.add_argument("--favoritas", type=float, default=0.3,
+                        help="fracción de notas en la categoría compartida")
+    parser.add_argument("--dibujo", type=int, default=0,
+                        help="bytes del campo dibujo de cada nota")
+    parser.add_argument("--features", type=int, default=6, help="features compradas por usuario")
+    parser.add_argument("--sin-compactar", dest="compactar", action="store_false",
+                        help="medir con las relaciones sembradas sin compactar "
+                             "(filas repetidas, como los datos antiguos)")
+    parser.add_argument("--iteraciones", type=int, default=200)
+    parser.add_argument("--calentamiento", type=int, default=10)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--rutas", nargs="*", help="subcadenas para filtrar escenarios")
+    parser.add_argument("--salida", default="bench_resultados.json")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.semilla)
+    t0 = time.perf_counter()
+    datos = sembrar(args, rng)
+    print(f"Datos sembrados en {time.perf_counter() - t0:.2f}s")
+
+    cliente = app.test_client()
+    resultados = {}
+    for nombre, escenario in ESCENARIOS.items():
+        if args.rutas and not any(f in nombre for f in args.rutas):
+            continue
+        r = medir(cliente, nombre, escenario, datos, rng,
+                  args.iteraciones, args.calentamiento)
+        resultados[nombre] = r
+        print(f"{nombre:45s} {r['peticiones_por_segundo']:>9} req/s  "
+              f"p50 {r['p50_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  "
+              f"ops {r['backend_por_peticion'].get('operaciones', 0):>7}  "
+              f"lecturas {r['backend_por_peticion'].get('lecturas', 0):>8}")
+
+    informe = {
+        "commit": commit_actual(),
+        "fecha": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "parametros": vars(args),
+        "rutas": resultados,
+    }
+    with open(args.salida, "w", encoding="utf-8") as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Normalización de texto y puntuación para la búsqueda de notas.
+
+Cada nota tiene en notas_busqueda/{id_nota} sus términos ya normalizados y
+cuánto pesa cada uno. Aquí solo está la parte que no toca Firestore: cómo se
+convierte un texto en términos y cómo se ordenan los resultados.
+
+La normalización ignora mayúsculas y tildes ("Canción" y "cancion" son el
+mismo término, también "niño" y "nino"), descarta las palabras vacías más
+comunes del español y reduce los plurales regulares ("reuniones" ->
+"reunion", "notas" -> "nota").
+"""
+import math
+import re
+import unicodedata
+
+# Peso de cada aparición según el campo en el que está
+PESOS_CAMPOS = {"titulo": 3, "etiquetas": 2, "contenido": 1}
+
+# Tope de apariciones que cuentan por término en el contenido, para que
+# repetir una palabra no hunda al resto de resultados
+MAX_APARICIONES = 5
+
+# Tope de términos guardados por nota (los de más peso)
+MAX_TERMINOS_NOTA = 500
+
+# Firestore admite como máximo 30 valores en array-contains-any
+MAX_TERMINOS_CONSULTA = 30
+
+LONGITUD_MINIMA = 2
+
+PALABRAS_VACIAS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuando de del desde
+donde durante e el ella ellas ellos en entre era es esa esas ese eso esos esta
+estas este esto estos fue ha hay la las le les lo los mas me mi mis mucho muy
+ni no nos o os otra otras otro otros para pero poco por porque que quien se
+ser si sin sobre su sus tambien te tiene todo todos tu tus un una unas uno
+unos y ya yo
+""".split())
+
+_PALABRA = re.compile(r"[a-z0-9]+")
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes ni diéresis (la ñ queda como n)."""
+    descompuesto = unicodedata.normalize("NFD", texto.lower())
+    return "".join(c for c in descompuesto if unicodedata.category(c) != "Mn")
+
+
+def _singular(palabra):
+    # Plurales regulares: "reuniones" -> "reunion", "notas" -> "nota".
+    # No es un lematizador; solo evita que singular y plural no coincidan
+    if len(palabra) > 4 and palabra.endswith("es") and palabra[-3] not in "aeiou":
+        return palabra[:-2]
+    if len(palabra) > 3 and palabra.endswith("s") and palabra[-2] in "aeiou":
+        return palabra[:-1]
+    return palabra
+
+
+def terminos(texto):
+    """Lista de términos del texto, en orden y con repeticiones."""
+    if not isinstance(texto, str) or not texto:
+        return []
+    return [
+        _singular(p) for p in _PALABRA.findall(normalizar(texto))
+        if len(p) >= LONGITUD_MINIMA and p not in PALABRAS_VACIAS
+    ]
+
+
+def pesos_nota(titulo=None, contenido=None, etiquetas=None):
+    """{término: peso} de una nota, con como mucho MAX_TERMINOS_NOTA
+    términos."""
+    textos = {
+        "titulo": titulo,
+        "contenido": contenido,
+        "etiquetas": " ".join(e for e in (etiquetas or []) if isinstance(e, str)),
+    }
+
+    pesos = {}
+    for campo, texto in textos.items():
+        apariciones = {}
+        for t in terminos(texto):
+            apariciones[t] = apariciones.get(t, 0) + 1
+        for t, n in apariciones.items():
+            pesos[t] = pesos.get(t, 0) + PESOS_CAMPOS[campo] * min(n, MAX_APARICIONES)
+
+    if len(pesos) > MAX_TERMINOS_NOTA:
+        mayores = sorted(pesos.items(), key=lambda p: (-p[1], p[0]))[:MAX_TERMINOS_NOTA]
+        pesos = dict(mayores)
+    return pesos
+
+
+def terminos_consulta(texto):
+    """Términos distintos de la búsqueda, como mucho MAX_TERMINOS_CONSULTA."""
+    return list(dict.fromkeys(terminos(texto)))[:MAX_TERMINOS_CONSULTA]
+
+
+def ordenar_resultados(candidatos, consulta):
+    """Ordena [(id_nota, {término: peso})] de más a menos relevante.
+
+    Primero las notas que contienen más términos de la búsqueda; entre ellas,
+    la suma de los pesos ponderada por lo raro que es cada término entre los
+    candidatos (un término que aparece en pocas notas discrimina más).
+    Devuelve [(id_nota, puntuación)].
+    """
+    total = len(candidatos)
+    frecuencia = {t: 0 for t in consulta}
+    for _, pesos in candidatos:
+        for t in consulta:
+            if t in pesos:
+                frecuencia[t] += 1
+
+    puntuados = []
+    for id_nota, pesos in candidatos:
+        encontrados = [t for t in consulta if t in pesos]
+        puntuacion = sum(pesos[t] * math.log(1 + total / frecuencia[t]) for t in encontrados)
+        puntuados.append((len(encontrados), round(puntuacion, 4), id_nota))
+
+    puntuados.sort(key=lambda p: (-p[0], -p[1], p[2]))
+    return [(id_nota, puntuacion) for _, puntuacion, id_nota in puntuados]
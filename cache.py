@@ -0,0 +1,49 @@
+"""
+Caché en memoria por proceso (cada worker de gunicorn tiene la suya).
+
+CacheTTL guarda como máximo 'max_entradas' valores; al llenarse expulsa el
+menos usado recientemente y cada entrada caduca a los 'ttl' segundos.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_AUSENTE = object()
+
+
+class CacheTTL:
+    def __init__(self, max_entradas=1024, ttl=60):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave, defecto=None):
+        with self._lock:
+            entrada = self._datos.get(clave, _AUSENTE)
+            if entrada is _AUSENTE:
+                return defecto
+            caduca, valor = entrada
+            if caduca <= time.monotonic():
+                del self._datos[clave]
+                return defecto
+            self._datos.move_to_end(clave)
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def limpiar(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
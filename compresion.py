@@ -0,0 +1,108 @@
+"""
+Compresión de las respuestas de las rutas de notas.
+
+Las notas (contenido y dibujo) se envían como JSON, que se comprime muy
+bien, y en redes móviles es lo que más tarda en llegar. Las respuestas de
+las rutas que empiezan por PREFIJOS_COMPRIMIDOS se comprimen con brotli o
+gzip, según el Accept-Encoding del cliente, si ocupan al menos
+COMPRESION_MIN_BYTES. Las que se envían a medida que se generan (NDJSON)
+se comprimen por partes sin esperar al final.
+
+brotli es opcional: si el paquete no está instalado solo se ofrece gzip.
+Con COMPRESION_RESPUESTAS=0 no se comprime nada (por ejemplo si ya lo hace
+un proxy por delante).
+"""
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+PREFIJOS_COMPRIMIDOS = ("/api/nota",)
+
+# Por debajo de este tamaño la compresión apenas ahorra y cuesta CPU
+COMPRESION_MIN_BYTES = int(os.environ.get("COMPRESION_MIN_BYTES", 1024))
+
+NIVEL_GZIP = 6
+# Calidad media: las más altas de brotli son para contenido estático
+CALIDAD_BROTLI = 5
+
+# Por orden de preferencia cuando el cliente acepta varias por igual
+CODIFICACIONES = ("br", "gzip") if brotli else ("gzip",)
+
+
+def compresion_activa():
+    return os.environ.get("COMPRESION_RESPUESTAS", "1").strip().lower() in ("1", "true", "si")
+
+
+def elegir_codificacion(aceptadas):
+    """Codificación a usar según Accept-Encoding, None si ninguna."""
+    mejor = max(CODIFICACIONES, key=lambda c: aceptadas[c])
+    return mejor if aceptadas[mejor] > 0 else None
+
+
+def compresor(codificacion):
+    """(comprimir, terminar): comprimir(bytes) devuelve lo que ya se puede
+    enviar y terminar() el resto."""
+    if codificacion == "br":
+        c = brotli.Compressor(quality=CALIDAD_BROTLI)
+        return c.process, c.finish
+    c = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress, c.flush
+
+
+def comprimir(datos, codificacion):
+    comprimir_parte, terminar = compresor(codificacion)
+    return comprimir_parte(datos) + terminar()
+
+
+def _comprimir_partes(partes, codificacion):
+    comprimir_parte, terminar = compresor(codificacion)
+    for parte in partes:
+        if isinstance(parte, str):
+            parte = parte.encode()
+        comprimido = comprimir_parte(parte)
+        if comprimido:
+            yield comprimido
+    yield terminar()
+
+
+def _comprimir_respuesta(respuesta):
+    if not compresion_activa() or not request.path.startswith(PREFIJOS_COMPRIMIDOS):
+        return respuesta
+    # Las cachés intermedias deben distinguir la versión comprimida
+    respuesta.vary.add("Accept-Encoding")
+    if (request.method == "HEAD" or respuesta.status_code < 200
+            or respuesta.status_code in (204, 304) or respuesta.direct_passthrough
+            or "Content-Encoding" in respuesta.headers):
+        return respuesta
+
+    codificacion = elegir_codificacion(request.accept_encodings)
+    if codificacion is None:
+        return respuesta
+
+    if respuesta.is_streamed:
+        respuesta.response = _comprimir_partes(respuesta.response, codificacion)
+        respuesta.headers.pop("Content-Length", None)
+    else:
+        datos = respuesta.get_data()
+        if len(datos) < COMPRESION_MIN_BYTES:
+            return respuesta
+        respuesta.set_data(comprimir(datos, codificacion))
+    respuesta.headers["Content-Encoding"] = codificacion
+
+    # Los bytes ya no son los de la respuesta sin comprimir: el ETag pasa a
+    # ser débil, que If-None-Match sigue aceptando
+    etag, debil = respuesta.get_etag()
+    if etag and not debil:
+        respuesta.set_etag(etag, weak=True)
+    return respuesta
+
+
+def registrar(app):
+    """Comprime las respuestas de las rutas de notas de 'app'."""
+    app.after_request(_comprimir_respuesta)
@@ -0,0 +1,152 @@
+"""
+Codificación de los dibujos de las notas.
+
+El dibujo no se guarda dentro del documento de la nota sino repartido en
+trozos en notas/{id_nota}/dibujo (ver firestore.py); la nota solo guarda
+en 'dibujo_info' cuántos trozos ocupa, su tamaño y su hash. Aquí está la
+parte que no toca Firestore: cómo se codifica, se trocea y se comprueba un
+dibujo.
+
+Un dibujo es una serie de segmentos. El primero es el dibujo tal y como se
+guardó la última vez que se sustituyó entero; cada vez que se añaden trazos
+se añade un segmento con solo esos trazos, sin reescribir los anteriores.
+Cada segmento es el JSON compacto del valor comprimido con zlib y ocupa uno
+o varios trozos de como mucho TAMANO_TROZO bytes.
+
+El hash se encadena segmento a segmento, así que al añadir trazos se
+calcula el nuevo sin leer los anteriores:
+    hash_0 = sha256(segmento_0)
+    hash_n = sha256(hash_(n-1) + sha256(segmento_n))
+"""
+import hashlib
+import json
+import os
+import zlib
+
+# Bytes de cada trozo: deja margen hasta el MiB que admite un documento
+TAMANO_TROZO = 768 * 1024
+
+# Tamaño máximo del dibujo comprimido. Por debajo de los 10 MiB que admite
+# un commit de Firestore, para que un dibujo siempre se pueda guardar entero
+MAX_BYTES_DIBUJO = int(os.environ.get("MAX_BYTES_DIBUJO", 8 * 1024 * 1024))
+
+NIVEL_COMPRESION = 6
+
+
+class DibujoNoValido(ValueError):
+    """El valor no se puede guardar o no admite que se le añadan trazos."""
+
+
+class DibujoDemasiadoGrande(ValueError):
+    """El dibujo comprimido supera MAX_BYTES_DIBUJO."""
+
+
+class DibujoCorrupto(Exception):
+    """Los trozos leídos no corresponden al hash de la nota."""
+
+
+def _json(valor):
+    return json.dumps(valor, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def _resumen(datos):
+    return hashlib.sha256(datos).hexdigest()
+
+
+def _encadenar(anterior, resumen):
+    if anterior is None:
+        return resumen
+    return _resumen((anterior + resumen).encode())
+
+
+class Segmento:
+    """Un valor ya codificado, listo para repartir en trozos."""
+
+    def __init__(self, valor):
+        try:
+            texto = _json(valor)
+        except (TypeError, ValueError):
+            raise DibujoNoValido("El dibujo debe ser un valor JSON")
+        self.lista = isinstance(valor, list)
+        self.bytes = len(texto)
+        self.resumen = _resumen(texto)
+        self.datos = zlib.compress(texto, NIVEL_COMPRESION)
+        if len(self.datos) > MAX_BYTES_DIBUJO:
+            raise DibujoDemasiadoGrande(
+                f"El dibujo comprimido ocupa {len(self.datos)} bytes (máximo {MAX_BYTES_DIBUJO})")
+
+    @property
+    def comprimido(self):
+        return len(self.datos)
+
+    def trozos(self):
+        return [self.datos[i:i + TAMANO_TROZO]
+                for i in range(0, len(self.datos), TAMANO_TROZO)]
+
+
+def codificar(valor):
+    """Segmento con 'valor'. Si ya es un Segmento lo devuelve tal cual.
+    Lanza DibujoNoValido o DibujoDemasiadoGrande."""
+    return valor if isinstance(valor, Segmento) else Segmento(valor)
+
+
+def info_dibujo(segmento):
+    """dibujo_info de un dibujo formado solo por 'segmento'."""
+    return {
+        "segmentos": 1,
+        "trozos": len(segmento.trozos()),
+        "bytes": segmento.bytes,
+        "comprimido": segmento.comprimido,
+        "hash": _encadenar(None, segmento.resumen),
+        "lista": segmento.lista,
+    }
+
+
+def anadir_segmento(info, segmento):
+    """dibujo_info después de añadir 'segmento' al dibujo de 'info'. Solo se
+    pueden añadir trazos a un dibujo que sea una lista."""
+    if not info.get("lista") or not segmento.lista:
+        raise DibujoNoValido("Solo se pueden añadir trazos a un dibujo que sea una lista")
+    comprimido = info["comprimido"] + segmento.comprimido
+    if comprimido > MAX_BYTES_DIBUJO:
+        raise DibujoDemasiadoGrande(
+            f"El dibujo comprimido ocuparía {comprimido} bytes (máximo {MAX_BYTES_DIBUJO})")
+    return {
+        "segmentos": info["segmentos"] + 1,
+        "trozos": info["trozos"] + len(segmento.trozos()),
+        "bytes": info["bytes"] + segmento.bytes,
+        "comprimido": comprimido,
+        "hash": _encadenar(info["hash"], segmento.resumen),
+        "lista": True,
+    }
+
+
+def decodificar(trozos, info):
+    """Vuelve a montar el dibujo a partir de [(segmento, datos)] en orden y
+    comprueba que su hash es el de 'info'. Lanza DibujoCorrupto."""
+    datos_segmentos = []
+    for segmento, datos in trozos:
+        if segmento == len(datos_segmentos):
+            datos_segmentos.append(bytearray())
+        elif segmento != len(datos_segmentos) - 1:
+            raise DibujoCorrupto("Trozos de dibujo fuera de orden")
+        datos_segmentos[-1] += datos
+    if len(datos_segmentos) != info["segmentos"]:
+        raise DibujoCorrupto("Faltan segmentos del dibujo")
+
+    valores = []
+    hash_actual = None
+    for datos in datos_segmentos:
+        try:
+            texto = zlib.decompress(bytes(datos))
+        except zlib.error:
+            raise DibujoCorrupto("Trozos de dibujo incompletos")
+        hash_actual = _encadenar(hash_actual, _resumen(texto))
+        valores.append(json.loads(texto))
+    if hash_actual != info["hash"]:
+        raise DibujoCorrupto("El dibujo no corresponde a su hash")
+
+    if len(valores) == 1:
+        return valores[0]
+    # Los segmentos añadidos siempre son listas de trazos
+    return [trazo for valor in valores for trazo in valor]
@@ -0,0 +1,100 @@
+"""
+Documentación Swagger de la API (/apidocs) cargada bajo demanda.
+
+Importar flasgger y recorrer los docstrings YAML de todas las rutas hacía más
+lento cada arranque de worker, y /apidocs casi no se visita. Por eso la
+documentación vive en una app Flask aparte que se crea con la primera
+petición a sus rutas; el resto de peticiones no pasan por ella.
+
+La especificación se puede dejar generada al desplegar:
+
+    python documentacion.py              # escribe apispec.json
+
+Si el fichero existe y es más reciente que app.py se sirve tal cual; si no,
+se genera a partir de los docstrings la primera vez que se pide.
+"""
+import json
+import os
+import sys
+import threading
+
+from flask import Flask
+
+ENDPOINT_SPEC = "apispec_1"
+RUTA_SPEC_PRECOMPILADA = os.environ.get(
+    "SWAGGER_SPEC",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "apispec.json")
+)
+
+# Prefijos de las rutas que registra flasgger: interfaz, spec y estáticos
+PREFIJOS_DOCUMENTACION = (
+    "/apidocs", f"/{ENDPOINT_SPEC}.json", "/flasgger_static", "/oauth2-redirect.html"
+)
+
+
+def _crear_swagger(app):
+    # La app de documentación comparte la configuración SWAGGER de 'app',
+    # pero la spec se genera con las rutas de 'app'
+    from flasgger import Swagger
+
+    docs = Flask(__name__)
+    docs.config["SWAGGER"] = app.config.get("SWAGGER", {})
+    return docs, Swagger(docs)
+
+
+def generar_spec(app):
+    """Especificación OpenAPI de las rutas de 'app' según sus docstrings."""
+    _, swagger = _crear_swagger(app)
+    with app.app_context():
+        return swagger.get_apispecs(ENDPOINT_SPEC)
+
+
+def _spec_precompilada(app):
+    # Una spec anterior al último cambio de las rutas no sirve
+    try:
+        ruta_app = sys.modules[app.import_name].__file__
+        if os.path.getmtime(RUTA_SPEC_PRECOMPILADA) < os.path.getmtime(ruta_app):
+            return None
+        with open(RUTA_SPEC_PRECOMPILADA, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, KeyError, AttributeError, ValueError):
+        return None
+
+
+class DocumentacionPerezosa:
+    """Middleware WSGI: las peticiones a la documentación van a una app de
+    flasgger que se crea la primera vez; las demás, a la app de siempre."""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+        self._docs = None
+        self._lock = threading.Lock()
+
+    def _app_documentacion(self):
+        if self._docs is None:
+            with self._lock:
+                if self._docs is None:
+                    docs, swagger = _crear_swagger(self.app)
+                    spec = _spec_precompilada(self.app)
+                    if spec is None:
+                        with self.app.app_context():
+                            spec = swagger.get_apispecs(ENDPOINT_SPEC)
+                    # flasgger guarda aquí la spec ya generada y la reutiliza
+                    swagger.apispecs[ENDPOINT_SPEC] = spec
+                    self._docs = docs
+        return self._docs
+
+    def __call__(self, environ, start_response):
+        if environ.get("PATH_INFO", "").startswith(PREFIJOS_DOCUMENTACION):
+            return self._app_documentacion()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from app import app
+
+    with open(RUTA_SPEC_PRECOMPILADA, "w", encoding="utf-8") as f:
+        json.dump(generar_spec(app), f, ensure_ascii=False)
+    print(f"Spec de Swagger guardada en {RUTA_SPEC_PRECOMPILADA}")
@@ -1,13 +1,32 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import asyncio
+import base64
+import json
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
 
-# Inicializar Firebase solo una vez
-# Asegúrate de que el archivo serviceAccountKey.json esté en la misma carpeta
-if not firebase_admin._apps:
-    cred = credentials.Certificate("serviceAccountKey.json")
-    firebase_admin.initialize_app(cred)
+import dibujos
+from asincrono import BucleAsincrono
+from backend import (
+    obtener_backend,
+    obtener_cliente_asincrono,
+    error_no_encontrado,
+    error_precondicion,
+    observar_llamadas,
+    ruta_campo,
+)
+from busqueda import normalizar, pesos_nota, terminos_consulta, ordenar_resultados
+from cache import CacheTTL
+from metricas import medir_funciones, registrar_llamada
 
-db = firestore.client()
+# Cliente y módulo del motor configurado (Firestore por defecto).
+# Con BACKEND_DATOS=memoria se usa el motor local de backend_memoria.py.
+# El cliente se crea al primer uso en cada proceso (ver backend.py)
+db, firestore = obtener_backend()
+
+# Las excepciones del motor (documento que no existe, precondición que no se
+# cumple) se resuelven al capturarlas, "except error_no_encontrado():", y no
+# al importar: con Firestore sus clases vienen de google.api_core, que carga grpc
 
 
 # ---------- FUNCIÓN PARA CONVERTIR TIMESTAMP ---------- #
@@ -19,11 +38,343 @@ def serializar_timestamp(ts):
         return None
 
 
+def _serializar_nota(doc):
+    data = doc.to_dict()
+    data["id"] = doc.id
+    if "contenido" in data:
+        data["contenido"] = descomprimir_contenido(data["contenido"])
+    data["fecha_creacion"] = serializar_timestamp(data.get("fecha_creacion"))
+    data["fecha_modificacion"] = serializar_timestamp(data.get("fecha_modificacion"))
+    return data
+
+
+# ---------- CONTENIDO COMPRIMIDO ---------- #
+
+# Con CONTENIDO_COMPRIMIDO_DESDE > 0, el contenido de las notas que ocupa al
+# menos esos bytes se guarda comprimido con zlib, como bytes en vez de
+# texto. Las lecturas de este módulo lo devuelven siempre como texto, así
+# que se puede activar y desactivar en cualquier momento. Desactivado por
+# defecto: quien lea la colección notas directamente vería bytes.
+CONTENIDO_COMPRIMIDO_DESDE = int(os.environ.get("CONTENIDO_COMPRIMIDO_DESDE", 0))
+
+NIVEL_COMPRESION_CONTENIDO = 6
+
+
+def comprimir_contenido(contenido):
+    """Valor a guardar en Firestore para 'contenido'."""
+    if not CONTENIDO_COMPRIMIDO_DESDE or not isinstance(contenido, str):
+        return contenido
+    texto = contenido.encode()
+    if len(texto) < CONTENIDO_COMPRIMIDO_DESDE:
+        return contenido
+    comprimido = zlib.compress(texto, NIVEL_COMPRESION_CONTENIDO)
+    # Un texto que no se repite puede ocupar más comprimido
+    return comprimido if len(comprimido) < len(texto) else contenido
+
+
+def descomprimir_contenido(contenido):
+    if isinstance(contenido, bytes):
+        return zlib.decompress(contenido).decode()
+    return contenido
+
+
+# ---------- ESCRITURAS AGRUPADAS ---------- #
+
+# Límite de operaciones por lote (batch) o transacción en Firestore
+MAX_OPERACIONES_LOTE = 500
+
+# Bytes de dibujo por lote en las operaciones masivas: Firestore rechaza
+# los commits de más de 10 MiB y se deja margen para el resto de campos
+MAX_BYTES_DIBUJO_LOTE = 9 * 1024 * 1024
+
+
+class Escrituras:
+    """Escrituras pendientes que después se aplican juntas sobre un lote o
+    una transacción. Permite componer varias operaciones de notas y saber
+    cuántas escrituras ocupa cada una antes de repartirlas en lotes."""
+
+    def __init__(self):
+        self.operaciones = []
+        # Usuarios cuya versión de notas hay que subir (una vez por usuario)
+        self.versiones = set()
+        # {id_usuario: {etiqueta: {id_nota: True o DELETE_FIELD}}}, que se
+        # escribe con un set por usuario y parte del índice
+        self.etiquetas = {}
+
+    def __len__(self):
+        return len(self.operaciones) + len(self.versiones) + len(self.etiquetas)
+
+    def set(self, ref, data, merge=False):
+        self.operaciones.append(("set", ref, data, merge))
+
+    def update(self, ref, data, opcion=None):
+        # 'opcion' es la precondición (db.write_option) del update
+        self.operaciones.append(("update", ref, data, opcion))
+
+    def delete(self, ref):
+        self.operaciones.append(("delete", ref, None, None))
+
+    def cambiar_version(self, id_usuario):
+        if id_usuario:
+            self.versiones.add(id_usuario)
+
+    def cambiar_etiquetas(self, id_usuario, id_nota, anteriores, nuevas):
+        """Anota en el índice de etiquetas del usuario que la nota pasa de
+        tener 'anteriores' a tener 'nuevas'."""
+        anteriores, nuevas = set(etiquetas_validas(anteriores)), set(etiquetas_validas(nuevas))
+        if not id_usuario or anteriores == nuevas:
+            return
+        indice = self.etiquetas.setdefault(id_usuario, {})
+        for etiqueta in anteriores - nuevas:
+            indice.setdefault(etiqueta, {})[id_nota] = firestore.DELETE_FIELD
+        for etiqueta in nuevas - anteriores:
+            indice.setdefault(etiqueta, {})[id_nota] = True
+
+    def extender(self, otras):
+        self.operaciones.extend(otras.operaciones)
+        self.versiones |= otras.versiones
+        for id_usuario, cambios in otras.etiquetas.items():
+            indice = self.etiquetas.setdefault(id_usuario, {})
+            for etiqueta, notas in cambios.items():
+                indice.setdefault(etiqueta, {}).update(notas)
+
+    def aplicar(self, destino):
+        for tipo, ref, data, merge in self.operaciones:
+            if tipo == "set":
+                destino.set(ref, data, merge=merge)
+            elif tipo == "update":
+                if merge is not None:
+                    destino.update(ref, data, option=merge)
+                else:
+                    destino.update(ref, data)
+            else:
+                destino.delete(ref)
+        for id_usuario in self.versiones:
+            destino.set(_ref_version(id_usuario), {
+                "notas": firestore.Increment(1),
+                "fecha_actualizacion": firestore.SERVER_TIMESTAMP
+            }, merge=True)
+        for id_usuario, cambios in self.etiquetas.items():
+            for numero, claves in _repartir_etiquetas(cambios).items():
+                destino.set(_ref_parte_etiquetas(id_usuario, numero),
+                            {"etiquetas": claves}, merge=True)
+        return destino
+
+    def commit(self):
+        self.aplicar(db.batch()).commit()
+
+
+def ejecutar_en_transaccion(planificar, solo_lectura=False):
+    """Ejecuta planificar(transaction) dentro de una transacción. La función
+    hace sus lecturas con la transacción y devuelve (Escrituras, resultado);
+    las escrituras se aplican al final y se devuelve el resultado.
+
+    Con solo_lectura=True todas las lecturas ven el mismo instante de la
+    base de datos y no se puede escribir."""
+    @firestore.transactional
+    def transaccion(transaction):
+        escrituras, resultado = planificar(transaction)
+        if escrituras:
+            escrituras.aplicar(transaction)
+        return resultado
+
+    return transaccion(db.transaction(read_only=solo_lectura))
+
+
+# ---------- VERSIÓN DE LAS NOTAS DE CADA USUARIO ---------- #
+
+# usuarios_versiones/{id_usuario} guarda en "notas" un número que sube con
+# cada escritura sobre las notas del usuario. Sirve de validador (ETag) para
+# los listados: si no ha cambiado, el listado tampoco.
+
+def _ref_version(id_usuario):
+    return db.collection("usuarios_versiones").document(id_usuario)
+
+
+def obtener_version_notas(id_usuario):
+    doc = _ref_version(id_usuario).get()
+    if doc.exists:
+        return doc.to_dict().get("notas", 0)
+    return 0
+
+
+# ---------- ÍNDICE DE ETIQUETAS DE CADA USUARIO ---------- #
+
+# etiquetas_usuario/{id_usuario}/partes_etiquetas/{n} =
+#     {"etiquetas": {clave: {id_nota: True}}, "partes": ETIQUETAS_PARTES}
+# Las notas de cada etiqueta se guardan como claves de un mapa y no como
+# array: así añadir y quitar notas de varias etiquetas cabe en un set con
+# merge, y el número de notas es el tamaño del mapa (no se desajusta aunque
+# una escritura se repita).
+#
+# - Claves: la etiqueta la escribe el usuario y Firestore no admite
+#   cualquier nombre de campo (los de la forma __x__ están reservados), así
+#   que se guarda codificada con clave_etiqueta().
+# - Partes: un solo documento llegaría al límite de 1 MiB con muchas notas
+#   etiquetadas. Cada etiqueta va a una de ETIQUETAS_PARTES partes según su
+#   clave; se leen todas con una consulta.
+# - Usuarios anteriores: "partes" lo escribe solo la reconstrucción. Si
+#   ninguna parte lo tiene con el valor actual (índice anterior a las
+#   partes, o se ha cambiado ETIQUETAS_PARTES) el índice se reconstruye a
+#   partir de las notas del usuario en la primera lectura.
+
+ETIQUETAS_PARTES = max(int(os.environ.get("ETIQUETAS_PARTES", 4)), 1)
+
+# Por encima de esto una parte se acerca al límite de 1 MiB de un documento
+MAX_BYTES_PARTE_ETIQUETAS = 900 * 1024
+
+
+def _ref_etiquetas(id_usuario):
+    return db.collection("etiquetas_usuario").document(id_usuario)
+
+
+def _ref_parte_etiquetas(id_usuario, numero):
+    return _ref_etiquetas(id_usuario).collection("partes_etiquetas").document(str(numero))
+
+
+def etiquetas_validas(etiquetas):
+    if not isinstance(etiquetas, list):
+        return []
+    return [e for e in etiquetas if isinstance(e, str) and e.strip()]
+
+
+def clave_etiqueta(etiqueta):
+    """Nombre de campo para 'etiqueta': "e_" y sus caracteres, con los que
+    no son letras o cifras ASCII como _XX por cada byte UTF-8."""
+    clave = ["e_"]
+    for c in etiqueta:
+        if c.isascii() and c.isalnum():
+            clave.append(c)
+        else:
+            clave.extend(f"_{b:02X}" for b in c.encode())
+    return "".join(clave)
+
+
+def etiqueta_de_clave(clave):
+    datos = bytearray()
+    i = 2
+    while i < len(clave):
+        if clave[i] == "_":
+            datos.append(int(clave[i + 1:i + 3], 16))
+            i += 3
+        else:
+            datos.extend(clave[i].encode())
+            i += 1
+    return datos.decode()
+
+
+def _parte_etiqueta(clave):
+    # crc32 y no hash(): tiene que dar lo mismo en todos los procesos
+    return zlib.crc32(clave.encode()) % ETIQUETAS_PARTES
+
+
+def _repartir_etiquetas(indice):
+    """{etiqueta: notas} -> {número de parte: {clave: notas}}."""
+    partes = {}
+    for etiqueta, notas in indice.items():
+        clave = clave_etiqueta(etiqueta)
+        partes.setdefault(_parte_etiqueta(clave), {})[clave] = notas
+    return partes
+
+
+def indice_etiquetas(notas):
+    """{etiqueta: {id_nota: True}} a partir de snapshots de notas."""
+    indice = {}
+    for d in notas:
+        for etiqueta in etiquetas_validas(d.to_dict().get("etiquetas")):
+            indice.setdefault(etiqueta, {})[d.id] = True
+    return indice
+
+
+def escribir_indice_etiquetas(destino, id_usuario, indice, existentes=()):
+    """Sustituye el índice del usuario por 'indice' en 'destino' (lote o
+    transacción). 'existentes' son las partes que hay ahora: las que sobran
+    se borran."""
+    partes = _repartir_etiquetas(indice)
+    for numero in range(ETIQUETAS_PARTES):
+        claves = partes.get(numero, {})
+        tamano = sum(len(c) + sum(len(i) + 2 for i in n) for c, n in claves.items())
+        if tamano > MAX_BYTES_PARTE_ETIQUETAS:
+            print(f"AVISO: el índice de etiquetas de {id_usuario} ocupa ~{tamano} bytes "
+                  f"en una parte; conviene subir ETIQUETAS_PARTES")
+        destino.set(_ref_parte_etiquetas(id_usuario, numero),
+                    {"etiquetas": claves, "partes": ETIQUETAS_PARTES})
+    for d in existentes:
+        if not d.id.isdigit() or int(d.id) >= ETIQUETAS_PARTES:
+            destino.delete(d.reference)
+    # Sustituye también el índice anterior a las partes, que estaba aquí
+    destino.set(_ref_etiquetas(id_usuario), {"partes": ETIQUETAS_PARTES})
+
+
+def reconstruir_indice_etiquetas(id_usuario):
+    """Rehace el índice de etiquetas del usuario a partir de sus notas, en
+    una transacción: una nota que cambie a la vez obliga a repetirla."""
+    @firestore.transactional
+    def reconstruir(transaction):
+        # Una consulta y no la colección: transaction.get no admite colecciones
+        existentes = list(transaction.get(
+            _ref_etiquetas(id_usuario).collection("partes_etiquetas").select([])))
+        notas = transaction.get(db.collection("notas")
+                                  .where("id_usuario", "==", id_usuario)
+                                  .select(["etiquetas"]))
+        indice = indice_etiquetas(notas)
+        escribir_indice_etiquetas(transaction, id_usuario, indice, existentes)
+        return indice
+
+    return reconstruir(db.transaction())
+
+
+def _leer_indice_etiquetas(id_usuario):
+    partes = [d.to_dict() for d in
+              _ref_etiquetas(id_usuario).collection("partes_etiquetas").stream()]
+    if not any(p.get("partes") == ETIQUETAS_PARTES for p in partes):
+        return reconstruir_indice_etiquetas(id_usuario)
+    indice = {}
+    for parte in partes:
+        for clave, notas in parte.get("etiquetas", {}).items():
+            indice[etiqueta_de_clave(clave)] = notas
+    return indice
+
+
+def obtener_etiquetas_usuario(id_usuario, prefijo=None, incluir_notas=False):
+    """Etiquetas del usuario con su número de notas, de más a menos usada,
+    con una consulta a las partes del índice. 'prefijo' filtra sin
+    distinguir mayúsculas ni tildes (autocompletado)."""
+    indice = _leer_indice_etiquetas(id_usuario)
+    prefijo = normalizar(prefijo.strip()) if prefijo else ""
+
+    resultado = []
+    for etiqueta, notas in indice.items():
+        # Las etiquetas que se quedan sin notas conservan un mapa vacío
+        if not notas or not normalizar(etiqueta).startswith(prefijo):
+            continue
+        fila = {"etiqueta": etiqueta, "num_notas": len(notas)}
+        if incluir_notas:
+            fila["notas"] = sorted(notas)
+        resultado.append(fila)
+
+    resultado.sort(key=lambda f: (-f["num_notas"], normalizar(f["etiqueta"])))
+    return resultado
+
+
 # ---------- CATEGORÍAS: MÉTODOS ---------- #
 
+# Índice nombre -> id de categoría para no consultar Firestore en cada nota.
+# Se vacía al renombrar o eliminar una categoría desde este worker.
+indice_categorias = CacheTTL(
+    max_entradas=int(os.environ.get("CACHE_CATEGORIAS_MAX", 5000)),
+    ttl=float(os.environ.get("CACHE_CATEGORIAS_TTL", 300))
+)
+
+
 def obtener_categoria_por_nombre(nombre):
-    docs = db.collection("categoriaNota").where("nombre", "==", nombre).stream()
+    existente = indice_categorias.obtener(nombre)
+    if existente:
+        return existente
+
+    docs = db.collection("categoriaNota").where("nombre", "==", nombre).limit(1).stream()
     for d in docs:
+        indice_categorias.guardar(nombre, d.id)
         return d.id
     return None
 
@@ -33,6 +384,7 @@ def crear_categoria(nombre):
     nueva_ref.set({
         "nombre": nombre
     })
+    indice_categorias.guardar(nombre, nueva_ref.id)
     return nueva_ref.id
 
 
@@ -45,31 +397,72 @@ def obtener_o_crear_categoria_por_nombre(nombre):
 
 # ---------- MÉTODO PARA RELACIONAR NOTA - CATEGORÍA ---------- #
 
+# Cada nota pertenece a una sola categoría: la relación usa el id de la nota
+# como id del documento, así que volver a relacionarla la mueve de categoría
+# en lugar de añadir otra fila. Las filas antiguas con id aleatorio se
+# limpian con: python mantenimiento.py relaciones
+
+def _ref_relacion(id_nota):
+    return db.collection("notas_categoriaNota").document(id_nota)
+
+
+def _ref_categoria(id_categoria):
+    return db.collection("categoriaNota").document(id_categoria)
+
+
+def _leer_estado_categorias(transaction, ids_notas, ids_categorias=(), con_notas=False):
+    """Lee dentro de la transacción la categoría actual de cada nota y qué
+    categorías existen, para mover notas y ajustar los contadores.
+
+    Devuelve {"relaciones": {id_nota: id_categoria o None},
+              "categorias": set de ids de categorías existentes,
+              "notas": {id_nota: datos de la nota}}.
+    "notas" solo se rellena con con_notas=True (lee también las notas)."""
+    refs = [_ref_relacion(i) for i in ids_notas] + [_ref_categoria(c) for c in ids_categorias]
+    if con_notas:
+        refs += [db.collection("notas").document(i) for i in ids_notas]
+    estado = {"relaciones": {i: None for i in ids_notas}, "categorias": set(), "notas": {}}
+
+    for d in (transaction.get_all(refs) if refs else []):
+        coleccion = d.reference.parent.id
+        if not d.exists:
+            continue
+        if coleccion == "notas_categoriaNota":
+            estado["relaciones"][d.id] = d.to_dict().get("id_categoriaNota")
+        elif coleccion == "notas":
+            estado["notas"][d.id] = d.to_dict()
+        else:
+            estado["categorias"].add(d.id)
+
+    anteriores = {c for c in estado["relaciones"].values() if c} - set(ids_categorias)
+    if anteriores:
+        for d in transaction.get_all([_ref_categoria(c) for c in anteriores]):
+            if d.exists:
+                estado["categorias"].add(d.id)
+    return estado
+
+
 def crear_relacion_nota_categoria(id_nota, id_categoriaNota):
-    nueva_ref = db.collection("notas_categoriaNota").document()
-    nueva_ref.set({
-        "id_nota": id_nota,
-        "id_categoriaNota": id_categoriaNota
-    })
-    return nueva_ref.id
+    """Mueve la nota a la categoría indicada. Devuelve False si la categoría
+    no existe."""
+    return actualizar_nota(id_nota, None, id_categoriaNota)
 
 
 # ---------- MÉTODOS DE CRUD PARA NOTAS ---------- #
 
-def crear_nota(id_usuario, id_plantilla, titulo, contenido,
-               etiquetas=None, dibujo=None, estado="activa", 
-               animacion_fondo=None, color_fondo=None):
+def _datos_nota(id_usuario, id_plantilla, titulo, contenido,
+                etiquetas=None, dibujo=None, estado="activa",
+                animacion_fondo=None, color_fondo=None):
     if etiquetas is None:
         etiquetas = []
 
-    nueva_ref = db.collection("notas").document()
-
-    data = {
+    return {
         "id_usuario": id_usuario,
         "id_plantilla": id_plantilla,
         "titulo": titulo,
         "contenido": contenido,
         "etiquetas": etiquetas,
+        # No se guarda en la nota: _escrituras_crear_nota lo pasa a trozos
         "dibujo": dibujo,
         "estado": estado,
         "favorita": False,
@@ -81,63 +474,1317 @@ def crear_nota(id_usuario, id_plantilla, titulo, contenido,
         "fecha_modificacion": firestore.SERVER_TIMESTAMP
     }
 
-    nueva_ref.set(data)
-    return nueva_ref.id
+
+def crear_nota(id_usuario, id_plantilla, titulo, contenido,
+               etiquetas=None, dibujo=None, estado="activa", 
+               animacion_fondo=None, color_fondo=None):
+    """Crea la nota sin categoría y devuelve su id. Escribe lo mismo que
+    crear_nota_con_categoria (términos de búsqueda, índice de etiquetas,
+    versión del usuario), para que la nota se encuentre igual."""
+    id_nota, _ = crear_nota_con_categoria(id_usuario, id_plantilla, titulo, contenido,
+                                          etiquetas, dibujo, estado,
+                                          animacion_fondo, color_fondo)
+    return id_nota
 
 
-def obtener_notas_usuario(id_usuario):
-    docs = db.collection("notas").where("id_usuario", "==", id_usuario).stream()
+def crear_nota_con_categoria(id_usuario, id_plantilla, titulo, contenido,
+                             etiquetas=None, dibujo=None, estado="activa",
+                             animacion_fondo=None, color_fondo=None,
+                             id_categoriaNota=None, categoria_nombre=None):
+    """Crea la nota, su relación con la categoría y, si hace falta, la
+    categoría nueva en un único lote: o se guarda todo o no se guarda nada.
 
-    notas = []
-    for d in docs:
-        data = d.to_dict()
-        data["id"] = d.id
+    Devuelve (id_nota, id_categoriaNota). Si la categoría no existe el lote
+    falla con error_no_encontrado() (al sumar su contador de notas)."""
+    escrituras = Escrituras()
+    categoria_nueva = False
+    por_nombre = categoria_nombre and not id_categoriaNota
 
-        data["fecha_creacion"] = serializar_timestamp(data.get("fecha_creacion"))
-        data["fecha_modificacion"] = serializar_timestamp(data.get("fecha_modificacion"))
+    if por_nombre:
+        id_categoriaNota = obtener_categoria_por_nombre(categoria_nombre)
+        if not id_categoriaNota:
+            id_categoriaNota = _escrituras_crear_categoria(escrituras, categoria_nombre)
+            categoria_nueva = True
 
-        notas.append(data)
+    nota_ref = db.collection("notas").document()
+    _escrituras_crear_nota(
+        escrituras, nota_ref,
+        _datos_nota(id_usuario, id_plantilla, titulo, contenido, etiquetas,
+                    dibujo, estado, animacion_fondo, color_fondo),
+        id_categoriaNota
+    )
+    try:
+        escrituras.commit()
+    except error_no_encontrado():
+        if not por_nombre or categoria_nueva:
+            raise
+        # El índice apuntaba a una categoría borrada desde otro worker
+        indice_categorias.invalidar(categoria_nombre)
+        return crear_nota_con_categoria(id_usuario, id_plantilla, titulo, contenido,
+                                        etiquetas, dibujo, estado, animacion_fondo,
+                                        color_fondo, categoria_nombre=categoria_nombre)
 
-    return notas
+    if categoria_nueva:
+        indice_categorias.guardar(categoria_nombre, id_categoriaNota)
+    return nota_ref.id, id_categoriaNota
 
 
-def obtener_nota(id_nota):
-    doc = db.collection("notas").document(id_nota).get()
+# Las funciones _escrituras_* describen qué documentos toca cada operación
+# sobre notas. Las usan tanto las rutas de una sola nota como las masivas,
+# para que ambas dejen los datos exactamente igual. Las que reciben 'estado'
+# necesitan lo leído por _leer_estado_categorias en la misma transacción y
+# lo actualizan, por si la misma nota aparece varias veces.
+
+# Cota de escrituras por operación, para repartirlas en lotes (incluye la
+# versión y el índice de etiquetas del usuario, que se escriben una vez por
+# lote). Los trozos del dibujo se cuentan aparte
+MAX_ESCRITURAS_POR_NOTA = 7
+
+def _escrituras_crear_categoria(escrituras, nombre, categoria_ref=None):
+    categoria_ref = categoria_ref or db.collection("categoriaNota").document()
+    escrituras.set(categoria_ref, {"nombre": nombre}, merge=True)
+    return categoria_ref.id
+
+
+def _escrituras_relacionar(escrituras, id_nota, id_categoriaNota, id_usuario=None):
+    data = {
+        "id_nota": id_nota,
+        "id_categoriaNota": id_categoriaNota,
+        "fecha": firestore.SERVER_TIMESTAMP
+    }
+    if id_usuario:
+        data["id_usuario"] = id_usuario
+    # merge=True conserva el id_usuario guardado al crear la nota
+    escrituras.set(_ref_relacion(id_nota), data, merge=True)
+
+
+def _escrituras_contar(escrituras, id_categoria, delta, estado=None):
+    """Suma 'delta' al contador num_notas de la categoría. Sin 'estado' la
+    categoría debe existir (si no, el lote falla con NotFound)."""
+    if not id_categoria:
+        return
+    if estado is not None and id_categoria not in estado["categorias"]:
+        return
+    escrituras.update(_ref_categoria(id_categoria),
+                      {"num_notas": firestore.Increment(delta)})
+
+
+def _escrituras_indexar_nota(escrituras, id_nota, nota):
+    escrituras.set(_ref_busqueda(id_nota), datos_busqueda_nota(nota))
+
+
+def _escrituras_crear_nota(escrituras, nota_ref, data, id_categoriaNota):
+    # Copia: en una transacción la misma planificación se puede repetir
+    data = dict(data)
+    data["dibujo_info"] = _escrituras_guardar_dibujo(escrituras, nota_ref, data.pop("dibujo", None))
+    escrituras.set(nota_ref, {**data, "contenido": comprimir_contenido(data.get("contenido"))})
+    escrituras.cambiar_version(data["id_usuario"])
+    escrituras.cambiar_etiquetas(data["id_usuario"], nota_ref.id, [], data.get("etiquetas"))
+    _escrituras_indexar_nota(escrituras, nota_ref.id, data)
+    _escrituras_relacionar(escrituras, nota_ref.id, id_categoriaNota, data["id_usuario"])
+    _escrituras_contar(escrituras, id_categoriaNota, 1)
+
+
+def _escrituras_mover_nota(escrituras, id_nota, id_categoriaNota, estado, id_usuario=None):
+    anterior = estado["relaciones"].get(id_nota)
+    if anterior == id_categoriaNota:
+        return
+    # Con id_usuario la relación queda completa aunque la nota no tuviera
+    _escrituras_relacionar(escrituras, id_nota, id_categoriaNota, id_usuario)
+    _escrituras_contar(escrituras, id_categoriaNota, 1, estado)
+    _escrituras_contar(escrituras, anterior, -1, estado)
+    estado["relaciones"][id_nota] = id_categoriaNota
+
+
+def _escrituras_actualizar_nota(escrituras, nota_ref, cambios, nota, opcion=None):
+    """'nota' son los datos actuales de la nota: su id_usuario y, si
+    'cambios' toca alguno de los CAMPOS_BUSQUEDA, también esos campos, y
+    si cambia el dibujo, su dibujo_info. 'opcion' es la precondición del
+    update de la nota."""
+    # Copia: en una transacción la misma planificación se puede repetir.
+    # dibujo_info solo lo escribe el servidor, junto con los trozos
+    cambios = {c: v for c, v in cambios.items() if c != "dibujo_info"}
+    if "dibujo" in cambios:
+        cambios["dibujo_info"] = _escrituras_guardar_dibujo(
+            escrituras, nota_ref, cambios.pop("dibujo"), nota.get("dibujo_info"))
+        # Las notas anteriores guardaban el dibujo dentro del documento
+        cambios["dibujo"] = firestore.DELETE_FIELD
+    cambios["fecha_modificacion"] = firestore.SERVER_TIMESTAMP
+    # Firestore crea campos nuevos si no existen, así que animacion_fondo
+    # se guardará automáticamente si viene en 'cambios'
+    if "contenido" in cambios:
+        escrituras.update(nota_ref, {**cambios,
+                                     "contenido": comprimir_contenido(cambios["contenido"])},
+                          opcion)
+    else:
+        escrituras.update(nota_ref, cambios, opcion)
+    escrituras.cambiar_version(nota.get("id_usuario"))
+    if "etiquetas" in cambios:
+        escrituras.cambiar_etiquetas(nota.get("id_usuario"), nota_ref.id,
+                                     nota.get("etiquetas"), cambios["etiquetas"])
+    if any(c in cambios for c in CAMPOS_BUSQUEDA):
+        _escrituras_indexar_nota(escrituras, nota_ref.id, {**nota, **cambios})
+
+
+def _escrituras_eliminar_nota(escrituras, nota_ref, estado, nota):
+    """'nota' son los datos de la nota que se borra ({} si no existe)."""
+    id_usuario = nota.get("id_usuario")
+    escrituras.delete(nota_ref)
+    escrituras.delete(_ref_busqueda(nota_ref.id))
+    _escrituras_borrar_trozos(escrituras, nota_ref, nota.get("dibujo_info"))
+    escrituras.cambiar_version(id_usuario)
+    escrituras.cambiar_etiquetas(id_usuario, nota_ref.id, nota.get("etiquetas"), [])
+    # Marca de borrado para que /cambios avise a los demás dispositivos
+    if id_usuario:
+        escrituras.set(_ref_eliminada(nota_ref.id), {
+            "id_nota": nota_ref.id,
+            "id_usuario": id_usuario,
+            "fecha_eliminacion": firestore.SERVER_TIMESTAMP
+        })
+    escrituras.delete(_ref_relacion(nota_ref.id))
+    _escrituras_contar(escrituras, estado["relaciones"].get(nota_ref.id), -1, estado)
+    estado["relaciones"][nota_ref.id] = None
+
+
+# Campos que necesita la vista de lista; el contenido y el dibujo solo se
+# devuelven en /api/nota/<id>
+CAMPOS_RESUMEN_NOTA = (
+    "id_usuario", "id_plantilla", "titulo", "etiquetas", "estado", "favorita",
+    "animacion_fondo", "color_fondo", "dibujo_info", "fecha_creacion",
+    "fecha_modificacion"
+)
+
+MAX_LIMITE_NOTAS = 100
+
+# Ordenaciones admitidas en los listados: valor de 'orden' -> (campo, descendente).
+# El '-' delante indica de más reciente a más antigua
+ORDENES_NOTAS = {
+    "-creacion": ("fecha_creacion", True),
+    "creacion": ("fecha_creacion", False),
+    "-modificacion": ("fecha_modificacion", True),
+    "modificacion": ("fecha_modificacion", False),
+    "titulo": ("titulo", False),
+}
+ORDEN_NOTAS_DEFECTO = "-creacion"
+
+# Filtros de igualdad admitidos: parámetro -> (campo, operador)
+FILTROS_NOTAS = {
+    "estado": ("estado", "=="),
+    "favorita": ("favorita", "=="),
+    "etiqueta": ("etiquetas", "array-contains"),
+}
+
+# Firestore combina (index merging) un índice compuesto por cada filtro de
+# igualdad con el campo de ordenación, así que basta con tener en
+# firestore.indexes.json (campo, orden) para cada filtro de FILTROS_NOTAS,
+# más id_usuario, y cada orden de ORDENES_NOTAS. Cualquier otra combinación
+# (un rango sobre un campo distinto del de ordenación, varias etiquetas...)
+# necesitaría un índice que no existe y se rechaza en validar_filtros_notas.
+
+
+class FiltroNoValido(ValueError):
+    """Combinación de filtros que Firestore no puede resolver con los
+    índices definidos."""
+
+
+def validar_filtros_notas(filtros):
+    """Comprueba los filtros de un listado de notas:
+        {"estado", "favorita", "etiqueta", "fecha_desde", "fecha_hasta", "orden"}
+    (todos opcionales). Devuelve el orden a aplicar, o None si no hace falta
+    ordenar. Lanza FiltroNoValido si la consulta no tendría índice."""
+    desconocidos = set(filtros) - set(FILTROS_NOTAS) - {"fecha_desde", "fecha_hasta", "orden"}
+    if desconocidos:
+        raise FiltroNoValido(f"Filtros no admitidos: {', '.join(sorted(desconocidos))}")
+
+    orden = filtros.get("orden")
+    if orden is not None and orden not in ORDENES_NOTAS:
+        raise FiltroNoValido(f"'orden' debe ser uno de: {', '.join(ORDENES_NOTAS)}")
+
+    if filtros.get("fecha_desde") or filtros.get("fecha_hasta"):
+        # El rango va sobre el campo de ordenación: un rango sobre otro
+        # campo obligaría a ordenar primero por él
+        orden = orden or ORDEN_NOTAS_DEFECTO
+        if not ORDENES_NOTAS[orden][0].startswith("fecha_"):
+            raise FiltroNoValido(
+                "'fecha_desde' y 'fecha_hasta' solo se pueden usar ordenando por "
+                "creacion o modificacion")
+    return orden
+
+
+def _consulta_notas_usuario(id_usuario, resumen=False, filtros=None, ordenar=False):
+    """Consulta de las notas del usuario con los filtros ya validados.
+    Devuelve (consulta, orden); con ordenar=True siempre se ordena (para
+    paginar), por defecto de la más reciente a la más antigua."""
+    filtros = filtros or {}
+    orden = validar_filtros_notas(filtros)
+    if ordenar:
+        orden = orden or ORDEN_NOTAS_DEFECTO
+
+    consulta = db.collection("notas").where("id_usuario", "==", id_usuario)
+    for parametro, (campo, operador) in FILTROS_NOTAS.items():
+        if filtros.get(parametro) is not None:
+            consulta = consulta.where(campo, operador, filtros[parametro])
+
+    if orden:
+        campo, descendente = ORDENES_NOTAS[orden]
+        direccion = firestore.Query.DESCENDING if descendente else firestore.Query.ASCENDING
+        if filtros.get("fecha_desde"):
+            consulta = consulta.where(campo, ">=", filtros["fecha_desde"])
+        if filtros.get("fecha_hasta"):
+            consulta = consulta.where(campo, "<=", filtros["fecha_hasta"])
+        # El id desempata notas con el mismo valor para que el cursor sea exacto
+        consulta = consulta.order_by(campo, direction=direccion)\
+                           .order_by("__name__", direction=direccion)
+
+    if resumen:
+        consulta = consulta.select(CAMPOS_RESUMEN_NOTA)
+    return consulta, orden
+
+
+def iterar_notas_usuario(id_usuario, resumen=False, filtros=None):
+    """Genera las notas serializadas a medida que llegan de la consulta, sin
+    cargarlas todas en memoria."""
+    consulta, _ = _consulta_notas_usuario(id_usuario, resumen, filtros)
+    for d in consulta.stream():
+        yield _serializar_nota(d)
+
+
+def obtener_notas_usuario(id_usuario, resumen=False, filtros=None):
+    return list(iterar_notas_usuario(id_usuario, resumen, filtros))
+
+
+def _codificar_cursor(doc, orden):
+    campo = ORDENES_NOTAS[orden][0]
+    valor = doc.to_dict().get(campo)
+    valor = json.dumps({
+        "orden": orden,
+        "valor": serializar_timestamp(valor) if campo.startswith("fecha_") else valor,
+        "id": doc.id
+    })
+    return base64.urlsafe_b64encode(valor.encode()).decode()
+
+
+def _decodificar_cursor(cursor, orden):
+    """Devuelve los valores de ordenación guardados en el cursor. Lanza
+    ValueError si el cursor no lo generó esta API o es de otro orden."""
+    try:
+        valor = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if valor["orden"] != orden:
+            raise ValueError("El cursor es de otro orden")
+        campo = ORDENES_NOTAS[orden][0]
+        return {
+            campo: datetime.fromisoformat(valor["valor"])
+                   if campo.startswith("fecha_") else valor["valor"],
+            "__name__": db.collection("notas").document(valor["id"])
+        }
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError("Cursor no válido") from e
+
+
+def obtener_pagina_notas_usuario(id_usuario, limite, cursor=None, resumen=False,
+                                 filtros=None):
+    """Devuelve (notas, siguiente_cursor) con las notas del usuario según
+    'filtros' (ver validar_filtros_notas). siguiente_cursor es None en la
+    última página.
+
+    Sin 'orden' se ordena de la más reciente a la más antigua por fecha de
+    creación, y no de modificación, para que editar una nota mientras se
+    pagina no la haga saltar de página.
+    """
+    consulta, orden = _consulta_notas_usuario(id_usuario, resumen, filtros, ordenar=True)
+    if cursor:
+        consulta = consulta.start_after(_decodificar_cursor(cursor, orden))
+
+    # Se pide un documento de más para saber si queda otra página
+    docs = list(consulta.limit(limite + 1).stream())
+    siguiente = _codificar_cursor(docs[limite - 1], orden) if len(docs) > limite else None
+
+    return [_serializar_nota(d) for d in docs[:limite]], siguiente
+
+
+def obtener_nota_versionada(id_nota, con_dibujo=True):
+    """Devuelve (nota, version). 'version' es la hora de la última
+    escritura del documento en texto y cambia con cada modificación.
+
+    Con con_dibujo=True la nota incluye el dibujo completo en 'dibujo'
+    (leyendo sus trozos); si no, solo su dibujo_info."""
+    nota_ref = db.collection("notas").document(id_nota)
+    doc, dibujo = _leer_nota_con_dibujo(nota_ref, con_dibujo)
     if doc.exists:
         data = doc.to_dict()
+        if dibujo:
+            data["dibujo"], data["dibujo_info"] = dibujo
+        if "contenido" in data:
+            data["contenido"] = descomprimir_contenido(data["contenido"])
 
         data["fecha_creacion"] = serializar_timestamp(data.get("fecha_creacion"))
         data["fecha_modificacion"] = serializar_timestamp(data.get("fecha_modificacion"))
 
-        return data
-    return None
+        return data, serializar_timestamp(doc.update_time)
+    return None, None
 
 
-def actualizar_nota(id_nota, cambios):
-    cambios["fecha_modificacion"] = firestore.SERVER_TIMESTAMP
-    # Firestore crea campos nuevos si no existen, así que animacion_fondo
-    # se guardará automáticamente si viene en 'cambios'
-    db.collection("notas").document(id_nota).update(cambios)
-    return True
+def obtener_nota(id_nota):
+    return obtener_nota_versionada(id_nota)[0]
+
+
+def nota_existe(id_nota):
+    # Sin campos: solo interesa si existe
+    return db.collection("notas").document(id_nota).get(field_paths=[]).exists
+
+
+def obtener_version_nota(id_nota):
+    """La misma 'version' que obtener_nota_versionada, sin leer ningún
+    campo ni el dibujo. None si la nota no existe."""
+    doc = db.collection("notas").document(id_nota).get(field_paths=[])
+    return serializar_timestamp(doc.update_time) if doc.exists else None
+
+
+def actualizar_nota(id_nota, cambios, id_categoriaNota=None):
+    """Aplica 'cambios' a la nota y, si se indica id_categoriaNota, la mueve
+    de categoría en la misma transacción. Devuelve False si la nota o la
+    categoría no existen."""
+    nota_ref = db.collection("notas").document(id_nota)
+    # Al sustituir el dibujo se borran los trozos que sobran del anterior:
+    # se lee en una transacción para que otra escritura no los cambie entre medias
+    con_dibujo = bool(cambios) and "dibujo" in cambios
+
+    if not id_categoriaNota and not con_dibujo:
+        # Se lee el dueño, para subir su versión de notas, y los campos de
+        # búsqueda solo si cambian, para rehacer los términos de la nota
+        campos = ["id_usuario"]
+        con_indices = any(c in cambios for c in CAMPOS_BUSQUEDA)
+        if con_indices:
+            campos += CAMPOS_BUSQUEDA
+        doc = nota_ref.get(field_paths=campos)
+        if not doc.exists:
+            return False
+        # Los términos y las etiquetas se calculan con lo leído: el lote solo
+        # se aplica si la nota no ha cambiado desde la lectura. Si otra
+        # escritura se adelanta, se repite en una transacción
+        opcion = db.write_option(last_update_time=doc.update_time) if con_indices else None
+        escrituras = Escrituras()
+        _escrituras_actualizar_nota(escrituras, nota_ref, cambios, doc.to_dict(), opcion)
+        try:
+            escrituras.commit()
+            return True
+        except error_precondicion():
+            pass
+
+    def planificar(transaction):
+        ids_categorias = [id_categoriaNota] if id_categoriaNota else []
+        # Al mover se lee también la nota, para guardar su dueño en la relación
+        estado = _leer_estado_categorias(transaction, [id_nota], ids_categorias,
+                                         con_notas=bool(cambios) or bool(id_categoriaNota))
+        if id_categoriaNota and id_categoriaNota not in estado["categorias"]:
+            return None, False
+        if cambios and id_nota not in estado["notas"]:
+            return None, False
+
+        escrituras = Escrituras()
+        if id_categoriaNota:
+            _escrituras_mover_nota(escrituras, id_nota, id_categoriaNota, estado,
+                                   estado["notas"].get(id_nota, {}).get("id_usuario"))
+        if cambios:
+            _escrituras_actualizar_nota(escrituras, nota_ref, cambios,
+                                        estado["notas"][id_nota])
+        return escrituras, True
+
+    return ejecutar_en_transaccion(planificar)
 
 
 def eliminar_nota(id_nota):
-    db.collection("notas").document(id_nota).delete()
-    return True
+    nota_ref = db.collection("notas").document(id_nota)
+
+    def planificar(transaction):
+        estado = _leer_estado_categorias(transaction, [id_nota], con_notas=True)
+        escrituras = Escrituras()
+        _escrituras_eliminar_nota(escrituras, nota_ref, estado,
+                                  estado["notas"].get(id_nota, {}))
+        return escrituras, True
+
+    return ejecutar_en_transaccion(planificar)
+
+
+# ---------- DIBUJOS DE LAS NOTAS ---------- #
+
+# El dibujo de cada nota se guarda en trozos en notas/{id_nota}/dibujo/{n}
+# y la nota solo guarda su dibujo_info: trozos, tamaño y hash (ver
+# dibujos.py). Las notas anteriores pueden tener aún el dibujo dentro del
+# documento; se leen igual y pasan a trozos al añadirles trazos o con
+# 'python mantenimiento.py dibujos'.
+
+# Segmentos a partir de los cuales añadir trazos reescribe el dibujo entero
+# en uno solo, para que leerlo no necesite cada vez más trozos
+MAX_SEGMENTOS_DIBUJO = int(os.environ.get("MAX_SEGMENTOS_DIBUJO", 32))
+
+# Lecturas de una nota con dibujo antes de rendirse si el dibujo se
+# sustituye a la vez que se leen sus trozos
+INTENTOS_LECTURA_DIBUJO = 3
+
+
+class DibujoModificado(Exception):
+    """El dibujo de la nota ya no es el que indica 'hash_base'."""
+
+
+def _ref_trozo(nota_ref, numero):
+    return nota_ref.collection("dibujo").document(f"{numero:05d}")
+
+
+def _escrituras_trozos(escrituras, nota_ref, segmento, indice_segmento, primero):
+    for i, datos in enumerate(segmento.trozos()):
+        escrituras.set(_ref_trozo(nota_ref, primero + i),
+                       {"segmento": indice_segmento, "datos": datos})
+
 
+def _escrituras_borrar_trozos(escrituras, nota_ref, info, desde=0):
+    for numero in range(desde, (info or {}).get("trozos", 0)):
+        escrituras.delete(_ref_trozo(nota_ref, numero))
+
+
+def _escrituras_guardar_dibujo(escrituras, nota_ref, dibujo, anterior=None):
+    """Guarda 'dibujo' (un valor o un dibujos.Segmento) en los trozos de la
+    nota en lugar del de 'anterior', el dibujo_info actual. Devuelve el
+    nuevo dibujo_info, None si 'dibujo' es None."""
+    if dibujo is None:
+        _escrituras_borrar_trozos(escrituras, nota_ref, anterior)
+        return None
+    segmento = dibujos.codificar(dibujo)
+    info = dibujos.info_dibujo(segmento)
+    _escrituras_trozos(escrituras, nota_ref, segmento, 0, 0)
+    _escrituras_borrar_trozos(escrituras, nota_ref, anterior, desde=info["trozos"])
+    return info
+
+
+def _leer_trozos(nota_ref, info, transaction=None):
+    """Dibujo guardado en los trozos que indica 'info'. Lanza
+    dibujos.DibujoCorrupto si no corresponden a su hash."""
+    refs = [_ref_trozo(nota_ref, n) for n in range(info["trozos"])]
+    if transaction is not None:
+        leidos = {d.reference.path: d for d in transaction.get_all(refs) if d.exists}
+    else:
+        leidos = leer_documentos(refs)
+
+    trozos = []
+    for ref in refs:
+        if ref.path not in leidos:
+            raise dibujos.DibujoCorrupto(f"Falta el trozo {ref.path}")
+        data = leidos[ref.path].to_dict()
+        trozos.append((data["segmento"], data["datos"]))
+    return dibujos.decodificar(trozos, info)
+
+
+def _dibujo_de_nota(nota_ref, nota, transaction=None):
+    """(dibujo, dibujo_info) de una nota ya leída, (None, None) si no tiene.
+    De las notas con el dibujo dentro del documento se calcula dibujo_info."""
+    info = nota.get("dibujo_info")
+    if info:
+        return _leer_trozos(nota_ref, info, transaction), info
+    dibujo = nota.get("dibujo")
+    if dibujo is None:
+        return None, None
+    return dibujo, dibujos.info_dibujo(dibujos.codificar(dibujo))
+
+
+def _leer_nota_con_dibujo(nota_ref, con_dibujo=True, field_paths=None, hashes_conocidos=()):
+    """Devuelve (snapshot, (dibujo, dibujo_info)). El segundo valor es None
+    si no se pide el dibujo, la nota no existe o su hash está en
+    'hashes_conocidos' (el cliente ya lo tiene y no se leen los trozos).
+
+    Los trozos se leen después que la nota: si entre medias se sustituye el
+    dibujo ya no cuadran con su hash y se vuelve a leer todo."""
+    for intento in range(INTENTOS_LECTURA_DIBUJO):
+        doc = nota_ref.get(field_paths=field_paths)
+        if not doc.exists or not con_dibujo:
+            return doc, None
+        nota = doc.to_dict()
+        if (nota.get("dibujo_info") or {}).get("hash") in hashes_conocidos:
+            return doc, None
+        try:
+            return doc, _dibujo_de_nota(nota_ref, nota)
+        except dibujos.DibujoCorrupto:
+            if intento == INTENTOS_LECTURA_DIBUJO - 1:
+                raise
+
+
+def obtener_dibujo(id_nota, hashes_conocidos=()):
+    """Devuelve (dibujo, dibujo_info) de la nota, (None, None) si no tiene
+    dibujo, o None si la nota no existe. Si el hash del dibujo está en
+    'hashes_conocidos' no se leen los trozos y el dibujo es None."""
+    nota_ref = db.collection("notas").document(id_nota)
+    doc, dibujo = _leer_nota_con_dibujo(nota_ref, field_paths=["dibujo", "dibujo_info"],
+                                        hashes_conocidos=hashes_conocidos)
+    if not doc.exists:
+        return None
+    return dibujo or (None, doc.to_dict().get("dibujo_info"))
+
+
+def anadir_trazos(id_nota, trazos, hash_base=None):
+    """Añade 'trazos' (una lista) al final del dibujo de la nota sin
+    reescribir lo ya guardado. Devuelve el nuevo dibujo_info, o None si la
+    nota no existe.
+
+    Con 'hash_base' lanza DibujoModificado si el dibujo actual no es ese.
+    Lanza dibujos.DibujoNoValido si el dibujo actual no es una lista y
+    dibujos.DibujoDemasiadoGrande si con los trazos supera el máximo."""
+    if not isinstance(trazos, list) or not trazos:
+        raise dibujos.DibujoNoValido("'trazos' debe ser una lista no vacía")
+    segmento = dibujos.codificar(trazos)
+    nota_ref = db.collection("notas").document(id_nota)
+
+    def planificar(transaction):
+        doc = next(iter(transaction.get_all([nota_ref])))
+        if not doc.exists:
+            return None, None
+        nota = doc.to_dict()
+        info = nota.get("dibujo_info")
+        escrituras = Escrituras()
+
+        if info and info["segmentos"] < MAX_SEGMENTOS_DIBUJO:
+            if hash_base and hash_base != info["hash"]:
+                raise DibujoModificado()
+            nuevo = dibujos.anadir_segmento(info, segmento)
+            _escrituras_trozos(escrituras, nota_ref, segmento, info["segmentos"], info["trozos"])
+        else:
+            # Sin dibujo, con el dibujo aún dentro de la nota o con demasiados
+            # segmentos: se guarda entero, ya con los trazos, en un segmento
+            actual, info_actual = _dibujo_de_nota(nota_ref, nota, transaction)
+            if hash_base and hash_base != (info_actual or {}).get("hash"):
+                raise DibujoModificado()
+            if actual is not None and not isinstance(actual, list):
+                raise dibujos.DibujoNoValido(
+                    "Solo se pueden añadir trazos a un dibujo que sea una lista")
+            nuevo = _escrituras_guardar_dibujo(escrituras, nota_ref,
+                                               (actual or []) + trazos, info)
+
+        escrituras.update(nota_ref, {
+            "dibujo_info": nuevo,
+            "dibujo": firestore.DELETE_FIELD,
+            "fecha_modificacion": firestore.SERVER_TIMESTAMP
+        })
+        escrituras.cambiar_version(nota.get("id_usuario"))
+        return escrituras, nuevo
+
+    return ejecutar_en_transaccion(planificar)
+
+
+def pasar_dibujo_a_trozos(id_nota):
+    """Mueve a trozos el dibujo de una nota que aún lo tiene dentro del
+    documento. Devuelve True si la nota se ha modificado."""
+    nota_ref = db.collection("notas").document(id_nota)
+
+    def planificar(transaction):
+        doc = next(iter(transaction.get_all([nota_ref])))
+        nota = doc.to_dict() if doc.exists else {}
+        if "dibujo" not in nota:
+            return None, False
+        escrituras = Escrituras()
+        cambios = {"dibujo": firestore.DELETE_FIELD}
+        if not nota.get("dibujo_info"):
+            cambios["dibujo_info"] = _escrituras_guardar_dibujo(escrituras, nota_ref,
+                                                                nota["dibujo"])
+        # No cambia el contenido de la nota, así que no se sube su versión
+        escrituras.update(nota_ref, cambios)
+        return escrituras, True
+
+    return ejecutar_en_transaccion(planificar)
+
+
+# ---------- SINCRONIZACIÓN INCREMENTAL ---------- #
+
+# Las notas borradas dejan una marca en notas_eliminadas/{id_nota} durante
+# RETENCION_ELIMINADAS_DIAS; después 'python mantenimiento.py eliminadas'
+# las purga. Un cliente que lleve más tiempo sin sincronizar debe volver a
+# descargar todas sus notas.
+RETENCION_ELIMINADAS_DIAS = int(os.environ.get("RETENCION_ELIMINADAS_DIAS", 30))
+
+
+class SincronizacionCaducada(Exception):
+    """'desde' es anterior a la retención de las notas eliminadas."""
+
+
+def _ref_eliminada(id_nota):
+    return db.collection("notas_eliminadas").document(id_nota)
+
+
+def limite_retencion_eliminadas():
+    return datetime.now(timezone.utc) - timedelta(days=RETENCION_ELIMINADAS_DIAS)
+
+
+def obtener_cambios_notas(id_usuario, desde=None):
+    """Notas creadas o modificadas y notas eliminadas después de 'desde'
+    (datetime con zona horaria; None para la primera sincronización).
+
+    Devuelve {"notas": [...], "eliminadas": [ids], "hasta": texto}. El
+    cliente guarda "hasta" y lo envía como 'desde' la próxima vez. Es la
+    fecha más reciente de lo devuelto, no la hora del servidor, así que no
+    depende del reloj del servidor.
+    """
+    if desde and desde < limite_retencion_eliminadas():
+        raise SincronizacionCaducada()
+
+    notas = db.collection("notas").where("id_usuario", "==", id_usuario)
+    eliminadas = db.collection("notas_eliminadas").where("id_usuario", "==", id_usuario)
+    if desde:
+        notas = notas.where("fecha_modificacion", ">", desde)
+        eliminadas = eliminadas.where("fecha_eliminacion", ">", desde)
+
+    def planificar(transaction):
+        # Las dos consultas en la misma transacción ven el mismo instante:
+        # ningún cambio anterior a "hasta" puede quedar fuera
+        return None, (list(transaction.get(notas)), list(transaction.get(eliminadas)))
+
+    docs_notas, docs_eliminadas = ejecutar_en_transaccion(planificar, solo_lectura=True)
+
+    fechas = [d.to_dict().get("fecha_modificacion") for d in docs_notas] + \
+             [d.to_dict().get("fecha_eliminacion") for d in docs_eliminadas]
+    hasta = max([f for f in fechas if f] + ([desde] if desde else []), default=None)
+
+    return {
+        "notas": [_serializar_nota(d) for d in docs_notas],
+        "eliminadas": [d.id for d in docs_eliminadas],
+        "hasta": serializar_timestamp(hasta)
+    }
+
+
+# ---------- BÚSQUEDA ---------- #
+
+# notas_busqueda/{id_nota} guarda los términos normalizados de la nota
+# (ver busqueda.py) y su peso: {"id_usuario", "terminos": [...],
+# "pesos": {término: peso}}. Se reescribe en el mismo lote que la nota, así
+# que buscar es una consulta array-contains-any sobre el índice de Firestore
+# en lugar de leer todas las notas.
+CAMPOS_BUSQUEDA = ["titulo", "contenido", "etiquetas"]
+
+MAX_RESULTADOS_BUSQUEDA = 50
+
+
+def _ref_busqueda(id_nota):
+    return db.collection("notas_busqueda").document(id_nota)
+
+
+def datos_busqueda_nota(nota):
+    """Documento de notas_busqueda a partir de la nota completa (al menos
+    id_usuario y los CAMPOS_BUSQUEDA)."""
+    pesos = pesos_nota(nota.get("titulo"), descomprimir_contenido(nota.get("contenido")),
+                       nota.get("etiquetas"))
+    return {
+        "id_usuario": nota.get("id_usuario"),
+        "terminos": list(pesos),
+        "pesos": pesos
+    }
+
+
+def buscar_notas(id_usuario, texto, limite=20):
+    """Notas del usuario que contienen alguno de los términos de 'texto',
+    de más a menos relevante. Cada nota se devuelve en su forma resumida
+    (CAMPOS_RESUMEN_NOTA) con su "puntuacion"."""
+    consulta = terminos_consulta(texto)
+    if not consulta:
+        return []
+
+    # Solo se traen los pesos de los términos buscados, no todos los de la
+    # nota. Los términos pueden empezar por un dígito ("2024"): van entre
+    # comillas en la ruta
+    docs = db.collection("notas_busqueda")\
+             .where("id_usuario", "==", id_usuario)\
+             .where("terminos", "array-contains-any", consulta)\
+             .select([ruta_campo("pesos", t) for t in consulta])\
+             .stream()
+    candidatos = [(d.id, d.to_dict().get("pesos", {})) for d in docs]
+    mejores = ordenar_resultados(candidatos, consulta)[:limite]
+
+    coleccion = db.collection("notas")
+    leidas = leer_documentos([coleccion.document(i) for i, _ in mejores],
+                             field_paths=CAMPOS_RESUMEN_NOTA)
+    resultados = []
+    for id_nota, puntuacion in mejores:
+        d = leidas.get(f"notas/{id_nota}")
+        if d:
+            resultados.append({**_serializar_nota(d), "puntuacion": puntuacion})
+    return resultados
+
+
+# ---------- LECTURA DE NOTAS POR LOTES ---------- #
+
+# Firestore acepta como máximo 30 valores en un filtro "in"
+TAMANO_LOTE_NOTAS = 30
+
+# Con FIRESTORE_ASINCRONO=1 las lecturas por lotes independientes se lanzan
+# a la vez desde el bucle de asincrono.py en lugar de una detrás de otra.
+# Solo lo usan obtener_notas_por_ids, obtener_notas_categoria y
+# leer_documentos; el resto de lecturas y las escrituras siguen siendo
+# síncronas. Está desactivado por defecto (también en render.yaml)
+bucle = BucleAsincrono(lambda: obtener_cliente_asincrono(db))
+
+
+def _consulta_ids_notas_categoria(cliente, id_categoria, id_usuario):
+    # Sin filtrar por id_usuario: las relaciones antiguas no lo guardan (hasta
+    # ejecutar "python mantenimiento.py relaciones") y se perderían sus notas.
+    # El dueño se comprueba al leer las notas en obtener_notas_por_ids.
+    return cliente.collection("notas_categoriaNota")\
+                  .where("id_categoriaNota", "==", id_categoria)\
+                  .select(["id_nota"])
+
+
+def _ids_unicos(rels):
+    # Hasta compactar las relaciones antiguas puede haber filas repetidas;
+    # conservamos el primer orden de aparición
+    ids = {}
+    for r in rels:
+        id_nota = r.to_dict().get("id_nota")
+        if id_nota:
+            ids[id_nota] = True
+    return list(ids)
+
+
+def obtener_ids_notas_categoria(id_categoria, id_usuario):
+    return _ids_unicos(_consulta_ids_notas_categoria(db, id_categoria, id_usuario).stream())
+
+
+def _consulta_notas_por_ids(cliente, ids_lote, id_usuario):
+    coleccion = cliente.collection("notas")
+    return coleccion.where("__name__", "in", [coleccion.document(i) for i in ids_lote])\
+                    .where("id_usuario", "==", id_usuario)
+
+
+def _lotes(elementos, tamano):
+    return [elementos[i:i + tamano] for i in range(0, len(elementos), tamano)]
+
+
+def obtener_notas_por_ids(ids_notas, id_usuario):
+    """Obtiene varias notas en lotes de TAMANO_LOTE_NOTAS documentos por
+    consulta, filtrando por dueño en el propio servidor."""
+    if bucle.activo:
+        return bucle.ejecutar(_obtener_notas_por_ids_async(ids_notas, id_usuario))
+
+    encontradas = {}
+    for lote in _lotes(ids_notas, TAMANO_LOTE_NOTAS):
+        for d in _consulta_notas_por_ids(db, lote, id_usuario).stream():
+            encontradas[d.id] = _serializar_nota(d)
+
+    return [encontradas[i] for i in ids_notas if i in encontradas]
+
+
+async def _obtener_notas_por_ids_async(ids_notas, id_usuario):
+    cliente = await bucle.cliente()
+
+    async def leer_lote(lote):
+        return [d async for d in _consulta_notas_por_ids(cliente, lote, id_usuario).stream()]
+
+    encontradas = {}
+    for docs in await asyncio.gather(*(leer_lote(l) for l in _lotes(ids_notas, TAMANO_LOTE_NOTAS))):
+        for d in docs:
+            encontradas[d.id] = _serializar_nota(d)
+
+    return [encontradas[i] for i in ids_notas if i in encontradas]
+
+
+def obtener_notas_categoria(id_usuario, id_categoria):
+    """Notas del usuario que están en la categoría, en el orden de sus
+    relaciones."""
+    if bucle.activo:
+        return bucle.ejecutar(_obtener_notas_categoria_async(id_usuario, id_categoria))
+
+    ids_notas = obtener_ids_notas_categoria(id_categoria, id_usuario)
+    return obtener_notas_por_ids(ids_notas, id_usuario) if ids_notas else []
+
+
+async def _obtener_notas_categoria_async(id_usuario, id_categoria):
+    # Todo en el bucle: la consulta de relaciones y después todos los
+    # lotes de notas a la vez, sin volver al hilo de la petición entre medias
+    cliente = await bucle.cliente()
+    rels = [r async for r in _consulta_ids_notas_categoria(cliente, id_categoria, id_usuario).stream()]
+    ids_notas = _ids_unicos(rels)
+    return await _obtener_notas_por_ids_async(ids_notas, id_usuario) if ids_notas else []
+
+
+# Documentos por llamada a get_all en lecturas masivas
+TAMANO_LOTE_LECTURA = 100
+
+
+def leer_documentos(refs, field_paths=None):
+    """Lee varios documentos con get_all en lotes. Devuelve {ruta: snapshot}
+    solo con los que existen. Con field_paths solo se traen esos campos."""
+    if bucle.activo:
+        return bucle.ejecutar(_leer_documentos_async([r.path for r in refs], field_paths))
+
+    existentes = {}
+    for lote in _lotes(refs, TAMANO_LOTE_LECTURA):
+        for d in db.get_all(lote, field_paths=field_paths):
+            if d.exists:
+                existentes[d.reference.path] = d
+    return existentes
+
+
+async def _leer_documentos_async(rutas, field_paths=None):
+    cliente = await bucle.cliente()
+
+    async def leer_lote(lote):
+        refs = [cliente.document(r) for r in lote]
+        return [d async for d in cliente.get_all(refs, field_paths=field_paths)]
+
+    existentes = {}
+    for docs in await asyncio.gather(*(leer_lote(l) for l in _lotes(rutas, TAMANO_LOTE_LECTURA))):
+        for d in docs:
+            if d.exists:
+                existentes[d.reference.path] = d
+    return existentes
+
+
+def leer_notas(ids_notas):
+    """Como leer_documentos pero para notas: devuelve {id_nota: snapshot}."""
+    coleccion = db.collection("notas")
+    leidos = leer_documentos([coleccion.document(i) for i in ids_notas])
+    return {d.id: d for d in leidos.values()}
+
+
+# ---------- OPERACIONES MASIVAS SOBRE NOTAS ---------- #
+
+OPERACIONES_NOTAS = ("crear", "obtener", "actualizar", "eliminar")
+CAMPOS_CREAR_NOTA = ("id_usuario", "id_plantilla", "titulo", "contenido")
+
+
+def _resultado(indice, op, status, **extra):
+    return {"indice": indice, "op": op, "ok": status < 400, "status": status, **extra}
+
+
+def _error_dibujo(indice, op, error, **extra):
+    status = 413 if isinstance(error, dibujos.DibujoDemasiadoGrande) else 400
+    return _resultado(indice, op, status, error=str(error), **extra)
+
+
+class _PlanNota:
+    """Una operación masiva ya validada: qué estado necesita leer y cómo
+    generar sus escrituras a partir de él. 'escrituras' es una cota de las
+    que ocupa y 'bytes_dibujo' lo que ocupan los trozos de dibujo que
+    escribe."""
+
+    def __init__(self, indice, resultado, planificar, ids_notas=(), ids_categorias=(),
+                 escrituras=MAX_ESCRITURAS_POR_NOTA, bytes_dibujo=0):
+        self.indice = indice
+        self.resultado = resultado
+        self.planificar = planificar
+        self.ids_notas = list(ids_notas)
+        self.ids_categorias = list(ids_categorias)
+        self.escrituras = escrituras
+        self.bytes_dibujo = bytes_dibujo
+
+
+def _repartir_en_lotes(planes):
+    """Agrupa los planes en lotes de hasta MAX_OPERACIONES_LOTE escrituras y
+    MAX_BYTES_DIBUJO_LOTE bytes de dibujos, sin partir nunca un plan."""
+    lote, escrituras, bytes_dibujo = [], 0, 0
+    for plan in planes:
+        if lote and (escrituras + plan.escrituras > MAX_OPERACIONES_LOTE
+                     or bytes_dibujo + plan.bytes_dibujo > MAX_BYTES_DIBUJO_LOTE):
+            yield lote
+            lote, escrituras, bytes_dibujo = [], 0, 0
+        lote.append(plan)
+        escrituras += plan.escrituras
+        bytes_dibujo += plan.bytes_dibujo
+    if lote:
+        yield lote
+
+
+def _guardar_lote(planes):
+    """Guarda las escrituras de varios planes juntas. Si alguno necesita
+    leer relaciones o categorías se usa una transacción; si no, un lote."""
+    ids_notas = [i for p in planes for i in p.ids_notas]
+    ids_categorias = [c for p in planes for c in p.ids_categorias]
+
+    def planificar(transaction):
+        estado = _leer_estado_categorias(transaction, list(dict.fromkeys(ids_notas)),
+                                         list(dict.fromkeys(ids_categorias)))
+        escrituras = Escrituras()
+        for plan in planes:
+            plan.planificar(escrituras, estado)
+        return escrituras, True
+
+    if ids_notas:
+        ejecutar_en_transaccion(planificar)
+        return
+
+    escrituras = Escrituras()
+    for plan in planes:
+        plan.planificar(escrituras, None)
+    escrituras.commit()
+
+
+def ejecutar_operaciones_notas(operaciones):
+    """Ejecuta una lista de operaciones sobre notas y devuelve un resultado
+    por operación, en el mismo orden.
+
+    Cada operación es un dict con "op" y sus datos:
+        {"op": "crear", "datos": {...}}         mismo cuerpo que /api/notas/nueva
+        {"op": "obtener", "id_nota": "..."}
+        {"op": "actualizar", "id_nota": "...", "cambios": {...}}
+        {"op": "eliminar", "id_nota": "..."}
+
+    Las escrituras se reparten en lotes de hasta MAX_OPERACIONES_LOTE sin
+    partir nunca una operación entre dos lotes; las lecturas usan get_all.
+    Los lotes con eliminaciones o cambios de categoría se guardan en una
+    transacción para que los contadores de las categorías cuadren.
+    Las operaciones "obtener" se resuelven después de las escrituras.
+    """
+    resultados = [None] * len(operaciones)
+    planes = []
+    a_obtener = []       # (indice, id_nota)
+
+    # 1. Comprobar de una vez qué notas y categorías existen antes de escribir
+    refs_previas = []
+    for o in operaciones:
+        if not isinstance(o, dict):
+            continue
+        if o.get("op") in ("actualizar", "eliminar") and isinstance(o.get("id_nota"), str):
+            refs_previas.append(db.collection("notas").document(o["id_nota"]))
+        datos = o.get("datos") if o.get("op") == "crear" else o.get("cambios")
+        if isinstance(datos, dict) and isinstance(datos.get("id_categoriaNota"), str):
+            refs_previas.append(_ref_categoria(datos["id_categoriaNota"]))
+    # {ruta: snapshot}; de las notas se toma el dueño para subir su versión
+    existentes = leer_documentos(list(dict.fromkeys(refs_previas)))
+
+    categorias_nuevas = {}
+    actuales = {}        # id_nota -> datos de la nota tras las operaciones ya planificadas
+    for indice, operacion in enumerate(operaciones):
+        op = operacion.get("op") if isinstance(operacion, dict) else None
+        if op not in OPERACIONES_NOTAS:
+            resultados[indice] = _resultado(
+                indice, op, 400, error=f"'op' debe ser uno de: {', '.join(OPERACIONES_NOTAS)}")
+            continue
+
+        if op == "crear":
+            datos = operacion.get("datos")
+            if not isinstance(datos, dict) or not all(c in datos for c in CAMPOS_CREAR_NOTA):
+                resultados[indice] = _resultado(indice, op, 400, error="Faltan campos requeridos")
+                continue
+
+            id_categoriaNota = datos.get("id_categoriaNota")
+            categoria_nombre = datos.get("categoria_nombre")
+            nombre_nuevo = None
+            if not id_categoriaNota and categoria_nombre:
+                id_categoriaNota = categorias_nuevas.get(categoria_nombre) \
+                    or obtener_categoria_por_nombre(categoria_nombre)
+                if not id_categoriaNota:
+                    id_categoriaNota = db.collection("categoriaNota").document().id
+                    categorias_nuevas[categoria_nombre] = id_categoriaNota
+                if categorias_nuevas.get(categoria_nombre) == id_categoriaNota:
+                    # Cada nota que usa una categoría nueva la incluye en sus
+                    # escrituras, así la relación nunca queda huérfana aunque
+                    # acabe en otro lote
+                    nombre_nuevo = categoria_nombre
+            elif id_categoriaNota and f"categoriaNota/{id_categoriaNota}" not in existentes:
+                resultados[indice] = _resultado(
+                    indice, op, 404, id_categoriaNota=id_categoriaNota,
+                    error="La categoría no existe")
+                continue
+            if not id_categoriaNota:
+                resultados[indice] = _resultado(
+                    indice, op, 400,
+                    error="Debes enviar 'id_categoriaNota' o 'categoria_nombre'")
+                continue
+
+            # El dibujo se codifica ya para saber cuánto ocupa en el lote
+            segmento = None
+            if datos.get("dibujo") is not None:
+                try:
+                    segmento = dibujos.codificar(datos["dibujo"])
+                except ValueError as e:
+                    resultados[indice] = _error_dibujo(indice, op, e)
+                    continue
+
+            nota_ref = db.collection("notas").document()
+            data = _datos_nota(datos["id_usuario"], datos["id_plantilla"],
+                               datos["titulo"], datos["contenido"],
+                               datos.get("etiquetas", []), segmento,
+                               datos.get("estado", "activa"),
+                               datos.get("animacion_fondo"), datos.get("color_fondo"))
+
+            def planificar(escrituras, estado, nota_ref=nota_ref, data=data,
+                           id_categoriaNota=id_categoriaNota, nombre_nuevo=nombre_nuevo):
+                if nombre_nuevo:
+                    _escrituras_crear_categoria(escrituras, nombre_nuevo,
+                                                _ref_categoria(id_categoriaNota))
+                _escrituras_crear_nota(escrituras, nota_ref, data, id_categoriaNota)
+
+            planes.append(_PlanNota(indice, _resultado(
+                indice, op, 200, id_nota=nota_ref.id, id_categoriaNota=id_categoriaNota),
+                planificar,
+                escrituras=MAX_ESCRITURAS_POR_NOTA + (len(segmento.trozos()) if segmento else 0),
+                bytes_dibujo=segmento.comprimido if segmento else 0))
+            continue
+
+        id_nota = operacion.get("id_nota")
+        if not isinstance(id_nota, str) or not id_nota:
+            resultados[indice] = _resultado(indice, op, 400, error="Falta 'id_nota'")
+            continue
+
+        if op == "obtener":
+            a_obtener.append((indice, id_nota))
+            continue
+
+        if f"notas/{id_nota}" not in existentes:
+            resultados[indice] = _resultado(
+                indice, op, 404, id_nota=id_nota, error="Nota no encontrada")
+            continue
+
+        nota_ref = db.collection("notas").document(id_nota)
+        if id_nota not in actuales:
+            actuales[id_nota] = existentes[f"notas/{id_nota}"].to_dict()
+        nota = actuales[id_nota]
+        if op == "actualizar":
+            cambios = operacion.get("cambios")
+            if not isinstance(cambios, dict) or not cambios:
+                resultados[indice] = _resultado(indice, op, 400, error="Falta 'cambios'")
+                continue
+            # Igual que PUT /api/nota/<id_nota>: el cambio de categoría es opcional
+            id_categoriaNota = cambios.get("id_categoriaNota")
+            if cambios.get("categoria_nombre"):
+                id_categoriaNota = obtener_o_crear_categoria_por_nombre(cambios["categoria_nombre"])
+            elif id_categoriaNota and f"categoriaNota/{id_categoriaNota}" not in existentes:
+                resultados[indice] = _resultado(
+                    indice, op, 404, id_nota=id_nota, id_categoriaNota=id_categoriaNota,
+                    error="La categoría no existe")
+                continue
+
+            cambios = dict(cambios)
+            trozos_anteriores = (nota.get("dibujo_info") or {}).get("trozos", 0)
+            trozos_nuevos = bytes_dibujo = 0
+            if cambios.get("dibujo") is not None:
+                try:
+                    cambios["dibujo"] = dibujos.codificar(cambios["dibujo"])
+                except ValueError as e:
+                    resultados[indice] = _error_dibujo(indice, op, e, id_nota=id_nota)
+                    continue
+                trozos_nuevos = len(cambios["dibujo"].trozos())
+                bytes_dibujo = cambios["dibujo"].comprimido
+
+            def planificar(escrituras, estado, nota_ref=nota_ref, cambios=cambios,
+                           id_categoriaNota=id_categoriaNota, nota=nota):
+                if id_categoriaNota:
+                    _escrituras_mover_nota(escrituras, nota_ref.id, id_categoriaNota, estado,
+                                           nota.get("id_usuario"))
+                _escrituras_actualizar_nota(escrituras, nota_ref, cambios, nota)
+            # Otra actualización posterior de la misma nota parte de esta
+            actuales[id_nota] = {**nota, **cambios}
+            if "dibujo" in cambios:
+                # ... y debe borrar también los trozos que escriba esta
+                actuales[id_nota]["dibujo_info"] = {
+                    "trozos": max(trozos_anteriores, trozos_nuevos)}
+
+            planes.append(_PlanNota(
+                indice, _resultado(indice, op, 200, id_nota=id_nota), planificar,
+                [id_nota] if id_categoriaNota else [],
+                [id_categoriaNota] if id_categoriaNota else [],
+                escrituras=MAX_ESCRITURAS_POR_NOTA + trozos_anteriores + trozos_nuevos,
+                bytes_dibujo=bytes_dibujo))
+        else:
+            def planificar(escrituras, estado, nota_ref=nota_ref, nota=nota):
+                _escrituras_eliminar_nota(escrituras, nota_ref, estado, nota)
+
+            planes.append(_PlanNota(
+                indice, _resultado(indice, op, 200, id_nota=id_nota), planificar, [id_nota],
+                escrituras=MAX_ESCRITURAS_POR_NOTA
+                + (nota.get("dibujo_info") or {}).get("trozos", 0)))
+            # Las operaciones posteriores sobre esta nota ya no la encuentran
+            existentes.pop(f"notas/{id_nota}")
+
+    # 2. Repartir las escrituras en lotes sin superar los límites de Firestore
+    for lote in _repartir_en_lotes(planes):
+        try:
+            _guardar_lote(lote)
+            for plan in lote:
+                resultados[plan.indice] = plan.resultado
+        except Exception as e:
+            print("ERROR en lote de notas:", e)
+            for plan in lote:
+                resultados[plan.indice] = _resultado(
+                    plan.indice, plan.resultado["op"], 500,
+                    id_nota=plan.resultado.get("id_nota"),
+                    error="No se pudo guardar el lote")
+
+    # 3. Lecturas al final para que reflejen las escrituras de esta petición
+    leidas = leer_notas(list(dict.fromkeys(id_nota for _, id_nota in a_obtener)))
+    for indice, id_nota in a_obtener:
+        if id_nota in leidas:
+            resultados[indice] = _resultado(
+                indice, "obtener", 200, id_nota=id_nota, nota=_serializar_nota(leidas[id_nota]))
+        else:
+            resultados[indice] = _resultado(
+                indice, "obtener", 404, id_nota=id_nota, error="Nota no encontrada")
+
+    return resultados
+
+
+# ---------- MÉTODOS PARA CATEGORÍAS (LISTADO/UPDATE/DELETE) ---------- #
+
+def iterar_categorias(id_usuario=None):
+    """Genera las categorías (todas si no se indica usuario) a medida que
+    llegan de la consulta."""
+    ref = db.collection("categoriaNota")
+    if id_usuario:
+        ref = ref.where("id_usuario", "==", id_usuario)
+
+    for d in ref.stream():
+        data = d.to_dict()
+        if data:
+            yield {
+                "id": d.id,
+                "nombre": data.get("nombre", ""),
+                "usuarioId": data.get("id_usuario", ""), # Devolvemos también el ID
+                "num_notas": data.get("num_notas", 0)
+            }
+
+
+# Intentos de eliminar_categoria si la categoría cambia entre la lectura y el borrado
+INTENTOS_ELIMINAR_CATEGORIA = 3
 
-# ---------- MÉTODOS PARA CATEGORÍAS (UPDATE/DELETE) ---------- #
 
 def actualizar_categoria(id_categoria, nuevo_nombre):
+    """Renombra la categoría. Devuelve False si no existe: update ya exige
+    que exista, así que no hace falta leerla antes."""
     doc_ref = db.collection("categoriaNota").document(id_categoria)
-    doc_ref.update({"nombre": nuevo_nombre})
+    try:
+        doc_ref.update({"nombre": nuevo_nombre})
+    except error_no_encontrado():
+        return False
+    indice_categorias.limpiar()
     return True
 
 
 def eliminar_categoria(id_categoria):
+    """Elimina la categoría si no tiene notas. Devuelve None si no existe,
+    False si tiene notas y True si se ha eliminado.
+
+    El borrado solo se aplica si la categoría no ha cambiado desde que se
+    leyó su contador (precondición last_update_time): si entre medias se
+    le añade una nota, se vuelve a comprobar. En las categorías sin contador
+    (anteriores a num_notas) se busca una relación con alguna nota."""
     doc_ref = db.collection("categoriaNota").document(id_categoria)
-    doc_ref.delete()
-    return True
+    for _ in range(INTENTOS_ELIMINAR_CATEGORIA):
+        doc = doc_ref.get(field_paths=["num_notas"])
+        if not doc.exists:
+            return None
+        num_notas = doc.to_dict().get("num_notas")
+        if num_notas is None:
+            num_notas = len(db.collection("notas_categoriaNota")
+                              .where("id_categoriaNota", "==", id_categoria)
+                              .limit(1).get())
+        if num_notas > 0:
+            return False
+        try:
+            doc_ref.delete(option=db.write_option(last_update_time=doc.update_time))
+        except error_precondicion():
+            continue
+        indice_categorias.limpiar()
+        return True
+    raise error_precondicion()(f"La categoría {id_categoria} cambia continuamente")
+
+# ---------- DESBLOQUEOS DEL USUARIO ---------- #
+
+# Un documento por usuario (id = id_usuario) con todo lo que ha comprado:
+#   {"plantillas": [...], "features": [...]}
+# Las transacciones de compra lo actualizan junto con el cobro, así que cada
+# comprobación de desbloqueo es una sola lectura puntual.
+# Los usuarios que compraron antes de existir este documento no lo tienen:
+# la primera vez que se consulta se crea a partir de las colecciones de
+# compras (usuarios_plantillas y usuarios_features). También se pueden
+# migrar todos de una vez con: python mantenimiento.py desbloqueos
+
+PREFIJO_FUENTE = "font_"
+PREFIJO_FONDO = "assets/animations/"
+
+
+def _ref_desbloqueos(id_usuario):
+    return db.collection("usuarios_desbloqueos").document(id_usuario)
+
+
+def _desbloqueos_antiguos(id_usuario, transaction=None):
+    """Lo comprado según usuarios_plantillas y usuarios_features, para los
+    usuarios que aún no tienen documento de desbloqueos."""
+    consultas = (
+        ("plantillas", "id_plantilla",
+         db.collection("usuarios_plantillas").where("id_usuario", "==", id_usuario)),
+        ("features", "feature",
+         db.collection("usuarios_features").where("id_usuario", "==", id_usuario)),
+    )
+    desbloqueos = {}
+    for clave, campo, consulta in consultas:
+        docs = transaction.get(consulta) if transaction else consulta.stream()
+        valores = []
+        for d in docs:
+            valor = d.to_dict().get(campo)
+            if valor and valor not in valores:
+                valores.append(valor)
+        desbloqueos[clave] = valores
+    return desbloqueos
+
+
+def _crear_desbloqueos(id_usuario):
+    """Crea el documento de desbloqueos de un usuario anterior a él con lo
+    que ya había comprado. ArrayUnion no pisa una compra que lo cree a la vez."""
+    desbloqueos = _desbloqueos_antiguos(id_usuario)
+    _ref_desbloqueos(id_usuario).set({
+        "id_usuario": id_usuario,
+        "plantillas": firestore.ArrayUnion(desbloqueos["plantillas"]),
+        "features": firestore.ArrayUnion(desbloqueos["features"]),
+        "fecha_actualizacion": firestore.SERVER_TIMESTAMP
+    }, merge=True)
+    return desbloqueos
+
+
+def obtener_desbloqueos(id_usuario):
+    doc = _ref_desbloqueos(id_usuario).get()
+    if not doc.exists:
+        return _crear_desbloqueos(id_usuario)
+    data = doc.to_dict()
+    return {
+        "plantillas": data.get("plantillas", []),
+        "features": data.get("features", [])
+    }
+
+
+def agrupar_features(features):
+    """Separa las features por tipo: fuentes (sin el prefijo 'font_'),
+    fondos animados y el resto."""
+    grupos = {"fuentes": [], "fondos": [], "otras": []}
+    for f in features:
+        if f.startswith(PREFIJO_FUENTE):
+            grupos["fuentes"].append(f[len(PREFIJO_FUENTE):])
+        elif f.startswith(PREFIJO_FONDO):
+            grupos["fondos"].append(f)
+        else:
+            grupos["otras"].append(f)
+    return grupos
+
+
+def obtener_fuentes_desbloqueadas(id_usuario):
+    return agrupar_features(obtener_desbloqueos(id_usuario)["features"])["fuentes"]
+
+
+def obtener_fondos_desbloqueados(id_usuario):
+    return agrupar_features(obtener_desbloqueos(id_usuario)["features"])["fondos"]
+
+
+def obtener_resumen_usuario(id_usuario):
+    """Monedas, plantillas y features agrupadas, leyendo el documento del
+    usuario y el de desbloqueos en una sola llamada."""
+    user_ref = db.collection("usuarios").document(id_usuario)
+    desbloqueos_ref = _ref_desbloqueos(id_usuario)
+
+    # get_all no garantiza el orden de los resultados
+    docs = {d.reference.path: d for d in db.get_all([user_ref, desbloqueos_ref])}
+    usuario = docs[user_ref.path]
+    desbloqueos = docs[desbloqueos_ref.path]
+
+    data_usuario = usuario.to_dict() if usuario.exists else {}
+    data_desbloqueos = desbloqueos.to_dict() if desbloqueos.exists else _crear_desbloqueos(id_usuario)
+    return {
+        "monedas": data_usuario.get("monedas", 0),
+        "plantillas": data_desbloqueos.get("plantillas", []),
+        "features": agrupar_features(data_desbloqueos.get("features", []))
+    }
+
 
 # firestore.py
 
@@ -147,13 +1794,48 @@ def obtener_monedas_usuario(id_usuario):
         return doc.to_dict().get("monedas", 0)
     return 0
 
+def _leer_compra(transaction, user_ref, id_usuario):
+    """(usuario, desbloqueos, existe) leídos dentro de la transacción de
+    compra: así se comprueba si ya lo tiene sin una lectura aparte, y dos
+    compras a la vez del mismo producto no lo cobran dos veces.
+
+    Si el usuario aún no tiene documento de desbloqueos (existe=False) lo
+    comprado se lee de las colecciones de compras, también en la transacción."""
+    desbloqueos_ref = _ref_desbloqueos(id_usuario)
+    # get_all no garantiza el orden de los resultados
+    docs = {d.reference.path: d for d in transaction.get_all([user_ref, desbloqueos_ref])}
+    desbloqueos = docs[desbloqueos_ref.path]
+    if desbloqueos.exists:
+        return docs[user_ref.path], desbloqueos.to_dict(), True
+    return docs[user_ref.path], _desbloqueos_antiguos(id_usuario, transaction), False
+
+
+def _resumen_tras_compra(id_usuario, desbloqueos, existe, clave, valor):
+    """Escritura (merge) del documento de desbloqueos al comprar 'valor'.
+    Si aún no existía se crea con todo lo comprado antes."""
+    datos = {
+        "id_usuario": id_usuario,
+        clave: firestore.ArrayUnion([valor]),
+        "fecha_actualizacion": firestore.SERVER_TIMESTAMP
+    }
+    if not existe:
+        for k in ("plantillas", "features"):
+            datos[k] = firestore.ArrayUnion(desbloqueos[k] + ([valor] if k == clave else []))
+    return datos
+
+
 def realizar_compra_plantilla(id_usuario, id_plantilla, costo):
+    """Cobra la plantilla y la desbloquea. Si el usuario ya la tiene no
+    cobra nada y devuelve (True, "Ya tienes esta plantilla")."""
     user_ref = db.collection("usuarios").document(id_usuario)
     
     # Usamos una transacción para asegurar que no se descuenten monedas sin dar el producto
     @firestore.transactional
     def transaccion_compra(transaction, user_ref):
-        snapshot = user_ref.get(transaction=transaction)
+        snapshot, desbloqueos, existe = _leer_compra(transaction, user_ref, id_usuario)
+        if id_plantilla in desbloqueos.get("plantillas", []):
+            return True, "Ya tienes esta plantilla"
+
         monedas_actuales = snapshot.get("monedas")
         
         if monedas_actuales < costo:
@@ -169,40 +1851,38 @@ def realizar_compra_plantilla(id_usuario, id_plantilla, costo):
             "id_plantilla": id_plantilla,
             "fecha_compra": firestore.SERVER_TIMESTAMP
         })
+
+        # 3. Mantener al día el resumen de desbloqueos del usuario
+        transaction.set(_ref_desbloqueos(id_usuario), _resumen_tras_compra(
+            id_usuario, desbloqueos, existe, "plantillas", id_plantilla), merge=True)
         return True, "Compra exitosa"
 
     transaction = db.transaction()
     return transaccion_compra(transaction, user_ref)
 
 def plantilla_esta_desbloqueada(id_usuario, id_plantilla):
-    # Verifica si existe el registro de compra
-    docs = db.collection("usuarios_plantillas")\
-             .where("id_usuario", "==", id_usuario)\
-             .where("id_plantilla", "==", id_plantilla).stream()
-    return any(docs)
+    return id_plantilla in obtener_desbloqueos(id_usuario)["plantillas"]
 
 def obtener_plantillas_desbloqueadas_usuario(id_usuario):
-    # Buscamos en la colección de transacciones/compras
-    docs = db.collection("usuarios_plantillas")\
-             .where("id_usuario", "==", id_usuario).stream()
-    
-    return [d.to_dict().get("id_plantilla") for d in docs]
+    return obtener_desbloqueos(id_usuario)["plantillas"]
 
 # firestore.py - Añadir estas funciones al final
 
 def usuario_tiene_feature(id_usuario, feature_name):
     """Verifica si el usuario ya compró una funcionalidad (ej: 'multimedia_images')"""
-    docs = db.collection("usuarios_features")\
-             .where("id_usuario", "==", id_usuario)\
-             .where("feature", "==", feature_name).stream()
-    return any(docs)
+    return feature_name in obtener_desbloqueos(id_usuario)["features"]
 
 def realizar_compra_feature(id_usuario, feature_name, costo=20):
+    """Cobra la funcionalidad y la desbloquea. Si el usuario ya la tiene no
+    cobra nada y devuelve (True, "Ya lo tienes")."""
     user_ref = db.collection("usuarios").document(id_usuario)
     
     @firestore.transactional
     def transaccion_compra(transaction, user_ref):
-        snapshot = user_ref.get(transaction=transaction)
+        snapshot, desbloqueos, existe = _leer_compra(transaction, user_ref, id_usuario)
+        if feature_name in desbloqueos.get("features", []):
+            return True, "Ya lo tienes"
+
         if not snapshot.exists:
             return False, "Usuario no existe"
         
@@ -221,7 +1901,68 @@ def realizar_compra_feature(id_usuario, feature_name, costo=20):
             "feature": feature_name,
             "fecha_compra": firestore.SERVER_TIMESTAMP
         })
+
+        # 3. Mantener al día el resumen de desbloqueos del usuario
+        transaction.set(_ref_desbloqueos(id_usuario), _resumen_tras_compra(
+            id_usuario, desbloqueos, existe, "features", feature_name), merge=True)
         return True, "Desbloqueado correctamente"
 
     transaction = db.transaction()
-    return transaccion_compra(transaction, user_ref)
\ No newline at end of file
+    return transaccion_compra(transaction, user_ref)
+
+
+# ---------- ARRANQUE DE WORKERS ---------- #
+
+def calentar_clientes():
+    """Abre el canal gRPC y obtiene el token de acceso con una lectura
+    mínima, para que no lo pague la primera petición del worker. Si el modo
+    asíncrono está activo calienta también el cliente del bucle."""
+    ref = db.collection("usuarios_versiones").document("_calentamiento")
+    ref.get(field_paths=[])
+
+    if bucle.activo:
+        async def calentar_asincrono():
+            cliente = await bucle.cliente()
+            await cliente.document(ref.path).get(field_paths=[])
+
+        bucle.ejecutar(calentar_asincrono())
+
+
+# ---------- MÉTRICAS ---------- #
+
+# Documentos leídos y escritos, por ruta (ver metricas.py)
+observar_llamadas(registrar_llamada)
+
+# Funciones de datos que usan las rutas: se mide cuánto tarda cada una
+medir_funciones(globals(), [
+    "crear_nota",
+    "crear_nota_con_categoria",
+    "actualizar_nota",
+    "nota_existe",
+    "obtener_version_nota",
+    "eliminar_nota",
+    "iterar_notas_usuario",
+    "obtener_pagina_notas_usuario",
+    "obtener_nota_versionada",
+    "obtener_dibujo",
+    "anadir_trazos",
+    "obtener_version_notas",
+    "obtener_cambios_notas",
+    "buscar_notas",
+    "obtener_etiquetas_usuario",
+    "obtener_notas_categoria",
+    "ejecutar_operaciones_notas",
+    "iterar_categorias",
+    "obtener_o_crear_categoria_por_nombre",
+    "crear_relacion_nota_categoria",
+    "actualizar_categoria",
+    "eliminar_categoria",
+    "realizar_compra_plantilla",
+    "realizar_compra_feature",
+    "plantilla_esta_desbloqueada",
+    "usuario_tiene_feature",
+    "obtener_plantillas_desbloqueadas_usuario",
+    "obtener_fuentes_desbloqueadas",
+    "obtener_fondos_desbloqueados",
+    "obtener_resumen_usuario",
+])
@@ -0,0 +1,73 @@
+"""
+Configuración de gunicorn (se carga sola al ejecutar 'gunicorn app:app').
+
+Variables de entorno:
+
+    PORT                    puerto (Render lo define; por defecto 8000)
+    WEB_CONCURRENCY         workers (por defecto 2)
+    GUNICORN_HILOS          hilos por worker gthread (por defecto 8)
+    GUNICORN_PRELOAD        1 para importar la app en el maestro antes del fork
+    FIRESTORE_CALENTAR      0 para no calentar los clientes al arrancar cada worker
+    PROMETHEUS_MULTIPROC_DIR  ficheros de métricas compartidos por los workers
+                              (por defecto uno en el directorio temporal)
+    AUTOGUARDADO            1 para agrupar los autoguardados del editor
+                            (ver autoguardado.py; por defecto se guarda al momento)
+    AUTOGUARDADO_DIR        diarios de los autoguardados pendientes (por defecto
+                            uno en el directorio temporal, que no es persistente)
+    AUTOGUARDADO_ESPERA     segundos sin cambios antes de guardar (por defecto 5)
+    AUTOGUARDADO_ESPERA_MAX segundos máximos con cambios pendientes (por defecto 30)
+    AUTOGUARDADO_MAX_NOTAS  notas pendientes por worker (por defecto 1000)
+"""
+import glob
+import os
+import tempfile
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_HILOS", 8))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "0") == "1"
+
+# /metrics suma los ficheros de todos los workers (ver metricas.py). La
+# variable tiene que estar definida antes de que se importe la app, y los
+# ficheros de una ejecución anterior sobran
+directorio_metricas = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "metricas_api")
+)
+os.makedirs(directorio_metricas, exist_ok=True)
+for fichero in glob.glob(os.path.join(directorio_metricas, "*.db")):
+    os.remove(fichero)
+
+
+def post_fork(server, worker):
+    # Cada worker crea sus propios clientes (backend.ClientePorProceso) y,
+    # si se pide, los calienta antes de aceptar peticiones: el canal gRPC y
+    # el token de acceso quedan listos para la primera
+    if os.environ.get("FIRESTORE_CALENTAR", "1") != "1":
+        return
+
+    from firestore import calentar_clientes
+    try:
+        calentar_clientes()
+        worker.log.info("Clientes de Firestore listos")
+    except Exception as e:
+        # Sin calentar el worker sigue funcionando; la primera petición
+        # abrirá la conexión
+        worker.log.warning("ERROR al calentar los clientes de Firestore: %s", e)
+
+
+def post_worker_init(worker):
+    # Adopta los autoguardados que dejó pendientes un worker que murió
+    from app import autoguardado
+    autoguardado.iniciar()
+
+
+def worker_exit(server, worker):
+    # Guarda los autoguardados pendientes antes de que el worker termine
+    from app import autoguardado
+    autoguardado.vaciar()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
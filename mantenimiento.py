@@ -0,0 +1,288 @@
+"""
+Migraciones y tareas de mantenimiento de datos.
+
+Uso:
+    python mantenimiento.py desbloqueos   # reconstruye usuarios_desbloqueos
+    python mantenimiento.py relaciones    # compacta notas_categoriaNota
+    python mantenimiento.py contadores    # recalcula num_notas de cada categoría
+    python mantenimiento.py eliminadas    # purga marcas de notas borradas caducadas
+    python mantenimiento.py busqueda      # reconstruye notas_busqueda
+    python mantenimiento.py etiquetas     # reconstruye etiquetas_usuario
+    python mantenimiento.py dibujos       # pasa a trozos los dibujos de las notas
+
+Todas las tareas son idempotentes: se pueden repetir sin duplicar datos.
+"""
+import argparse
+
+from firestore import (
+    db,
+    firestore,
+    MAX_OPERACIONES_LOTE,
+    datos_busqueda_nota,
+    escribir_indice_etiquetas,
+    etiquetas_validas,
+    leer_notas,
+    limite_retencion_eliminadas,
+    pasar_dibujo_a_trozos,
+)
+
+
+class EscritorPorLotes:
+    """Acumula escrituras y hace commit cada MAX_OPERACIONES_LOTE operaciones."""
+
+    def __init__(self):
+        self.lote = db.batch()
+        self.pendientes = 0
+        self.total = 0
+
+    def _contar(self):
+        self.pendientes += 1
+        self.total += 1
+        if self.pendientes >= MAX_OPERACIONES_LOTE:
+            self.cerrar()
+
+    def set(self, ref, data, merge=False):
+        self.lote.set(ref, data, merge=merge)
+        self._contar()
+
+    def delete(self, ref):
+        self.lote.delete(ref)
+        self._contar()
+
+    def cerrar(self):
+        if self.pendientes:
+            self.lote.commit()
+        self.lote = db.batch()
+        self.pendientes = 0
+
+
+# ---------- DESBLOQUEOS ---------- #
+
+def migrar_desbloqueos():
+    """Rellena usuarios_desbloqueos a partir de las colecciones de compras.
+
+    Usa ArrayUnion, así que no borra lo que ya hayan escrito las compras
+    hechas después del despliegue.
+    """
+    por_usuario = {}
+
+    for d in db.collection("usuarios_plantillas").stream():
+        data = d.to_dict()
+        if data.get("id_usuario") and data.get("id_plantilla"):
+            por_usuario.setdefault(data["id_usuario"], ([], []))[0].append(data["id_plantilla"])
+
+    for d in db.collection("usuarios_features").stream():
+        data = d.to_dict()
+        if data.get("id_usuario") and data.get("feature"):
+            por_usuario.setdefault(data["id_usuario"], ([], []))[1].append(data["feature"])
+
+    escritor = EscritorPorLotes()
+    for id_usuario, (plantillas, features) in por_usuario.items():
+        escritor.set(db.collection("usuarios_desbloqueos").document(id_usuario), {
+            "id_usuario": id_usuario,
+            "plantillas": firestore.ArrayUnion(plantillas),
+            "features": firestore.ArrayUnion(features),
+            "fecha_actualizacion": firestore.SERVER_TIMESTAMP
+        }, merge=True)
+    escritor.cerrar()
+
+    return {"usuarios": len(por_usuario)}
+
+
+# ---------- RELACIONES NOTA - CATEGORÍA ---------- #
+
+def _momento_relacion(doc):
+    # Las filas antiguas no tienen "fecha": se usa la fecha de creación
+    return doc.to_dict().get("fecha") or doc.create_time
+
+
+def compactar_relaciones():
+    """Deja una sola relación por nota, con el id de la nota como id del
+    documento, y borra las relaciones de notas que ya no existen.
+
+    Si una nota tiene varias filas se conserva la más reciente, que es la
+    categoría a la que se movió por última vez.
+    """
+    por_nota = {}
+    sin_nota = []
+    for d in db.collection("notas_categoriaNota").stream():
+        id_nota = d.to_dict().get("id_nota")
+        if id_nota:
+            por_nota.setdefault(id_nota, []).append(d)
+        else:
+            sin_nota.append(d)
+
+    notas = leer_notas(list(por_nota))
+    escritor = EscritorPorLotes()
+    resumen = {"notas": len(por_nota), "sustituidas": 0, "huerfanas": len(sin_nota)}
+
+    for d in sin_nota:
+        escritor.delete(d.reference)
+
+    for id_nota, filas in por_nota.items():
+        if id_nota not in notas:
+            resumen["huerfanas"] += len(filas)
+            for d in filas:
+                escritor.delete(d.reference)
+            continue
+
+        vigente = max(filas, key=_momento_relacion)
+        data = vigente.to_dict()
+        canonica = db.collection("notas_categoriaNota").document(id_nota)
+        id_usuario = notas[id_nota].to_dict().get("id_usuario")
+
+        if vigente.id != id_nota or data.get("id_usuario") != id_usuario:
+            escritor.set(canonica, {
+                "id_nota": id_nota,
+                "id_categoriaNota": data.get("id_categoriaNota"),
+                "id_usuario": id_usuario,
+                "fecha": _momento_relacion(vigente)
+            })
+        for d in filas:
+            if d.id != id_nota:
+                escritor.delete(d.reference)
+                resumen["sustituidas"] += 1
+
+    escritor.cerrar()
+    return resumen
+
+
+# ---------- CONTADORES DE CATEGORÍAS ---------- #
+
+def recalcular_contadores():
+    """Recalcula num_notas de todas las categorías contando las relaciones.
+
+    Conviene ejecutarla después de 'relaciones' y en un momento de poco
+    tráfico: escribe valores absolutos, así que un movimiento de nota que
+    ocurra a la vez puede quedar sin contar.
+    """
+    conteos = {}
+    for d in db.collection("notas_categoriaNota").stream():
+        id_categoria = d.to_dict().get("id_categoriaNota")
+        if id_categoria:
+            conteos[id_categoria] = conteos.get(id_categoria, 0) + 1
+
+    escritor = EscritorPorLotes()
+    actualizadas = 0
+    for d in db.collection("categoriaNota").stream():
+        num_notas = conteos.get(d.id, 0)
+        if d.to_dict().get("num_notas") != num_notas:
+            escritor.set(d.reference, {"num_notas": num_notas}, merge=True)
+            actualizadas += 1
+    escritor.cerrar()
+
+    return {"categorias_actualizadas": actualizadas}
+
+
+# ---------- NOTAS ELIMINADAS ---------- #
+
+def purgar_eliminadas():
+    """Borra las marcas de notas eliminadas más antiguas que
+    RETENCION_ELIMINADAS_DIAS. Conviene programarla a diario."""
+    limite = limite_retencion_eliminadas()
+    docs = db.collection("notas_eliminadas")\
+             .where("fecha_eliminacion", "<", limite)\
+             .stream()
+
+    escritor = EscritorPorLotes()
+    for d in docs:
+        escritor.delete(d.reference)
+    escritor.cerrar()
+
+    return {"purgadas": escritor.total}
+
+
+# ---------- BÚSQUEDA ---------- #
+
+def reconstruir_busqueda():
+    """Vuelve a calcular los términos de búsqueda de todas las notas y borra
+    los de notas que ya no existen. Necesaria una vez para las notas
+    anteriores a la búsqueda y después de cambiar busqueda.py."""
+    escritor = EscritorPorLotes()
+    ids_notas = set()
+    for d in db.collection("notas").stream():
+        ids_notas.add(d.id)
+        escritor.set(db.collection("notas_busqueda").document(d.id),
+                     datos_busqueda_nota(d.to_dict()))
+
+    huerfanas = 0
+    for d in db.collection("notas_busqueda").select([]).stream():
+        if d.id not in ids_notas:
+            escritor.delete(d.reference)
+            huerfanas += 1
+    escritor.cerrar()
+
+    return {"notas": len(ids_notas), "huerfanas": huerfanas}
+
+
+# ---------- ETIQUETAS ---------- #
+
+def reconstruir_etiquetas():
+    """Rehace el índice de etiquetas de cada usuario a partir de las notas.
+    Sustituye todas sus partes, así que también elimina las etiquetas que se
+    quedaron sin notas y reparte de nuevo si ha cambiado ETIQUETAS_PARTES.
+
+    Una nota modificada mientras se ejecuta puede quedar mal indexada; se
+    corrige con la siguiente ejecución."""
+    por_usuario = {}
+    for d in db.collection("notas").select(["id_usuario", "etiquetas"]).stream():
+        data = d.to_dict()
+        if not data.get("id_usuario"):
+            continue
+        indice = por_usuario.setdefault(data["id_usuario"], {})
+        for etiqueta in etiquetas_validas(data.get("etiquetas")):
+            indice.setdefault(etiqueta, {})[d.id] = True
+
+    # Usuarios que ya no tienen notas: su índice queda vacío
+    for d in db.collection("etiquetas_usuario").select([]).stream():
+        por_usuario.setdefault(d.id, {})
+
+    escritor = EscritorPorLotes()
+    for id_usuario, indice in por_usuario.items():
+        existentes = db.collection("etiquetas_usuario").document(id_usuario)\
+                       .collection("partes_etiquetas").select([]).stream()
+        escribir_indice_etiquetas(escritor, id_usuario, indice, list(existentes))
+    escritor.cerrar()
+
+    return {"usuarios": len(por_usuario)}
+
+
+# ---------- DIBUJOS ---------- #
+
+def trocear_dibujos():
+    """Pasa a trozos (ver dibujos.py) los dibujos de las notas que aún los
+    tienen dentro del documento, y quita el campo 'dibujo' vacío de las que
+    no tienen. Cada nota se guarda en su propia transacción: un dibujo
+    grande puede ocupar casi todo lo que admite un commit."""
+    # Solo las notas anteriores no tienen dibujo_info
+    pendientes = [d.id for d in db.collection("notas").select(["dibujo_info"]).stream()
+                  if "dibujo_info" not in d.to_dict()]
+
+    movidas = sum(1 for id_nota in pendientes if pasar_dibujo_a_trozos(id_nota))
+    return {"notas": len(pendientes), "movidas": movidas}
+
+
+# ---------- LÍNEA DE COMANDOS ---------- #
+
+TAREAS = {
+    "desbloqueos": migrar_desbloqueos,
+    "relaciones": compactar_relaciones,
+    "contadores": recalcular_contadores,
+    "eliminadas": purgar_eliminadas,
+    "busqueda": reconstruir_busqueda,
+    "etiquetas": reconstruir_etiquetas,
+    "dibujos": trocear_dibujos,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migraciones y mantenimiento de datos")
+    parser.add_argument("tarea", choices=sorted(TAREAS))
+    args = parser.parse_args(argv)
+
+    resultado = TAREAS[args.tarea]()
+    print(f"{args.tarea}: {resultado}")
+
+
+if __name__ == "__main__":
+    main()
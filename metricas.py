@@ -0,0 +1,177 @@
+"""
+Métricas de la API en formato Prometheus (GET /metrics).
+
+Por cada ruta se registra la duración de las peticiones (con su código de
+estado), el tamaño de las respuestas y cuántos documentos de Firestore se
+leyeron, llegaron de consultas o se escribieron, que es lo que se factura.
+Además se mide la duración de las funciones de firestore.py que usan las
+rutas.
+
+Con varios workers de gunicorn cada proceso escribe sus valores en ficheros
+de PROMETHEUS_MULTIPROC_DIR y /metrics los suma todos (modo multiproceso de
+prometheus_client). gunicorn.conf.py prepara ese directorio; sin la variable
+cada proceso expone solo sus propias métricas.
+"""
+import contextvars
+import functools
+import inspect
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+RUTA_DESCONOCIDA = "<sin ruta>"
+TIPOS_DOCUMENTO = ("lectura", "consulta", "escritura")
+
+DURACION_PETICION = Histogram(
+    "api_peticion_segundos", "Duración de las peticiones, hasta enviar el último byte",
+    ["metodo", "ruta", "estado"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+TAMANO_RESPUESTA = Histogram(
+    "api_respuesta_bytes", "Tamaño del cuerpo de las respuestas",
+    ["metodo", "ruta"],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+DOCUMENTOS = Counter(
+    "api_firestore_documentos_total", "Documentos de Firestore leídos, recibidos de consultas o escritos",
+    ["ruta", "tipo"],
+)
+DOCUMENTOS_PETICION = Histogram(
+    "api_firestore_documentos_por_peticion", "Documentos de Firestore por petición",
+    ["ruta", "tipo"],
+    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000),
+)
+DURACION_FUNCION = Histogram(
+    "api_firestore_funcion_segundos", "Duración de las funciones de datos de firestore.py",
+    ["funcion"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 10),
+)
+
+# Medición de la petición en curso; los documentos se suman aquí. Las
+# corrutinas del bucle asíncrono la heredan (ver asincrono.py)
+_peticion = contextvars.ContextVar("metricas_peticion", default=None)
+
+
+def registrar_llamada(tipo, forma, documentos, segundos):
+    """Se registra con backend.observar_llamadas()."""
+    medicion = _peticion.get()
+    if medicion is not None and tipo in TIPOS_DOCUMENTO:
+        medicion[tipo] += documentos
+
+
+def anotar_ruta(ruta):
+    """Regla de Flask que atiende la petición en curso (la etiqueta 'ruta')."""
+    medicion = _peticion.get()
+    if medicion is not None and ruta is not None:
+        medicion["ruta"] = ruta
+
+
+class _CuerpoMedido:
+    """Cuerpo de la respuesta que cuenta sus bytes y cierra la medición al
+    terminar de enviarse (las respuestas en streaming siguen leyendo de
+    Firestore mientras se envían)."""
+
+    def __init__(self, cuerpo, medicion, cerrar):
+        self._cuerpo = cuerpo
+        self._medicion = medicion
+        self._cerrar = cerrar
+
+    def __iter__(self):
+        for trozo in self._cuerpo:
+            self._medicion["bytes"] += len(trozo)
+            yield trozo
+
+    def close(self):
+        try:
+            if hasattr(self._cuerpo, "close"):
+                self._cuerpo.close()
+        finally:
+            self._cerrar()
+
+
+class MetricasWSGI:
+    """Middleware WSGI que mide cada petición de la app."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        medicion = {"ruta": RUTA_DESCONOCIDA, "estado": "500", "bytes": 0}
+        medicion.update((tipo, 0) for tipo in TIPOS_DOCUMENTO)
+        _peticion.set(medicion)
+        metodo = environ.get("REQUEST_METHOD", "")
+        inicio = time.perf_counter()
+
+        def cerrar():
+            _registrar(metodo, medicion, time.perf_counter() - inicio)
+
+        def start(estado, cabeceras, exc_info=None):
+            medicion["estado"] = estado.split(" ", 1)[0]
+            return start_response(estado, cabeceras, exc_info)
+
+        try:
+            cuerpo = self.wsgi_app(environ, start)
+        except Exception:
+            cerrar()
+            raise
+        return _CuerpoMedido(cuerpo, medicion, cerrar)
+
+
+def _registrar(metodo, medicion, segundos):
+    ruta = medicion["ruta"]
+    DURACION_PETICION.labels(metodo, ruta, medicion["estado"]).observe(segundos)
+    TAMANO_RESPUESTA.labels(metodo, ruta).observe(medicion["bytes"])
+    for tipo in TIPOS_DOCUMENTO:
+        DOCUMENTOS_PETICION.labels(ruta, tipo).observe(medicion[tipo])
+        if medicion[tipo]:
+            DOCUMENTOS.labels(ruta, tipo).inc(medicion[tipo])
+
+
+def medir_funciones(espacio, nombres):
+    """Sustituye en 'espacio' (los globals() de un módulo) cada función de
+    'nombres' por una que mide su duración. En los generadores se mide
+    hasta que se terminan de recorrer."""
+    for nombre in nombres:
+        espacio[nombre] = _medida(espacio[nombre])
+
+
+def _medida(funcion):
+    histograma = DURACION_FUNCION.labels(funcion.__name__)
+
+    if inspect.isgeneratorfunction(funcion):
+        @functools.wraps(funcion)
+        def generador(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                yield from funcion(*args, **kwargs)
+            finally:
+                histograma.observe(time.perf_counter() - inicio)
+        return generador
+
+    @functools.wraps(funcion)
+    def medida(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcion(*args, **kwargs)
+        finally:
+            histograma.observe(time.perf_counter() - inicio)
+    return medida
+
+
+def exportar():
+    """(cuerpo, content type) de /metrics."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro), CONTENT_TYPE_LATEST
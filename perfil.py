@@ -0,0 +1,121 @@
+"""
+Perfil de las llamadas a Firestore de cada petición, para encontrar rutas
+que leen de más antes de que lleguen a producción.
+
+Con PERFIL_BACKEND=1 cada respuesta lleva en cabeceras el resumen de las
+llamadas que hizo al motor mientras se atendía:
+
+    X-Backend-Calls     llamadas (RPC)
+    X-Backend-Reads     documentos leídos o recibidos de consultas
+    X-Backend-Writes    documentos escritos
+    X-Backend-Time      milisegundos esperando al motor, sumando las llamadas
+    X-Backend-Repeated  formas de llamada repetidas (ver más abajo)
+
+Si la misma forma de llamada (la consulta o lectura sin sus valores) se
+repite más de PERFIL_REPETICIONES_MAX veces (5 por defecto) en una petición
+se escribe un aviso: es el patrón N+1, una llamada por elemento en lugar de
+una por lotes.
+
+Con PERFIL_MUESTREO (fracción entre 0 y 1) se escribe además el detalle por
+forma de esa fracción de peticiones, aunque PERFIL_BACKEND esté apagado.
+
+Las llamadas que hace una respuesta en streaming mientras se envía no
+llegan a las cabeceras.
+"""
+import contextvars
+import os
+import random
+
+from flask import request
+
+from backend import observar_llamadas
+
+_peticion = contextvars.ContextVar("perfil_peticion", default=None)
+
+
+def _activo():
+    return os.environ.get("PERFIL_BACKEND", "0").strip().lower() in ("1", "true", "si")
+
+
+def _muestreo():
+    return float(os.environ.get("PERFIL_MUESTREO", 0))
+
+
+def _repeticiones_max():
+    return int(os.environ.get("PERFIL_REPETICIONES_MAX", 5))
+
+
+def _anotar(tipo, forma, documentos, segundos):
+    perfil = _peticion.get()
+    if perfil is not None:
+        perfil["llamadas"].append((tipo, forma, documentos, segundos))
+
+
+def resumir(llamadas):
+    """Totales y desglose por forma de una lista de llamadas
+    (tipo, forma, documentos, segundos)."""
+    resumen = {"llamadas": len(llamadas), "lecturas": 0, "escrituras": 0,
+               "segundos": 0.0, "formas": {}}
+    for tipo, forma, documentos, segundos in llamadas:
+        if tipo in ("lectura", "consulta"):
+            resumen["lecturas"] += documentos
+        elif tipo == "escritura":
+            resumen["escrituras"] += documentos
+        resumen["segundos"] += segundos
+
+        por_forma = resumen["formas"].setdefault(
+            forma, {"llamadas": 0, "documentos": 0, "segundos": 0.0})
+        por_forma["llamadas"] += 1
+        por_forma["documentos"] += documentos
+        por_forma["segundos"] += segundos
+    return resumen
+
+
+def _antes():
+    cabeceras = _activo()
+    muestreada = random.random() < _muestreo()
+    if cabeceras or muestreada:
+        _peticion.set({"llamadas": [], "cabeceras": cabeceras, "muestreada": muestreada})
+    else:
+        _peticion.set(None)
+
+
+def _despues(response):
+    perfil = _peticion.get()
+    if perfil is None:
+        return response
+
+    resumen = resumir(perfil["llamadas"])
+    maximo = _repeticiones_max()
+    repetidas = {forma: datos["llamadas"] for forma, datos in resumen["formas"].items()
+                 if datos["llamadas"] > maximo}
+    for forma, veces in repetidas.items():
+        print(f"AVISO N+1 en {request.method} {request.path}: "
+              f"'{forma}' se ha llamado {veces} veces")
+
+    if perfil["cabeceras"]:
+        response.headers["X-Backend-Calls"] = str(resumen["llamadas"])
+        response.headers["X-Backend-Reads"] = str(resumen["lecturas"])
+        response.headers["X-Backend-Writes"] = str(resumen["escrituras"])
+        response.headers["X-Backend-Time"] = f"{resumen['segundos'] * 1000:.1f}"
+        if repetidas:
+            response.headers["X-Backend-Repeated"] = "; ".join(
+                f"{forma} x{veces}" for forma, veces in repetidas.items())
+
+    if perfil["muestreada"]:
+        print(f"PERFIL {request.method} {request.path} {response.status_code}: "
+              f"{resumen['llamadas']} llamadas, {resumen['lecturas']} lecturas, "
+              f"{resumen['escrituras']} escrituras, {resumen['segundos'] * 1000:.1f} ms")
+        formas = sorted(resumen["formas"].items(), key=lambda f: -f[1]["segundos"])
+        for forma, datos in formas:
+            print(f"    {datos['llamadas']:>4} x {forma}: {datos['documentos']} docs, "
+                  f"{datos['segundos'] * 1000:.1f} ms")
+    return response
+
+
+def registrar(app):
+    """Activa el perfil en la app (solo actúa con PERFIL_BACKEND o
+    PERFIL_MUESTREO)."""
+    observar_llamadas(_anotar)
+    app.before_request(_antes)
+    app.after_request(_despues)
@@ -0,0 +1,93 @@
+"""
+Lecturas por lotes con FIRESTORE_ASINCRONO=1: mismos resultados que el
+cliente síncrono.
+"""
+import contextvars
+import os
+import threading
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from app import app  # noqa: E402
+from asincrono import BucleAsincrono  # noqa: E402
+from firestore import (  # noqa: E402
+    TAMANO_LOTE_NOTAS, bucle, db, leer_documentos, obtener_notas_por_ids
+)
+
+
+def _crear_nota(cliente, id_usuario, **campos):
+    datos = {"id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+             "titulo": "Nota", "contenido": "Texto", "categoria_nombre": "General"}
+    datos.update(campos)
+    r = cliente.post("/api/notas/nueva", json=datos)
+    assert r.status_code == 200, r.json
+    return r.json["id_nota"], r.json["id_categoriaNota"]
+
+
+def _en_los_dos_modos(monkeypatch, leer):
+    resultados = []
+    for valor in ("0", "1"):
+        monkeypatch.setenv("FIRESTORE_ASINCRONO", valor)
+        assert bucle.activo == (valor == "1")
+        resultados.append(leer())
+    return resultados
+
+
+def test_notas_de_categoria_iguales_en_los_dos_modos(monkeypatch):
+    cliente = app.test_client()
+    # Más de un lote, una nota de otro usuario y una relación antigua sin
+    # id_usuario
+    id_nota, id_categoria = _crear_nota(cliente, "asincrono_categoria", categoria_nombre="Lotes")
+    for _ in range(TAMANO_LOTE_NOTAS + 5):
+        _crear_nota(cliente, "asincrono_categoria", id_categoriaNota=id_categoria)
+    _crear_nota(cliente, "asincrono_ajeno", id_categoriaNota=id_categoria)
+    db.collection("notas_categoriaNota").document(id_nota).set(
+        {"id_nota": id_nota, "id_categoriaNota": id_categoria})
+
+    url = f"/api/notas/categoria/asincrono_categoria/{id_categoria}"
+    sincrono, asincrono = _en_los_dos_modos(monkeypatch, lambda: cliente.get(url).json)
+    assert len(sincrono) == TAMANO_LOTE_NOTAS + 6
+    assert asincrono == sincrono
+
+
+def test_notas_por_ids_conservan_el_orden(monkeypatch):
+    cliente = app.test_client()
+    ids = [_crear_nota(cliente, "asincrono_ids")[0] for _ in range(TAMANO_LOTE_NOTAS + 3)]
+    ajena, _ = _crear_nota(cliente, "asincrono_otro")
+    pedidos = list(reversed(ids)) + [ajena, "no_existe"]
+
+    sincrono, asincrono = _en_los_dos_modos(
+        monkeypatch, lambda: obtener_notas_por_ids(pedidos, "asincrono_ids"))
+    assert [n["id"] for n in sincrono] == list(reversed(ids))
+    assert asincrono == sincrono
+
+
+def test_leer_documentos(monkeypatch):
+    cliente = app.test_client()
+    ids = [_crear_nota(cliente, "asincrono_documentos")[0] for _ in range(3)]
+    refs = [db.collection("notas").document(i) for i in ids + ["no_existe"]]
+
+    def leer():
+        leidos = leer_documentos(refs, field_paths=["titulo"])
+        return {ruta: d.to_dict() for ruta, d in leidos.items()}
+
+    sincrono, asincrono = _en_los_dos_modos(monkeypatch, leer)
+    assert sorted(sincrono) == sorted(f"notas/{i}" for i in ids)
+    assert asincrono == sincrono
+
+
+def test_bucle_ve_el_contexto_del_hilo():
+    variable = contextvars.ContextVar("prueba_asincrono")
+    bucle_prueba = BucleAsincrono(lambda: "cliente")
+
+    async def leer():
+        return variable.get(), await bucle_prueba.cliente(), threading.current_thread().name
+
+    variable.set("peticion")
+    valor, cliente, hilo = bucle_prueba.ejecutar(leer(), timeout=5)
+    assert (valor, cliente, hilo) == ("peticion", "cliente", "firestore-asincrono")
+
+
+def test_desactivado_por_defecto(monkeypatch):
+    monkeypatch.delenv("FIRESTORE_ASINCRONO", raising=False)
+    assert not bucle.activo
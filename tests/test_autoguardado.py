@@ -0,0 +1,97 @@
+"""
+Autoguardado del editor (PUT /api/nota/<id_nota>?autoguardado=1).
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import pytest  # noqa: E402
+
+import app as modulo_app  # noqa: E402
+from app import app  # noqa: E402
+from firestore import obtener_nota_versionada  # noqa: E402
+
+
+@pytest.fixture
+def autoguardado(monkeypatch, tmp_path):
+    buffer = modulo_app.autoguardado
+    monkeypatch.setenv("AUTOGUARDADO", "1")
+    monkeypatch.setattr(buffer, "directorio", str(tmp_path))
+    # Que el hilo no guarde durante la prueba
+    monkeypatch.setattr(buffer, "espera", 60)
+    monkeypatch.setattr(buffer, "espera_max", 60)
+    yield buffer
+    buffer.vaciar()
+
+
+def _crear_nota(cliente):
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": "test_autoguardado", "id_plantilla": "plantilla_basica",
+        "titulo": "Nota", "contenido": "inicial", "categoria_nombre": "General"})
+    return r.json["id_nota"]
+
+
+def _guardada(id_nota):
+    return obtener_nota_versionada(id_nota)[0]
+
+
+def test_desactivado_por_defecto(monkeypatch):
+    monkeypatch.delenv("AUTOGUARDADO", raising=False)
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+
+    r = cliente.put(f"/api/nota/{id_nota}?autoguardado=1", json={"contenido": "ya"})
+    assert r.status_code == 200
+    assert _guardada(id_nota)["contenido"] == "ya"
+
+
+def test_cambios_agrupados(autoguardado):
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+
+    for i in range(3):
+        r = cliente.put(f"/api/nota/{id_nota}?autoguardado=1", json={"contenido": f"v{i}"})
+        assert r.status_code == 202
+    cliente.put(f"/api/nota/{id_nota}?autoguardado=1", json={"titulo": "Nuevo"})
+
+    # Aún sin guardar, pero el mismo proceso lee lo último
+    assert _guardada(id_nota)["contenido"] == "inicial"
+    r = cliente.get(f"/api/nota/{id_nota}")
+    assert (r.json["contenido"], r.json["titulo"]) == ("v2", "Nuevo")
+
+    autoguardado.guardar_nota(id_nota)
+    nota = _guardada(id_nota)
+    assert (nota["contenido"], nota["titulo"]) == ("v2", "Nuevo")
+    assert autoguardado.pendientes(id_nota) == {}
+
+
+def test_guardado_explicito_lleva_los_pendientes(autoguardado):
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+
+    cliente.put(f"/api/nota/{id_nota}?autoguardado=1", json={"contenido": "pendiente"})
+    assert cliente.put(f"/api/nota/{id_nota}", json={"titulo": "Explícito"}).status_code == 200
+
+    nota = _guardada(id_nota)
+    assert (nota["contenido"], nota["titulo"]) == ("pendiente", "Explícito")
+    assert autoguardado.pendientes(id_nota) == {}
+
+
+def test_nota_inexistente(autoguardado):
+    r = app.test_client().put("/api/nota/no_existe?autoguardado=1", json={"contenido": "x"})
+    assert r.status_code == 404
+    assert r.json == {"error": "Nota no encontrada", "id_nota": "no_existe"}
+    assert autoguardado.pendientes("no_existe") == {}
+
+
+def test_diario_de_un_proceso_muerto(autoguardado, tmp_path):
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+    # Diario de un worker que murió con un cambio sin guardar
+    (tmp_path / "autoguardado-999999999.jsonl").write_text(
+        '{"id_nota": "%s", "cambios": {"contenido": "recuperado"}}\n' % id_nota, encoding="utf-8")
+
+    autoguardado._adoptar_huerfanos()
+    autoguardado.vaciar()
+    assert _guardada(id_nota)["contenido"] == "recuperado"
+    assert not (tmp_path / "autoguardado-999999999.jsonl").exists()
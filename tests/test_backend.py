@@ -0,0 +1,80 @@
+"""
+Selección del motor y canal gRPC de Firestore (backend.py).
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import pytest  # noqa: E402
+
+import backend  # noqa: E402
+
+
+def test_cliente_por_proceso_se_crea_al_primer_uso():
+    creados = []
+
+    class Cliente:
+        def leer(self):
+            return "leido"
+
+    def crear():
+        creados.append(Cliente())
+        return creados[-1]
+
+    db = backend.ClientePorProceso(crear)
+    assert creados == []
+    assert db.leer() == "leido"
+    assert db.leer() == "leido"
+    assert len(creados) == 1
+
+
+def test_opciones_canal(monkeypatch):
+    monkeypatch.setenv("FIRESTORE_MAX_MENSAJE_MB", "8")
+    opciones = dict(backend._opciones_canal())
+    assert opciones["grpc.max_receive_message_length"] == 8 * 1024 * 1024
+    assert "grpc.use_local_subchannel_pool" not in opciones
+
+    monkeypatch.delenv("FIRESTORE_MAX_MENSAJE_MB")
+    opciones = dict(backend._opciones_canal(conexion_propia=True))
+    assert opciones["grpc.max_send_message_length"] == -1
+    assert opciones["grpc.use_local_subchannel_pool"] == 1
+
+
+def test_canal_repartido_usa_varias_conexiones():
+    grpc = pytest.importorskip("grpc")
+    from concurrent import futures
+
+    clientes = []
+
+    def eco(peticion, contexto):
+        clientes.append(contexto.peer())
+        return peticion
+
+    def repetir(peticion, contexto):
+        clientes.append(contexto.peer())
+        yield peticion
+        yield peticion
+
+    servidor = grpc.server(futures.ThreadPoolExecutor(max_workers=4))
+    servidor.add_generic_rpc_handlers([grpc.method_handlers_generic_handler("prueba", {
+        "Eco": grpc.unary_unary_rpc_method_handler(eco),
+        "Repetir": grpc.unary_stream_rpc_method_handler(repetir),
+    })])
+    puerto = servidor.add_insecure_port("127.0.0.1:0")
+    servidor.start()
+    try:
+        canales = [grpc.insecure_channel(f"127.0.0.1:{puerto}",
+                                         options=backend._opciones_canal(conexion_propia=True))
+                   for _ in range(2)]
+        # Como en el cliente: interceptado para las métricas
+        canal = backend._interceptar(backend._canal_repartido(canales))
+        assert canal.unary_unary("/prueba/Eco")(b"hola", timeout=5) == b"hola"
+        assert canal.unary_unary("/prueba/Eco").with_call(b"hola", timeout=5)[0] == b"hola"
+        assert list(canal.unary_stream("/prueba/Repetir")(b"x", timeout=5)) == [b"x", b"x"]
+        assert canal.unary_unary("/prueba/Eco").future(b"hola", timeout=5).result() == b"hola"
+        canal.close()
+    finally:
+        servidor.stop(None)
+
+    # Por turnos: las llamadas han salido por las dos conexiones
+    assert len(set(clientes)) == 2
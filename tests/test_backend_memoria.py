@@ -0,0 +1,124 @@
+"""
+Motor de datos en memoria (backend_memoria.py): la parte de la API de
+Firestore que usa firestore.py.
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import pytest  # noqa: E402
+
+import backend  # noqa: E402
+import backend_memoria  # noqa: E402
+from backend_memoria import (  # noqa: E402
+    AlreadyExists,
+    ArrayRemove,
+    ArrayUnion,
+    DELETE_FIELD,
+    FailedPrecondition,
+    Increment,
+    NotFound,
+    SERVER_TIMESTAMP,
+    transactional,
+)
+
+
+@pytest.fixture
+def db():
+    return backend_memoria.client()
+
+
+def test_backend_no_valido(monkeypatch):
+    monkeypatch.setenv("BACKEND_DATOS", "otro")
+    with pytest.raises(ValueError):
+        backend.nombre_backend()
+
+
+def test_escrituras_y_valores_especiales(db):
+    ref = db.collection("notas").document("n1")
+    ref.set({"titulo": "a", "etiquetas": ["x"], "num": 1, "mapa": {"a": 1}})
+    ref.set({"mapa": {"b": 2}, "fecha": SERVER_TIMESTAMP}, merge=True)
+    ref.update({"num": Increment(2), "etiquetas": ArrayUnion(["y", "x"]), "mapa.a": DELETE_FIELD})
+
+    data = ref.get().to_dict()
+    assert data["num"] == 3
+    assert data["etiquetas"] == ["x", "y"]
+    assert data["mapa"] == {"b": 2}
+    assert data["fecha"] is not None
+
+    ref.update({"etiquetas": ArrayRemove(["x"])})
+    assert ref.get().to_dict()["etiquetas"] == ["y"]
+    assert ref.get(field_paths=["titulo"]).to_dict() == {"titulo": "a"}
+
+
+def test_update_de_documento_inexistente(db):
+    with pytest.raises(NotFound):
+        db.collection("notas").document("no").update({"a": 1})
+
+
+def test_rutas_de_campo_como_el_sdk(db):
+    ref = db.collection("c").document("d")
+    ref.set({})
+    ref.update({"pesos.`2024`": 1})
+    assert ref.get().to_dict() == {"pesos": {"2024": 1}}
+    with pytest.raises(ValueError):
+        ref.update({"pesos.2024": 1})
+
+
+def test_consultas(db):
+    notas = db.collection("notas")
+    for i, usuario in enumerate(["a", "b", "a", "a"]):
+        notas.document(f"n{i}").set({"id_usuario": usuario, "orden": i})
+
+    consulta = notas.where("id_usuario", "==", "a").order_by("orden", direction="DESCENDING").limit(2)
+    assert [d.id for d in consulta.stream()] == ["n3", "n2"]
+    assert [d.id for d in notas.where("orden", "in", [0, 1]).stream()] == ["n0", "n1"]
+
+
+def test_lote_todo_o_nada(db):
+    ref = db.collection("c").document("d")
+    ref.set({"v": 1})
+    lote = db.batch()
+    lote.set(db.collection("c").document("otro"), {"v": 1})
+    lote.update(ref, {"v": 2}, option=db.write_option(exists=False))
+    with pytest.raises(AlreadyExists):
+        lote.commit()
+    assert not db.collection("c").document("otro").get().exists
+    assert ref.get().to_dict() == {"v": 1}
+
+
+def test_precondicion_last_update_time(db):
+    ref = db.collection("c").document("d")
+    ref.set({"v": 1})
+    leido = ref.get()
+    ref.set({"v": 2})
+    with pytest.raises(FailedPrecondition):
+        ref.delete(option=db.write_option(last_update_time=leido.update_time))
+    ref.delete(option=db.write_option(last_update_time=ref.get().update_time))
+    assert not ref.get().exists
+
+
+def test_transaccion(db):
+    ref = db.collection("usuarios").document("u")
+    ref.set({"monedas": 10})
+
+    @transactional
+    def cobrar(transaction):
+        monedas = next(transaction.get(ref)).to_dict()["monedas"]
+        transaction.update(ref, {"monedas": monedas - 3})
+
+    cobrar(db.transaction())
+    assert ref.get().to_dict()["monedas"] == 7
+
+    with pytest.raises(ValueError):
+        cobrar(db.transaction(read_only=True))
+
+
+def test_estadisticas(db):
+    db.collection("c").document("d").set({"v": 1})
+    db.reiniciar_estadisticas()
+    db.collection("c").document("d").get()
+    list(db.collection("c").stream())
+    estadisticas = db.reiniciar_estadisticas()
+    assert estadisticas["lecturas"] == 2
+    assert estadisticas.get("escrituras", 0) == 0
@@ -0,0 +1,66 @@
+"""
+Operaciones masivas sobre notas (POST /api/notas/batch).
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from app import MAX_OPERACIONES_BATCH, app  # noqa: E402
+from firestore import db  # noqa: E402
+
+
+def _crear(id_usuario, titulo="Nota", **datos):
+    return {"op": "crear", "datos": {"id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+                                     "titulo": titulo, "contenido": "Texto",
+                                     "categoria_nombre": "Batch", **datos}}
+
+
+def test_operaciones_en_orden():
+    cliente = app.test_client()
+    r = cliente.post("/api/notas/batch", json={"operaciones": [_crear("batch_orden", "a"),
+                                                                _crear("batch_orden", "b")]})
+    assert r.json["ok"] is True
+    id_a, id_b = (x["id_nota"] for x in r.json["resultados"])
+
+    r = cliente.post("/api/notas/batch", json={"operaciones": [
+        {"op": "actualizar", "id_nota": id_a, "cambios": {"titulo": "a2"}},
+        {"op": "eliminar", "id_nota": id_b},
+        {"op": "obtener", "id_nota": id_a},
+        {"op": "obtener", "id_nota": id_b},
+    ]})
+    resultados = r.json["resultados"]
+    assert [x["status"] for x in resultados] == [200, 200, 200, 404]
+    assert [x["indice"] for x in resultados] == [0, 1, 2, 3]
+    assert resultados[2]["nota"]["titulo"] == "a2"
+    assert r.json["ok"] is False
+
+    id_categoria = db.collection("notas_categoriaNota").document(id_a).get().to_dict()["id_categoriaNota"]
+    assert db.collection("categoriaNota").document(id_categoria).get().to_dict()["num_notas"] >= 1
+    assert not db.collection("notas_categoriaNota").document(id_b).get().exists
+
+
+def test_errores_por_operacion():
+    r = app.test_client().post("/api/notas/batch", json={"operaciones": [
+        {"op": "otra"},
+        {"op": "crear", "datos": {"id_usuario": "batch_errores"}},
+        _crear("batch_errores", categoria_nombre=None, id_categoriaNota="no_existe"),
+        {"op": "actualizar", "id_nota": "no_existe", "cambios": {"titulo": "x"}},
+        {"op": "eliminar"},
+        _crear("batch_errores"),
+    ]})
+    assert [x["status"] for x in r.json["resultados"]] == [400, 400, 404, 404, 400, 200]
+
+
+def test_cuerpo_no_valido():
+    cliente = app.test_client()
+    assert cliente.post("/api/notas/batch", json={}).status_code == 400
+    demasiadas = [{"op": "obtener", "id_nota": "x"}] * (MAX_OPERACIONES_BATCH + 1)
+    assert cliente.post("/api/notas/batch", json={"operaciones": demasiadas}).status_code == 400
+
+
+def test_muchas_notas_en_varios_lotes():
+    # Más escrituras de las que caben en un commit de Firestore
+    operaciones = [_crear("batch_muchas", f"n{i}") for i in range(120)]
+    r = app.test_client().post("/api/notas/batch", json={"operaciones": operaciones})
+    assert r.json["ok"] is True
+    assert len(list(db.collection("notas").where("id_usuario", "==", "batch_muchas").stream())) == 120
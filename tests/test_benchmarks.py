@@ -0,0 +1,38 @@
+"""
+Benchmarks de benchmarks/: se ejecutan en pequeño para comprobar que todos
+los escenarios responden sin errores.
+"""
+import json
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import firestore  # noqa: E402
+from benchmarks import compresion, endpoints  # noqa: E402
+
+
+def test_percentil():
+    assert endpoints.percentil([], 50) is None
+    assert endpoints.percentil([1, 2, 3, 4], 50) == 2.5
+    assert endpoints.percentil([5], 99) == 5
+
+
+def test_endpoints(tmp_path):
+    salida = tmp_path / "bench.json"
+    endpoints.main(["--usuarios", "2", "--notas", "10", "--iteraciones", "3",
+                    "--calentamiento", "1", "--salida", str(salida)])
+
+    informe = json.loads(salida.read_text(encoding="utf-8"))
+    assert informe["parametros"]["compactar"] is True
+    assert set(informe["rutas"]) == set(endpoints.ESCENARIOS)
+    for nombre, r in informe["rutas"].items():
+        assert r["errores"] == 0, nombre
+        assert r["p50_ms"] <= r["p99_ms"]
+
+
+def test_compresion(tmp_path, monkeypatch):
+    # El benchmark cambia el umbral de compresión del contenido; se restaura
+    monkeypatch.setattr(firestore, "CONTENIDO_COMPRIMIDO_DESDE", firestore.CONTENIDO_COMPRIMIDO_DESDE)
+    salida = tmp_path / "compresion.json"
+    compresion.main(["--notas", "3", "--salida", str(salida)])
+    assert json.loads(salida.read_text(encoding="utf-8"))
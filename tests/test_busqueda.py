@@ -0,0 +1,40 @@
+"""
+Búsqueda de notas con términos que no son identificadores de Firestore.
+
+Se ejecuta sobre el motor en memoria, que interpreta las rutas de campos
+igual que el SDK; si el SDK está instalado también se comprueba con su
+propio parser.
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import pytest  # noqa: E402
+
+from app import app  # noqa: E402
+from backend import ruta_campo  # noqa: E402
+
+
+def test_buscar_termino_numerico():
+    cliente = app.test_client()
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": "test_busqueda",
+        "id_plantilla": "plantilla_basica",
+        "titulo": "Resumen 2024",
+        "contenido": "Balance del año",
+        "categoria_nombre": "General",
+    })
+    assert r.status_code == 200
+    id_nota = r.json["id_nota"]
+
+    r = cliente.get("/api/notas/test_busqueda/buscar?q=2024")
+    assert r.status_code == 200
+    assert [n["id"] for n in r.json] == [id_nota]
+
+
+def test_ruta_campo_con_el_parser_del_sdk():
+    field_path = pytest.importorskip("google.cloud.firestore_v1.field_path")
+    for partes in (("pesos", "2024"), ("pesos", "nota"), ("pesos", "a`b"), ("pesos", "a\\b")):
+        ruta = ruta_campo(*partes)
+        assert ruta == field_path.FieldPath(*partes).to_api_repr()
+        assert tuple(field_path.parse_field_path(ruta)) == partes
@@ -0,0 +1,38 @@
+"""
+Caché en memoria por proceso (cache.py).
+"""
+from cache import CacheTTL
+
+
+def test_caduca(monkeypatch):
+    ahora = [100.0]
+    monkeypatch.setattr("cache.time.monotonic", lambda: ahora[0])
+    cache = CacheTTL(ttl=10)
+    cache.guardar("a", 1)
+
+    ahora[0] = 109.9
+    assert cache.obtener("a") == 1
+    ahora[0] = 110.0
+    assert cache.obtener("a") is None
+    assert len(cache) == 0
+
+
+def test_expulsa_el_menos_usado():
+    cache = CacheTTL(max_entradas=2)
+    cache.guardar("a", 1)
+    cache.guardar("b", 2)
+    cache.obtener("a")
+    cache.guardar("c", 3)
+
+    assert cache.obtener("b") is None
+    assert (cache.obtener("a"), cache.obtener("c")) == (1, 3)
+
+
+def test_invalidar_y_limpiar():
+    cache = CacheTTL()
+    cache.guardar("a", 1)
+    cache.guardar("b", 2)
+    cache.invalidar("a")
+    assert cache.obtener("a", "nada") == "nada"
+    cache.limpiar()
+    assert len(cache) == 0
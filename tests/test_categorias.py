@@ -0,0 +1,139 @@
+"""
+Categorías: listado de notas por categoría, contador num_notas y borrado,
+también con datos guardados antes de las relaciones con id_usuario y de los
+contadores.
+"""
+import os
+from datetime import datetime, timezone
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from app import app  # noqa: E402
+from firestore import db, firestore  # noqa: E402
+from mantenimiento import compactar_relaciones, recalcular_contadores  # noqa: E402
+
+
+def _crear_nota(cliente, id_usuario, **campos):
+    datos = {"id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+             "titulo": "Nota", "contenido": "Texto"}
+    datos.update(campos)
+    r = cliente.post("/api/notas/nueva", json=datos)
+    assert r.status_code == 200
+    return r.json["id_nota"], r.json["id_categoriaNota"]
+
+
+def _relacion_antigua(id_nota, id_categoria):
+    """Relación como las guardaba el backend antes: id aleatorio y sin id_usuario."""
+    db.collection("notas_categoriaNota").document(id_nota).delete()
+    db.collection("notas_categoriaNota").add({"id_nota": id_nota, "id_categoriaNota": id_categoria})
+
+
+def test_notas_de_categoria_con_relaciones_antiguas():
+    cliente = app.test_client()
+    id_nota, id_categoria = _crear_nota(cliente, "categorias_dueno", categoria_nombre="Viajes")
+    ajena, _ = _crear_nota(cliente, "categorias_otro", id_categoriaNota=id_categoria)
+    _relacion_antigua(id_nota, id_categoria)
+    _relacion_antigua(ajena, id_categoria)
+
+    r = cliente.get(f"/api/notas/categoria/categorias_dueno/{id_categoria}")
+    assert r.status_code == 200
+    assert [n["id"] for n in r.json] == [id_nota]
+
+
+def test_relacion_repetida_no_duplica_la_nota():
+    cliente = app.test_client()
+    id_nota, id_categoria = _crear_nota(cliente, "categorias_repetida", categoria_nombre="Casa")
+    db.collection("notas_categoriaNota").add({"id_nota": id_nota, "id_categoriaNota": id_categoria})
+
+    r = cliente.get(f"/api/notas/categoria/categorias_repetida/{id_categoria}")
+    assert [n["id"] for n in r.json] == [id_nota]
+
+
+def test_contador_de_notas():
+    cliente = app.test_client()
+    _, id_categoria = _crear_nota(cliente, "categorias_contador", categoria_nombre="Trabajo")
+    _crear_nota(cliente, "categorias_contador", id_categoriaNota=id_categoria)
+    categoria = db.collection("categoriaNota").document(id_categoria)
+    assert categoria.get().to_dict()["num_notas"] == 2
+
+    r = cliente.delete(f"/api/categorias/{id_categoria}")
+    assert r.status_code == 400
+    assert categoria.get().exists
+
+
+def test_eliminar_categoria_sin_contador():
+    cliente = app.test_client()
+    _, id_categoria = _crear_nota(cliente, "categorias_sin_contador", categoria_nombre="Antigua")
+    categoria = db.collection("categoriaNota").document(id_categoria)
+    # Categoría anterior al contador num_notas
+    categoria.update({"num_notas": firestore.DELETE_FIELD})
+
+    r = cliente.delete(f"/api/categorias/{id_categoria}")
+    assert r.status_code == 400
+    assert categoria.get().exists
+
+    r = cliente.post("/api/categorias", json={"nombre": "Vacía", "usuarioId": "categorias_sin_contador"})
+    id_vacia = r.json["id"]
+    assert "num_notas" not in db.collection("categoriaNota").document(id_vacia).get().to_dict()
+    assert cliente.delete(f"/api/categorias/{id_vacia}").status_code == 200
+    assert not db.collection("categoriaNota").document(id_vacia).get().exists
+
+
+def test_mover_nota_es_idempotente():
+    cliente = app.test_client()
+    id_nota, origen = _crear_nota(cliente, "categorias_mover", categoria_nombre="Origen")
+    _, destino = _crear_nota(cliente, "categorias_mover", categoria_nombre="Destino")
+
+    for _ in range(2):
+        r = cliente.put(f"/api/nota/{id_nota}", json={"id_categoriaNota": destino})
+        assert r.status_code == 200
+
+    relaciones = list(db.collection("notas_categoriaNota").where("id_nota", "==", id_nota).stream())
+    assert [d.id for d in relaciones] == [id_nota]
+    assert relaciones[0].to_dict()["id_categoriaNota"] == destino
+    assert db.collection("categoriaNota").document(origen).get().to_dict()["num_notas"] == 0
+    assert db.collection("categoriaNota").document(destino).get().to_dict()["num_notas"] == 2
+
+
+def test_compactar_relaciones_antiguas():
+    cliente = app.test_client()
+    id_nota, vieja = _crear_nota(cliente, "categorias_compactar", categoria_nombre="Vieja")
+    _, nueva = _crear_nota(cliente, "categorias_compactar", categoria_nombre="Nueva")
+    relaciones = db.collection("notas_categoriaNota")
+    # Filas como las de antes: id aleatorio, sin id_usuario, una por movimiento
+    relaciones.document(id_nota).delete()
+    relaciones.add({"id_nota": id_nota, "id_categoriaNota": vieja,
+                    "fecha": datetime(2023, 1, 1, tzinfo=timezone.utc)})
+    relaciones.add({"id_nota": id_nota, "id_categoriaNota": nueva,
+                    "fecha": datetime(2024, 1, 1, tzinfo=timezone.utc)})
+    _, huerfana = relaciones.add({"id_nota": "nota_borrada", "id_categoriaNota": vieja})
+
+    compactar_relaciones()
+    assert [d.id for d in relaciones.where("id_nota", "==", id_nota).stream()] == [id_nota]
+    relacion = relaciones.document(id_nota).get().to_dict()
+    assert relacion["id_categoriaNota"] == nueva
+    assert relacion["id_usuario"] == "categorias_compactar"
+    assert not huerfana.get().exists
+
+    r = cliente.get(f"/api/notas/categoria/categorias_compactar/{nueva}")
+    assert id_nota in [n["id"] for n in r.json]
+
+
+def test_recalcular_contadores():
+    cliente = app.test_client()
+    _, id_categoria = _crear_nota(cliente, "categorias_recalcular", categoria_nombre="Recalcular")
+    _crear_nota(cliente, "categorias_recalcular", id_categoriaNota=id_categoria)
+    categoria = db.collection("categoriaNota").document(id_categoria)
+    categoria.update({"num_notas": 7})
+
+    recalcular_contadores()
+    assert categoria.get().to_dict()["num_notas"] == 2
+
+
+def test_eliminar_nota_descuenta():
+    cliente = app.test_client()
+    id_nota, id_categoria = _crear_nota(cliente, "categorias_descontar", categoria_nombre="Descontar")
+    assert cliente.delete(f"/api/nota/{id_nota}").status_code == 200
+
+    assert db.collection("categoriaNota").document(id_categoria).get().to_dict()["num_notas"] == 0
+    assert cliente.delete(f"/api/categorias/{id_categoria}").status_code == 200
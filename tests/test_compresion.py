@@ -0,0 +1,81 @@
+"""
+Compresión de las respuestas de notas y del contenido guardado.
+"""
+import gzip
+import os
+import zlib
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import firestore as modulo_firestore  # noqa: E402
+from app import app  # noqa: E402
+from firestore import db  # noqa: E402
+
+TEXTO_LARGO = "Lista de la compra: leche, pan, huevos. " * 200
+
+
+def _crear_nota(cliente, contenido=TEXTO_LARGO):
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": "test_compresion", "id_plantilla": "plantilla_basica",
+        "titulo": "Larga", "contenido": contenido, "categoria_nombre": "General"})
+    return r.json["id_nota"]
+
+
+def test_respuesta_gzip():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+
+    r = cliente.get(f"/api/nota/{id_nota}", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in r.headers["Vary"]
+    assert b'"contenido"' in gzip.decompress(r.get_data())
+
+
+def test_sin_accept_encoding_no_se_comprime():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+
+    r = cliente.get(f"/api/nota/{id_nota}", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in r.headers
+    assert r.json["contenido"] == TEXTO_LARGO
+
+
+def test_respuesta_pequena_no_se_comprime():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, contenido="corta")
+
+    r = cliente.get(f"/api/nota/{id_nota}", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in r.headers
+
+
+def test_etag_debil_sigue_valiendo():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+
+    r = cliente.get(f"/api/nota/{id_nota}", headers={"Accept-Encoding": "gzip"})
+    etag = r.headers["ETag"]
+    assert etag.startswith("W/")
+    r = cliente.get(f"/api/nota/{id_nota}",
+                    headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert r.status_code == 304
+
+
+def test_contenido_comprimido_en_firestore(monkeypatch):
+    monkeypatch.setattr(modulo_firestore, "CONTENIDO_COMPRIMIDO_DESDE", 100)
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+
+    guardado = db.collection("notas").document(id_nota).get().to_dict()["contenido"]
+    assert isinstance(guardado, bytes)
+    assert zlib.decompress(guardado).decode() == TEXTO_LARGO
+    assert cliente.get(f"/api/nota/{id_nota}").json["contenido"] == TEXTO_LARGO
+
+
+def test_contenido_sin_comprimir_de_notas_anteriores(monkeypatch):
+    # Notas guardadas como texto se siguen leyendo con la compresión activa
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente)
+    monkeypatch.setattr(modulo_firestore, "CONTENIDO_COMPRIMIDO_DESDE", 100)
+
+    assert isinstance(db.collection("notas").document(id_nota).get().to_dict()["contenido"], str)
+    assert cliente.get(f"/api/nota/{id_nota}").json["contenido"] == TEXTO_LARGO
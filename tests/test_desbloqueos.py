@@ -0,0 +1,127 @@
+"""
+Desbloqueos del usuario: el documento resumen de usuarios_desbloqueos y los
+usuarios que compraron antes de que existiera.
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from app import app  # noqa: E402
+from firestore import db  # noqa: E402
+
+
+def _compras_antiguas(id_usuario, plantillas=(), features=()):
+    """Compras como las guardaba el backend antes del resumen de desbloqueos."""
+    for id_plantilla in plantillas:
+        db.collection("usuarios_plantillas").add(
+            {"id_usuario": id_usuario, "id_plantilla": id_plantilla})
+    for feature in features:
+        db.collection("usuarios_features").add({"id_usuario": id_usuario, "feature": feature})
+
+
+def test_usuario_sin_migrar_conserva_lo_comprado():
+    id_usuario = "desbloqueos_sin_migrar"
+    _compras_antiguas(id_usuario, plantillas=["plantilla_viaje"],
+                      features=["font_Lora", "assets/animations/fire.json", "multimedia_images"])
+    cliente = app.test_client()
+
+    assert cliente.get(f"/api/usuarios/plantillas_desbloqueadas/{id_usuario}").json == ["plantilla_viaje"]
+    r = cliente.get(f"/api/usuarios/check_feature/{id_usuario}/multimedia_images")
+    assert r.json == {"desbloqueado": True}
+    assert cliente.get(f"/api/usuarios/fonts_unlocked/{id_usuario}").json == ["Lora"]
+    r = cliente.get(f"/api/usuarios/unlocked_backgrounds/{id_usuario}")
+    assert "assets/animations/fire.json" in str(r.json)
+
+
+def test_resumen_se_crea_en_la_primera_consulta():
+    id_usuario = "desbloqueos_resumen_perezoso"
+    _compras_antiguas(id_usuario, plantillas=["plantilla_viaje"], features=["font_Lora"])
+    db.collection("usuarios").document(id_usuario).set({"monedas": 50})
+    ref = db.collection("usuarios_desbloqueos").document(id_usuario)
+    assert not ref.get().exists
+
+    r = app.test_client().get(f"/api/usuarios/{id_usuario}/entitlements")
+    assert r.status_code == 200
+    assert r.json["plantillas"] == ["plantilla_viaje"]
+    assert r.json["features"]["fuentes"] == ["Lora"]
+
+    data = ref.get().to_dict()
+    assert data["plantillas"] == ["plantilla_viaje"]
+    assert data["features"] == ["font_Lora"]
+
+    # Con el resumen creado ya no se consultan las colecciones de compras
+    db.reiniciar_estadisticas()
+    app.test_client().get(f"/api/usuarios/check_feature/{id_usuario}/font_Lora")
+    assert db.reiniciar_estadisticas()["lecturas"] == 1
+
+
+def test_usuario_sin_compras():
+    r = app.test_client().get("/api/usuarios/check_feature/desbloqueos_nada/font_Lora")
+    assert r.json == {"desbloqueado": False}
+
+
+def _monedas(id_usuario):
+    return db.collection("usuarios").document(id_usuario).get().to_dict()["monedas"]
+
+
+def test_compra_repetida_no_cobra():
+    id_usuario = "desbloqueos_compra_repetida"
+    db.collection("usuarios").document(id_usuario).set({"monedas": 500})
+    cliente = app.test_client()
+    cuerpo = {"id_usuario": id_usuario, "id_plantilla": "plantilla_viaje"}
+
+    assert cliente.post("/api/usuarios/comprar_plantilla", json=cuerpo).json["mensaje"] == "Compra exitosa"
+    assert _monedas(id_usuario) == 300
+    r = cliente.post("/api/usuarios/comprar_plantilla", json=cuerpo)
+    assert r.json == {"ok": True, "mensaje": "Ya tienes esta plantilla"}
+    assert _monedas(id_usuario) == 300
+
+
+def test_compra_de_usuario_sin_migrar():
+    id_usuario = "desbloqueos_compra_sin_migrar"
+    _compras_antiguas(id_usuario, plantillas=["plantilla_viaje"], features=["font_Lora"])
+    db.collection("usuarios").document(id_usuario).set({"monedas": 500})
+    cliente = app.test_client()
+
+    # Lo comprado antes del resumen no se vuelve a cobrar
+    r = cliente.post("/api/usuarios/comprar_plantilla",
+                     json={"id_usuario": id_usuario, "id_plantilla": "plantilla_viaje"})
+    assert r.json == {"ok": True, "mensaje": "Ya tienes esta plantilla"}
+    r = cliente.post("/api/usuarios/comprar_feature", json={"id_usuario": id_usuario, "feature": "font_Lora"})
+    assert r.json["mensaje"] == "Ya lo tienes"
+    assert _monedas(id_usuario) == 500
+
+    # Una compra nueva crea el resumen con lo anterior incluido
+    r = cliente.post("/api/usuarios/comprar_feature",
+                     json={"id_usuario": id_usuario, "feature": "multimedia_images"})
+    assert r.json["ok"] is True
+    data = db.collection("usuarios_desbloqueos").document(id_usuario).get().to_dict()
+    assert data["plantillas"] == ["plantilla_viaje"]
+    assert data["features"] == ["font_Lora", "multimedia_images"]
+
+
+def test_entitlements_agrupa_y_se_guarda_en_cache():
+    id_usuario = "desbloqueos_entitlements"
+    db.collection("usuarios").document(id_usuario).set({"monedas": 500})
+    _compras_antiguas(id_usuario, features=["font_Lora", "assets/animations/fire.json", "multimedia_images"])
+    cliente = app.test_client()
+
+    r = cliente.get(f"/api/usuarios/{id_usuario}/entitlements")
+    assert r.json == {
+        "monedas": 500,
+        "plantillas": [],
+        "features": {"fuentes": ["Lora"], "fondos": ["assets/animations/fire.json"],
+                     "otras": ["multimedia_images"]},
+    }
+
+    # La segunda vez sale de la caché del worker
+    db.reiniciar_estadisticas()
+    assert cliente.get(f"/api/usuarios/{id_usuario}/entitlements").json == r.json
+    assert db.reiniciar_estadisticas().get("lecturas", 0) == 0
+
+    # Una compra en este worker la invalida
+    cliente.post("/api/usuarios/comprar_plantilla",
+                 json={"id_usuario": id_usuario, "id_plantilla": "plantilla_viaje"})
+    r = cliente.get(f"/api/usuarios/{id_usuario}/entitlements")
+    assert r.json["monedas"] == 300
+    assert r.json["plantillas"] == ["plantilla_viaje"]
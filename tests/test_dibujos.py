@@ -0,0 +1,192 @@
+"""
+Dibujos de las notas guardados en trozos (notas/{id_nota}/dibujo) y trazos
+añadidos sin reescribir el dibujo.
+"""
+import os
+import random
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import pytest  # noqa: E402
+
+import dibujos  # noqa: E402
+import firestore as modulo_firestore  # noqa: E402
+from app import app  # noqa: E402
+from firestore import db  # noqa: E402
+from mantenimiento import trocear_dibujos  # noqa: E402
+
+
+def _trazos(numero, semilla=0, puntos=10):
+    azar = random.Random(semilla)
+    return [{"color": "#000000", "puntos": [[azar.random(), azar.random()] for _ in range(puntos)]}
+            for _ in range(numero)]
+
+
+def _crear_nota(cliente, id_usuario, dibujo=None):
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+        "titulo": "Nota", "contenido": "Texto", "categoria_nombre": "General",
+        "dibujo": dibujo})
+    assert r.status_code == 200, r.json
+    return r.json["id_nota"]
+
+
+def _trozos(id_nota):
+    return sorted(d.id for d in db.collection("notas").document(id_nota)
+                  .collection("dibujo").stream())
+
+
+def _nota(id_nota):
+    return db.collection("notas").document(id_nota).get().to_dict()
+
+
+def test_dibujo_grande_en_varios_trozos():
+    cliente = app.test_client()
+    dibujo = _trazos(3000, puntos=20)
+    id_nota = _crear_nota(cliente, "dibujos_grande", dibujo)
+
+    nota = _nota(id_nota)
+    assert "dibujo" not in nota
+    info = nota["dibujo_info"]
+    assert info["trozos"] > 1 and info["segmentos"] == 1 and info["lista"]
+    assert len(_trozos(id_nota)) == info["trozos"]
+
+    assert cliente.get(f"/api/nota/{id_nota}").json["dibujo"] == dibujo
+    r = cliente.get(f"/api/nota/{id_nota}/dibujo")
+    assert r.json["dibujo"] == dibujo
+    assert r.headers["ETag"] == f'"{info["hash"]}"'
+
+    # Con el hash que ya tiene el cliente no se leen los trozos
+    db.reiniciar_estadisticas()
+    r = cliente.get(f"/api/nota/{id_nota}/dibujo", headers={"If-None-Match": r.headers["ETag"]})
+    assert r.status_code == 304
+    assert db.reiniciar_estadisticas()["lecturas"] == 1
+
+
+def test_listado_sin_dibujo():
+    cliente = app.test_client()
+    _crear_nota(cliente, "dibujos_listado", _trazos(5))
+    nota, = cliente.get("/api/notas/dibujos_listado?resumen=1").json
+    assert "dibujo" not in nota
+    assert nota["dibujo_info"]["segmentos"] == 1
+
+
+def test_anadir_trazos_solo_escribe_los_nuevos():
+    cliente = app.test_client()
+    inicial = _trazos(3000, puntos=20)
+    id_nota = _crear_nota(cliente, "dibujos_trazos", inicial)
+    info = _nota(id_nota)["dibujo_info"]
+
+    nuevos = _trazos(2, semilla=1)
+    db.reiniciar_estadisticas()
+    r = cliente.post(f"/api/nota/{id_nota}/dibujo/trazos",
+                     json={"trazos": nuevos, "hash_base": info["hash"]})
+    assert r.status_code == 200
+    # Un trozo nuevo, la nota y la versión del usuario
+    assert db.reiniciar_estadisticas()["escrituras"] == 3
+    nuevo = r.json["dibujo_info"]
+    assert nuevo["segmentos"] == 2 and nuevo["trozos"] == info["trozos"] + 1
+    assert nuevo["hash"] != info["hash"]
+
+    assert cliente.get(f"/api/nota/{id_nota}/dibujo").json["dibujo"] == inicial + nuevos
+
+    # Desde un hash que ya no es el actual
+    r = cliente.post(f"/api/nota/{id_nota}/dibujo/trazos",
+                     json={"trazos": nuevos, "hash_base": info["hash"]})
+    assert r.status_code == 409
+
+
+def test_demasiados_segmentos_se_juntan(monkeypatch):
+    monkeypatch.setattr(modulo_firestore, "MAX_SEGMENTOS_DIBUJO", 2)
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "dibujos_segmentos", _trazos(1))
+    for semilla in (1, 2):
+        r = cliente.post(f"/api/nota/{id_nota}/dibujo/trazos",
+                         json={"trazos": _trazos(1, semilla)})
+    assert r.json["dibujo_info"]["segmentos"] == 1
+    dibujo = cliente.get(f"/api/nota/{id_nota}/dibujo").json["dibujo"]
+    assert dibujo == _trazos(1) + _trazos(1, 1) + _trazos(1, 2)
+
+
+def test_sustituir_y_borrar_quita_los_trozos():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "dibujos_sustituir", _trazos(3000, puntos=20))
+    assert len(_trozos(id_nota)) > 1
+
+    cliente.put(f"/api/nota/{id_nota}", json={"dibujo": _trazos(1)})
+    assert len(_trozos(id_nota)) == 1
+    assert cliente.get(f"/api/nota/{id_nota}/dibujo").json["dibujo"] == _trazos(1)
+
+    cliente.delete(f"/api/nota/{id_nota}")
+    assert _trozos(id_nota) == []
+
+
+def test_errores_de_dibujo(monkeypatch):
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "dibujos_errores", {"fondo": "blanco"})
+    r = cliente.post(f"/api/nota/{id_nota}/dibujo/trazos", json={"trazos": _trazos(1)})
+    assert r.status_code == 400
+    r = cliente.post(f"/api/nota/{id_nota}/dibujo/trazos", json={"trazos": []})
+    assert r.status_code == 400
+    r = cliente.post("/api/nota/dibujos_no_existe/dibujo/trazos", json={"trazos": _trazos(1)})
+    assert r.status_code == 404
+
+    monkeypatch.setattr(dibujos, "MAX_BYTES_DIBUJO", 100)
+    r = cliente.put(f"/api/nota/{id_nota}", json={"dibujo": _trazos(50)})
+    assert r.status_code == 413
+
+
+def test_trozos_corruptos():
+    info = dibujos.info_dibujo(dibujos.codificar(_trazos(2)))
+    trozos = [(0, d) for d in dibujos.codificar(_trazos(2)).trozos()]
+    assert dibujos.decodificar(trozos, info) == _trazos(2)
+    with pytest.raises(dibujos.DibujoCorrupto):
+        dibujos.decodificar([(0, d) for d in dibujos.codificar(_trazos(3)).trozos()], info)
+    with pytest.raises(dibujos.DibujoCorrupto):
+        dibujos.decodificar([], info)
+
+
+def _nota_antigua(id_nota, id_usuario, dibujo):
+    # Como las guardaba el código anterior: el dibujo dentro del documento
+    datos = {"id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+             "titulo": "Antigua", "contenido": ""}
+    if dibujo is not None:
+        datos["dibujo"] = dibujo
+    db.collection("notas").document(id_nota).set(datos)
+
+
+def test_nota_antigua_con_el_dibujo_dentro():
+    cliente = app.test_client()
+    _nota_antigua("dibujos_antigua", "dibujos_antiguo", _trazos(2))
+
+    assert cliente.get("/api/nota/dibujos_antigua").json["dibujo"] == _trazos(2)
+    r = cliente.get("/api/nota/dibujos_antigua/dibujo")
+    assert r.json["dibujo"] == _trazos(2)
+    assert r.json["dibujo_info"] == dibujos.info_dibujo(dibujos.codificar(_trazos(2)))
+
+    # Añadir trazos la pasa a trozos
+    r = cliente.post("/api/nota/dibujos_antigua/dibujo/trazos",
+                     json={"trazos": _trazos(1, 1), "hash_base": r.json["dibujo_info"]["hash"]})
+    assert r.status_code == 200
+    nota = _nota("dibujos_antigua")
+    assert "dibujo" not in nota and nota["dibujo_info"]["segmentos"] == 1
+    assert cliente.get("/api/nota/dibujos_antigua/dibujo").json["dibujo"] == \
+        _trazos(2) + _trazos(1, 1)
+
+
+def test_trocear_dibujos():
+    _nota_antigua("dibujos_trocear", "dibujos_mantenimiento", _trazos(4))
+    _nota_antigua("dibujos_vacio", "dibujos_mantenimiento", None)
+    db.collection("notas").document("dibujos_vacio").update({"dibujo": None})
+
+    resultado = trocear_dibujos()
+    assert resultado["movidas"] >= 2
+
+    nota = _nota("dibujos_trocear")
+    assert "dibujo" not in nota and nota["dibujo_info"]["trozos"] == len(_trozos("dibujos_trocear"))
+    assert app.test_client().get("/api/nota/dibujos_trocear").json["dibujo"] == _trazos(4)
+    vacia = _nota("dibujos_vacio")
+    assert "dibujo" not in vacia and vacia.get("dibujo_info") is None
+
+    # Una segunda pasada no tiene nada que mover
+    assert trocear_dibujos()["movidas"] == 0
@@ -0,0 +1,84 @@
+"""
+Arranque sin flasgger ni el SDK de Firestore y documentación Swagger creada
+bajo demanda.
+"""
+import json
+import os
+import subprocess
+import sys
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import documentacion  # noqa: E402
+from app import app  # noqa: E402
+from documentacion import DocumentacionPerezosa  # noqa: E402
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULOS_PESADOS = ("firebase_admin", "google.cloud.firestore", "grpc", "flasgger")
+
+
+def _modulos_tras(codigo):
+    """Módulos pesados cargados en un proceso nuevo tras ejecutar 'codigo'."""
+    programa = (codigo + "\nimport json, sys\n"
+                f"print(json.dumps({{m: m in sys.modules for m in {MODULOS_PESADOS!r}}}))")
+    salida = subprocess.run(
+        [sys.executable, "-c", programa], cwd=RAIZ, capture_output=True, text=True,
+        check=True, env=dict(os.environ, BACKEND_DATOS="memoria"),
+    ).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def test_importar_la_app_no_carga_modulos_pesados():
+    cargados = _modulos_tras(
+        "from app import app\n"
+        "assert app.test_client().get('/api/categorias').status_code == 200")
+    assert not any(cargados.values()), cargados
+
+
+def test_la_documentacion_carga_flasgger():
+    cargados = _modulos_tras(
+        "from app import app\n"
+        "assert app.test_client().get('/apispec_1.json').status_code == 200")
+    assert cargados["flasgger"]
+    assert not cargados["firebase_admin"]
+
+
+def test_spec_generada_con_las_rutas_de_la_app():
+    r = app.test_client().get("/apispec_1.json")
+    assert r.status_code == 200
+    rutas = r.json["paths"]
+    assert "/api/notas/{id_usuario}" in rutas
+    assert "/api/notas/{id_usuario}/cambios" in rutas
+    assert app.test_client().get("/apidocs/").status_code == 200
+
+
+def test_spec_precompilada(tmp_path, monkeypatch):
+    ruta = tmp_path / "apispec.json"
+    ruta.write_text(json.dumps({"swagger": "2.0", "paths": {"/precompilada": {}}}))
+    monkeypatch.setattr(documentacion, "RUTA_SPEC_PRECOMPILADA", str(ruta))
+
+    cliente = app.test_client()
+    app.wsgi_app, original = DocumentacionPerezosa(app), app.wsgi_app
+    try:
+        assert list(cliente.get("/apispec_1.json").json["paths"]) == ["/precompilada"]
+    finally:
+        app.wsgi_app = original
+
+
+def test_spec_precompilada_anterior_a_la_app(tmp_path, monkeypatch):
+    # Generada antes del último cambio de app.py: se ignora
+    ruta = tmp_path / "apispec.json"
+    ruta.write_text(json.dumps({"swagger": "2.0", "paths": {"/vieja": {}}}))
+    antes = os.path.getmtime(os.path.join(RAIZ, "app.py")) - 60
+    os.utime(ruta, (antes, antes))
+    monkeypatch.setattr(documentacion, "RUTA_SPEC_PRECOMPILADA", str(ruta))
+
+    cliente = app.test_client()
+    app.wsgi_app, original = DocumentacionPerezosa(app), app.wsgi_app
+    try:
+        rutas = cliente.get("/apispec_1.json").json["paths"]
+    finally:
+        app.wsgi_app = original
+    assert "/vieja" not in rutas
+    assert "/api/notas/{id_usuario}" in rutas
@@ -0,0 +1,80 @@
+"""
+Peticiones condicionales: ETag e If-None-Match en notas, listados y
+entitlements.
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from app import app  # noqa: E402
+from firestore import db  # noqa: E402
+
+
+def _crear_nota(cliente, id_usuario):
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+        "titulo": "Nota", "contenido": "Texto", "categoria_nombre": "General"})
+    return r.json["id_nota"]
+
+
+def test_nota_no_modificada():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "etag_nota")
+    etag = cliente.get(f"/api/nota/{id_nota}").headers["ETag"]
+
+    db.reiniciar_estadisticas()
+    r = cliente.get(f"/api/nota/{id_nota}", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.get_data() == b""
+    # Solo se ha leído la versión de la nota (una lectura sin campos)
+    assert db.reiniciar_estadisticas()["lecturas"] == 1
+
+    cliente.put(f"/api/nota/{id_nota}", json={"titulo": "Otro"})
+    r = cliente.get(f"/api/nota/{id_nota}", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] != etag
+    assert r.json["titulo"] == "Otro"
+
+
+def test_nota_inexistente_con_if_none_match():
+    r = app.test_client().get("/api/nota/no_existe", headers={"If-None-Match": '"x"'})
+    assert r.status_code == 404
+
+
+def test_listado_no_modificado_hasta_que_cambia_una_nota():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "etag_listado")
+    etag = cliente.get("/api/notas/etag_listado").headers["ETag"]
+
+    assert cliente.get("/api/notas/etag_listado",
+                       headers={"If-None-Match": etag}).status_code == 304
+    # Otra consulta sobre las mismas notas tiene su propio ETag
+    assert cliente.get("/api/notas/etag_listado?resumen=1",
+                       headers={"If-None-Match": etag}).status_code == 200
+
+    cliente.put(f"/api/nota/{id_nota}", json={"contenido": "nuevo"})
+    assert cliente.get("/api/notas/etag_listado",
+                       headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_listado_de_usuario_sin_version():
+    # Usuarios con notas anteriores a usuarios_versiones
+    cliente = app.test_client()
+    _crear_nota(cliente, "etag_sin_version")
+    db.collection("usuarios_versiones").document("etag_sin_version").delete()
+
+    r = cliente.get("/api/notas/etag_sin_version")
+    assert r.status_code == 200 and len(r.json) == 1
+    etag = r.headers["ETag"]
+    _crear_nota(cliente, "etag_sin_version")
+    r = cliente.get("/api/notas/etag_sin_version", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and len(r.json) == 2
+
+
+def test_entitlements_no_modificados():
+    cliente = app.test_client()
+    db.collection("usuarios").document("etag_entitlements").set({"monedas": 10})
+    r = cliente.get("/api/usuarios/etag_entitlements/entitlements")
+    r = cliente.get("/api/usuarios/etag_entitlements/entitlements",
+                    headers={"If-None-Match": r.headers["ETag"]})
+    assert r.status_code == 304
@@ -0,0 +1,112 @@
+"""
+Índice de etiquetas de cada usuario (GET /api/etiquetas/<id_usuario>).
+"""
+import os
+import re
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import firestore as modulo_firestore  # noqa: E402
+from app import app  # noqa: E402
+from firestore import clave_etiqueta, db, etiqueta_de_clave  # noqa: E402
+from mantenimiento import reconstruir_etiquetas  # noqa: E402
+
+RARAS = ["__name__", "a.b", "a`b", "año", "con espacio", "e_5F", "💡 ideas"]
+
+
+def _crear_nota(cliente, id_usuario, etiquetas):
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": id_usuario, "id_plantilla": "plantilla_basica", "titulo": "Nota",
+        "contenido": "Texto", "categoria_nombre": "General", "etiquetas": etiquetas})
+    return r.json["id_nota"]
+
+
+def _partes(id_usuario):
+    return {d.id: d.to_dict() for d in
+            db.collection("etiquetas_usuario").document(id_usuario)
+              .collection("partes_etiquetas").stream()}
+
+
+def _conteos(cliente, id_usuario):
+    return {f["etiqueta"]: f["num_notas"] for f in cliente.get(f"/api/etiquetas/{id_usuario}").json}
+
+
+def test_claves_de_campo_validas():
+    for etiqueta in RARAS:
+        clave = clave_etiqueta(etiqueta)
+        assert re.fullmatch(r"e_[A-Za-z0-9_]*", clave)
+        assert etiqueta_de_clave(clave) == etiqueta
+
+
+def test_etiquetas_con_caracteres_especiales():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "etiquetas_raras", RARAS)
+    _crear_nota(cliente, "etiquetas_raras", ["a.b"])
+
+    conteos = _conteos(cliente, "etiquetas_raras")
+    assert conteos == {**{e: 1 for e in RARAS}, "a.b": 2}
+    for parte in _partes("etiquetas_raras").values():
+        assert all(clave.startswith("e_") for clave in parte["etiquetas"])
+
+    cliente.put(f"/api/nota/{id_nota}", json={"etiquetas": ["a.b"]})
+    assert _conteos(cliente, "etiquetas_raras") == {"a.b": 2}
+
+
+def test_indice_repartido_en_partes():
+    cliente = app.test_client()
+    etiquetas = [f"etiqueta{i}" for i in range(20)]
+    _crear_nota(cliente, "etiquetas_partes", etiquetas)
+
+    assert set(_conteos(cliente, "etiquetas_partes")) == set(etiquetas)
+    partes = _partes("etiquetas_partes")
+    assert len(partes) == modulo_firestore.ETIQUETAS_PARTES
+    assert sum(len(p["etiquetas"]) for p in partes.values()) == 20
+
+
+def test_cambiar_numero_de_partes(monkeypatch):
+    cliente = app.test_client()
+    _crear_nota(cliente, "etiquetas_repartir", ["uno", "dos", "tres"])
+    assert _conteos(cliente, "etiquetas_repartir") == {"uno": 1, "dos": 1, "tres": 1}
+
+    monkeypatch.setattr(modulo_firestore, "ETIQUETAS_PARTES", 2)
+    assert _conteos(cliente, "etiquetas_repartir") == {"uno": 1, "dos": 1, "tres": 1}
+    assert set(_partes("etiquetas_repartir")) == {"0", "1"}
+
+
+def test_indice_anterior_a_las_partes():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "etiquetas_sin_migrar", ["viaje", "playa"])
+    # Índice como lo guardaba la versión anterior: un documento por usuario
+    # con las etiquetas tal cual, y ninguna parte
+    for d in _partes("etiquetas_sin_migrar"):
+        db.collection("etiquetas_usuario").document("etiquetas_sin_migrar")\
+          .collection("partes_etiquetas").document(d).delete()
+    db.collection("etiquetas_usuario").document("etiquetas_sin_migrar").set(
+        {"etiquetas": {"viaje": {id_nota: True}}})
+
+    assert _conteos(cliente, "etiquetas_sin_migrar") == {"viaje": 1, "playa": 1}
+    assert db.collection("etiquetas_usuario").document("etiquetas_sin_migrar")\
+             .get().to_dict() == {"partes": modulo_firestore.ETIQUETAS_PARTES}
+
+
+def test_usuario_sin_indice():
+    cliente = app.test_client()
+    _crear_nota(cliente, "etiquetas_sin_indice", ["casa"])
+    for d in _partes("etiquetas_sin_indice"):
+        db.collection("etiquetas_usuario").document("etiquetas_sin_indice")\
+          .collection("partes_etiquetas").document(d).delete()
+
+    assert _conteos(cliente, "etiquetas_sin_indice") == {"casa": 1}
+
+
+def test_reconstruir_etiquetas():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "etiquetas_reconstruir", ["trabajo"])
+    # Una etiqueta que ya no está en ninguna nota
+    clave = clave_etiqueta("vieja")
+    db.collection("etiquetas_usuario").document("etiquetas_reconstruir")\
+      .collection("partes_etiquetas").document("0").set(
+          {"etiquetas": {clave: {id_nota: True}}}, merge=True)
+
+    reconstruir_etiquetas()
+    assert _conteos(cliente, "etiquetas_reconstruir") == {"trabajo": 1}
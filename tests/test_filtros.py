@@ -0,0 +1,141 @@
+"""
+Filtros y orden de GET /api/notas/<id_usuario> resueltos en Firestore.
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from app import app  # noqa: E402
+from firestore import FILTROS_NOTAS, ORDENES_NOTAS, db  # noqa: E402
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _crear_nota(cliente, id_usuario, **campos):
+    datos = {"id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+             "titulo": "Nota", "contenido": "Texto", "categoria_nombre": "General"}
+    datos.update(campos)
+    r = cliente.post("/api/notas/nueva", json=datos)
+    assert r.status_code == 200, r.json
+    return r.json["id_nota"]
+
+
+def _titulos(cliente, id_usuario, **filtros):
+    r = cliente.get(f"/api/notas/{id_usuario}", query_string=filtros)
+    assert r.status_code == 200, r.json
+    return [n["titulo"] for n in r.json]
+
+
+def test_filtros_de_igualdad():
+    cliente = app.test_client()
+    _crear_nota(cliente, "filtros_igualdad", titulo="a", etiquetas=["casa"])
+    id_b = _crear_nota(cliente, "filtros_igualdad", titulo="b", estado="archivada")
+    id_c = _crear_nota(cliente, "filtros_igualdad", titulo="c", etiquetas=["casa", "urgente"])
+    cliente.put(f"/api/notas/favorita/{id_c}", json={"favorita": True})
+    cliente.put(f"/api/notas/favorita/{id_b}", json={"favorita": False})
+
+    assert _titulos(cliente, "filtros_igualdad", estado="archivada") == ["b"]
+    assert _titulos(cliente, "filtros_igualdad", favorita="true") == ["c"]
+    assert sorted(_titulos(cliente, "filtros_igualdad", etiqueta="casa")) == ["a", "c"]
+    assert _titulos(cliente, "filtros_igualdad", etiqueta="casa", favorita="true") == ["c"]
+    assert _titulos(cliente, "filtros_igualdad", estado="activa", etiqueta="urgente") == ["c"]
+
+
+def test_orden_y_rango_de_fechas():
+    cliente = app.test_client()
+    ids = {}
+    for dia, titulo in ((3, "b"), (1, "c"), (2, "a")):
+        ids[titulo] = _crear_nota(cliente, "filtros_orden", titulo=titulo)
+        db.collection("notas").document(ids[titulo]).update(
+            {"fecha_creacion": datetime(2025, 1, dia, tzinfo=timezone.utc)})
+
+    assert _titulos(cliente, "filtros_orden", orden="-creacion") == ["b", "a", "c"]
+    assert _titulos(cliente, "filtros_orden", orden="creacion") == ["c", "a", "b"]
+    assert _titulos(cliente, "filtros_orden", orden="titulo") == ["a", "b", "c"]
+    # Sin orden el rango va sobre la fecha de creación, de más reciente a más antigua
+    assert _titulos(cliente, "filtros_orden", fecha_desde="2025-01-02T00:00:00Z") == ["b", "a"]
+    assert _titulos(cliente, "filtros_orden", orden="creacion",
+                    fecha_desde="2025-01-01T12:00:00Z",
+                    fecha_hasta="2025-01-02T12:00:00Z") == ["a"]
+
+    cliente.put(f"/api/nota/{ids['c']}", json={"contenido": "editada"})
+    assert _titulos(cliente, "filtros_orden", orden="-modificacion")[0] == "c"
+
+
+def test_paginas_con_filtros_y_orden():
+    cliente = app.test_client()
+    for titulo in "edcba":
+        _crear_nota(cliente, "filtros_paginas", titulo=titulo, estado="activa")
+    _crear_nota(cliente, "filtros_paginas", titulo="z", estado="archivada")
+
+    vistos, cursor = [], None
+    while True:
+        consulta = {"orden": "titulo", "estado": "activa", "limit": 2}
+        if cursor:
+            consulta["cursor"] = cursor
+        r = cliente.get("/api/notas/filtros_paginas", query_string=consulta)
+        assert r.status_code == 200
+        vistos += [n["titulo"] for n in r.json]
+        cursor = r.headers.get("X-Siguiente-Cursor")
+        if not cursor:
+            break
+    assert vistos == list("abcde")
+
+    # Un cursor no sirve para otra ordenación
+    r = cliente.get("/api/notas/filtros_paginas",
+                    query_string={"orden": "titulo", "limit": 2})
+    r = cliente.get("/api/notas/filtros_paginas", query_string={
+        "orden": "-creacion", "limit": 2, "cursor": r.headers["X-Siguiente-Cursor"]})
+    assert r.status_code == 400
+
+
+def test_filtros_no_validos_no_leen():
+    cliente = app.test_client()
+    malos = [
+        {"orden": "titulo", "fecha_desde": "2025-01-01T00:00:00Z"},
+        {"orden": "tamano"},
+        {"favorita": "quizas"},
+        {"fecha_hasta": "mañana"},
+    ]
+    for consulta in malos:
+        db.reiniciar_estadisticas()
+        r = cliente.get("/api/notas/filtros_malos", query_string=consulta)
+        assert r.status_code == 400, consulta
+        assert "error" in r.json
+        assert db.reiniciar_estadisticas().get("lecturas", 0) == 0
+
+    r = cliente.get("/api/notas/filtros_malos?etiqueta=a&etiqueta=b")
+    assert r.status_code == 400
+
+
+def test_notas_antiguas_sin_estado_ni_favorita():
+    # Notas guardadas antes de estado/favorita: aparecen en el listado sin
+    # filtros y no en los filtrados por esos campos
+    db.collection("notas").document("filtros_antigua").set({
+        "id_usuario": "filtros_antiguo", "titulo": "antigua", "contenido": "",
+        "id_plantilla": "plantilla_basica",
+        "fecha_creacion": datetime(2024, 5, 1, tzinfo=timezone.utc)})
+    cliente = app.test_client()
+    _crear_nota(cliente, "filtros_antiguo", titulo="nueva")
+
+    assert sorted(_titulos(cliente, "filtros_antiguo")) == ["antigua", "nueva"]
+    assert _titulos(cliente, "filtros_antiguo", orden="creacion") == ["antigua", "nueva"]
+    assert _titulos(cliente, "filtros_antiguo", estado="activa") == ["nueva"]
+
+
+def test_hay_indice_para_cada_filtro_y_orden():
+    with open(os.path.join(RAIZ, "firestore.indexes.json"), encoding="utf-8") as f:
+        indices = json.load(f)["indexes"]
+    definidos = {
+        tuple((c["fieldPath"], c.get("order") or c.get("arrayConfig")) for c in i["fields"])
+        for i in indices if i["collectionGroup"] == "notas"
+    }
+    igualdad = [("id_usuario", "ASCENDING")] + [
+        (campo, "CONTAINS" if operador == "array-contains" else "ASCENDING")
+        for campo, operador in FILTROS_NOTAS.values()]
+    for campo_orden, descendente in ORDENES_NOTAS.values():
+        orden = (campo_orden, "DESCENDING" if descendente else "ASCENDING")
+        for filtro in igualdad:
+            assert (filtro, orden) in definidos, (filtro, orden)
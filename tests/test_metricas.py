@@ -0,0 +1,117 @@
+"""
+Métricas Prometheus por ruta (GET /metrics).
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from prometheus_client import REGISTRY  # noqa: E402
+
+from app import app  # noqa: E402
+from metricas import RUTA_DESCONOCIDA, medir_funciones  # noqa: E402
+
+RUTA_NOTAS = "/api/notas/<id_usuario>"
+
+
+def _valor(nombre, **etiquetas):
+    return REGISTRY.get_sample_value(nombre, etiquetas) or 0
+
+
+def _pedir(cliente, ruta, **kwargs):
+    # La medición se cierra al cerrar la respuesta, como al terminar de enviarla
+    r = cliente.get(ruta, **kwargs)
+    r.get_data()
+    r.close()
+    return r
+
+
+def _crear_nota(cliente, id_usuario):
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+        "titulo": "Nota", "contenido": "Texto", "categoria_nombre": "General"})
+    assert r.status_code == 200
+    return r.json["id_nota"]
+
+
+def test_peticion_medida_por_regla():
+    cliente = app.test_client()
+    for _ in range(3):
+        _crear_nota(cliente, "metricas_ruta")
+
+    peticiones = _valor("api_peticion_segundos_count", metodo="GET", ruta=RUTA_NOTAS, estado="200")
+    consultados = _valor("api_firestore_documentos_total", ruta=RUTA_NOTAS, tipo="consulta")
+    escritos = _valor("api_firestore_documentos_total", ruta=RUTA_NOTAS, tipo="escritura")
+    bytes_antes = _valor("api_respuesta_bytes_sum", metodo="GET", ruta=RUTA_NOTAS)
+
+    r = _pedir(cliente, "/api/notas/metricas_ruta")
+    assert r.status_code == 200
+
+    assert _valor("api_peticion_segundos_count", metodo="GET", ruta=RUTA_NOTAS,
+                  estado="200") == peticiones + 1
+    assert _valor("api_firestore_documentos_total", ruta=RUTA_NOTAS,
+                  tipo="consulta") >= consultados + 3
+    assert _valor("api_firestore_documentos_total", ruta=RUTA_NOTAS, tipo="escritura") == escritos
+    assert _valor("api_respuesta_bytes_sum", metodo="GET", ruta=RUTA_NOTAS) \
+        == bytes_antes + len(r.get_data())
+
+
+def test_respuesta_en_streaming_se_mide_al_terminar():
+    cliente = app.test_client()
+    for _ in range(2):
+        _crear_nota(cliente, "metricas_ndjson")
+    bytes_antes = _valor("api_respuesta_bytes_sum", metodo="GET", ruta=RUTA_NOTAS)
+
+    r = cliente.get("/api/notas/metricas_ndjson", headers={"Accept": "application/x-ndjson"})
+    cuerpo = r.get_data()
+    r.close()
+    assert len(cuerpo.splitlines()) == 2
+    assert _valor("api_respuesta_bytes_sum", metodo="GET", ruta=RUTA_NOTAS) \
+        == bytes_antes + len(cuerpo)
+
+
+def test_ruta_desconocida_y_estado():
+    cliente = app.test_client()
+    antes = _valor("api_peticion_segundos_count", metodo="GET", ruta=RUTA_DESCONOCIDA, estado="404")
+    assert _pedir(cliente, "/no/existe").status_code == 404
+    assert _valor("api_peticion_segundos_count", metodo="GET", ruta=RUTA_DESCONOCIDA,
+                  estado="404") == antes + 1
+
+    antes = _valor("api_peticion_segundos_count", metodo="GET",
+                   ruta="/api/nota/<id_nota>", estado="404")
+    assert _pedir(cliente, "/api/nota/metricas_no_existe").status_code == 404
+    assert _valor("api_peticion_segundos_count", metodo="GET",
+                  ruta="/api/nota/<id_nota>", estado="404") == antes + 1
+
+
+def test_exportacion():
+    cliente = app.test_client()
+    _crear_nota(cliente, "metricas_exportar")
+    r = cliente.get("/metrics")
+    assert r.status_code == 200
+    assert r.content_type.startswith("text/plain")
+    texto = r.get_data(as_text=True)
+    for metrica in ("api_peticion_segundos", "api_respuesta_bytes",
+                    "api_firestore_documentos_total", "api_firestore_funcion_segundos"):
+        assert metrica in texto
+
+
+def test_medir_funciones_incluye_generadores():
+    def metricas_prueba_lista():
+        return [1, 2]
+
+    def metricas_prueba_generador():
+        yield 1
+        yield 2
+
+    espacio = {"metricas_prueba_lista": metricas_prueba_lista,
+               "metricas_prueba_generador": metricas_prueba_generador}
+    medir_funciones(espacio, list(espacio))
+
+    assert espacio["metricas_prueba_lista"]() == [1, 2]
+    generador = espacio["metricas_prueba_generador"]()
+    # Hasta recorrerlo no se ha terminado de medir
+    assert _valor("api_firestore_funcion_segundos_count",
+                  funcion="metricas_prueba_generador") == 0
+    assert list(generador) == [1, 2]
+    for nombre in espacio:
+        assert _valor("api_firestore_funcion_segundos_count", funcion=nombre) == 1
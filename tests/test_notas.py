@@ -0,0 +1,147 @@
+"""
+Creación, lectura y listado de notas.
+"""
+import json
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+import pytest  # noqa: E402
+
+import backend  # noqa: E402
+from app import app  # noqa: E402
+from firestore import db  # noqa: E402
+
+
+@pytest.fixture
+def llamadas():
+    """Llamadas al motor (tipo, forma) hechas durante la prueba."""
+    anotadas = []
+
+    def observar(tipo, forma, documentos, segundos):
+        anotadas.append((tipo, forma))
+
+    backend.observar_llamadas(observar)
+    yield anotadas
+    backend._observadores.remove(observar)
+
+
+def _crear_nota(cliente, id_usuario, **campos):
+    datos = {"id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+             "titulo": "Nota", "contenido": "Texto", "categoria_nombre": "General"}
+    datos.update(campos)
+    r = cliente.post("/api/notas/nueva", json=datos)
+    assert r.status_code == 200, r.json
+    return r.json["id_nota"]
+
+
+def test_crear_nota_con_categoria_nueva_en_un_lote(llamadas):
+    cliente = app.test_client()
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": "notas_lote", "id_plantilla": "plantilla_basica", "titulo": "Nota",
+        "contenido": "Texto", "categoria_nombre": "Categoría del lote"})
+    assert r.status_code == 200
+    id_nota, id_categoria = r.json["id_nota"], r.json["id_categoriaNota"]
+
+    escrituras = [forma for tipo, forma in llamadas if tipo == "escritura"]
+    assert len(escrituras) == 1
+    assert "categoriaNota" in escrituras[0] and "notas_categoriaNota" in escrituras[0]
+
+    relacion = db.collection("notas_categoriaNota").document(id_nota).get().to_dict()
+    assert relacion["id_categoriaNota"] == id_categoria
+    assert relacion["id_usuario"] == "notas_lote"
+    assert db.collection("categoriaNota").document(id_categoria).get().to_dict()["num_notas"] == 1
+
+
+def test_crear_nota_reutiliza_la_categoria():
+    cliente = app.test_client()
+    _crear_nota(cliente, "notas_reutiliza", categoria_nombre="Reutilizada")
+    _crear_nota(cliente, "notas_reutiliza", categoria_nombre="Reutilizada")
+
+    categorias = list(db.collection("categoriaNota").where("nombre", "==", "Reutilizada").stream())
+    assert len(categorias) == 1
+    assert categorias[0].to_dict()["num_notas"] == 2
+
+
+def test_crear_nota_en_categoria_inexistente():
+    cliente = app.test_client()
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": "notas_sin_categoria", "id_plantilla": "plantilla_basica",
+        "titulo": "Nota", "contenido": "Texto", "id_categoriaNota": "no_existe"})
+    assert r.status_code == 404
+    # Todo o nada: no queda la nota sin categoría
+    assert not list(db.collection("notas").where("id_usuario", "==", "notas_sin_categoria").stream())
+
+
+def _paginas(cliente, url):
+    """Todas las páginas siguiendo X-Siguiente-Cursor."""
+    paginas, cursor = [], None
+    while True:
+        r = cliente.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert r.status_code == 200
+        paginas.append([n["id"] for n in r.json])
+        cursor = r.headers.get("X-Siguiente-Cursor")
+        if not cursor:
+            return paginas
+
+
+def test_paginacion_con_cursor():
+    cliente = app.test_client()
+    ids = [_crear_nota(cliente, "notas_paginas", titulo=f"n{i}") for i in range(5)]
+
+    paginas = _paginas(cliente, "/api/notas/notas_paginas?limit=2")
+    assert [len(p) for p in paginas] == [2, 2, 1]
+    # De la más reciente a la más antigua, sin repetir ninguna
+    assert sum(paginas, []) == ids[::-1]
+
+
+def test_paginacion_no_valida():
+    cliente = app.test_client()
+    assert cliente.get("/api/notas/notas_paginas?limit=0").status_code == 400
+    assert cliente.get("/api/notas/notas_paginas?limit=1000").status_code == 400
+    assert cliente.get("/api/notas/notas_paginas?limit=2&cursor=basura").status_code == 400
+
+
+def test_resumen_sin_contenido():
+    cliente = app.test_client()
+    _crear_nota(cliente, "notas_resumen", contenido="Texto largo")
+
+    completa = cliente.get("/api/notas/notas_resumen").json[0]
+    resumen = cliente.get("/api/notas/notas_resumen?resumen=1").json[0]
+    assert completa["contenido"] == "Texto largo"
+    assert "contenido" not in resumen
+    assert "dibujo" not in resumen and "dibujo" not in completa
+    assert resumen["titulo"] == completa["titulo"]
+
+
+def test_listado_ndjson():
+    cliente = app.test_client()
+    ids = [_crear_nota(cliente, "notas_ndjson", titulo=f"n{i}") for i in range(3)]
+
+    r = cliente.get("/api/notas/notas_ndjson", headers={"Accept": "application/x-ndjson"})
+    assert r.mimetype == "application/x-ndjson"
+    assert r.is_streamed
+    filas = [json.loads(linea) for linea in r.get_data(as_text=True).splitlines()]
+    assert sorted(f["id"] for f in filas) == sorted(ids)
+
+    # Sin pedirlo explícitamente sigue siendo JSON
+    r = cliente.get("/api/notas/notas_ndjson", headers={"Accept": "*/*"})
+    assert r.mimetype == "application/json"
+    assert sorted(n["id"] for n in r.json) == sorted(ids)
+
+
+def test_listado_ndjson_vacio():
+    r = app.test_client().get("/api/notas/notas_ndjson_nadie",
+                              headers={"Accept": "application/x-ndjson"})
+    assert r.status_code == 200
+    assert r.get_data() == b""
+
+
+def test_categorias_ndjson():
+    cliente = app.test_client()
+    cliente.post("/api/categorias", json={"nombre": "Ndjson", "usuarioId": "notas_ndjson_cat"})
+
+    r = cliente.get("/api/categorias?usuarioId=notas_ndjson_cat",
+                    headers={"Accept": "application/x-ndjson"})
+    filas = [json.loads(linea) for linea in r.get_data(as_text=True).splitlines()]
+    assert [f["nombre"] for f in filas] == ["Ndjson"]
@@ -0,0 +1,102 @@
+"""
+Perfil de llamadas a Firestore por petición (PERFIL_BACKEND) y avisos de
+N+1.
+"""
+import os
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from flask import Flask, jsonify  # noqa: E402
+
+import perfil  # noqa: E402
+from app import app  # noqa: E402
+from firestore import db  # noqa: E402
+
+
+def _crear_nota(cliente, id_usuario):
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+        "titulo": "Nota", "contenido": "Texto", "categoria_nombre": "General"})
+    assert r.status_code == 200
+    return r.json["id_nota"]
+
+
+def _app_n_mas_1(veces):
+    # App aparte con una ruta que lee las notas de una en una. El observador
+    # del perfil ya lo registró app.py
+    prueba = Flask(__name__)
+    prueba.before_request(perfil._antes)
+    prueba.after_request(perfil._despues)
+
+    @prueba.route("/una_a_una")
+    def una_a_una():
+        for i in range(veces):
+            db.collection("notas").document(f"perfil_{i}").get()
+        return jsonify([])
+
+    return prueba
+
+
+def test_desactivado_sin_cabeceras(monkeypatch):
+    monkeypatch.delenv("PERFIL_BACKEND", raising=False)
+    monkeypatch.delenv("PERFIL_MUESTREO", raising=False)
+    r = app.test_client().get("/api/notas/perfil_apagado")
+    assert "X-Backend-Calls" not in r.headers
+
+
+def test_cabeceras_con_las_llamadas(monkeypatch):
+    monkeypatch.setenv("PERFIL_BACKEND", "1")
+    cliente = app.test_client()
+    for _ in range(3):
+        _crear_nota(cliente, "perfil_cabeceras")
+
+    r = cliente.get("/api/notas/perfil_cabeceras")
+    assert r.status_code == 200
+    assert int(r.headers["X-Backend-Calls"]) >= 1
+    assert int(r.headers["X-Backend-Reads"]) >= 3
+    assert r.headers["X-Backend-Writes"] == "0"
+    assert float(r.headers["X-Backend-Time"]) >= 0
+    assert "X-Backend-Repeated" not in r.headers
+
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": "perfil_cabeceras", "id_plantilla": "plantilla_basica",
+        "titulo": "Otra", "contenido": "", "categoria_nombre": "General"})
+    assert int(r.headers["X-Backend-Writes"]) >= 1
+
+
+def test_aviso_n_mas_1(monkeypatch, capsys):
+    monkeypatch.setenv("PERFIL_BACKEND", "1")
+    monkeypatch.setenv("PERFIL_REPETICIONES_MAX", "5")
+
+    r = _app_n_mas_1(6).test_client().get("/una_a_una")
+    assert r.headers["X-Backend-Calls"] == "6"
+    assert r.headers["X-Backend-Repeated"].endswith(" x6")
+    assert "AVISO N+1 en GET /una_a_una" in capsys.readouterr().out
+
+    r = _app_n_mas_1(5).test_client().get("/una_a_una")
+    assert "X-Backend-Repeated" not in r.headers
+    assert "AVISO N+1" not in capsys.readouterr().out
+
+
+def test_muestreo_sin_cabeceras(monkeypatch, capsys):
+    monkeypatch.delenv("PERFIL_BACKEND", raising=False)
+    monkeypatch.setenv("PERFIL_MUESTREO", "1")
+    r = _app_n_mas_1(2).test_client().get("/una_a_una")
+    assert "X-Backend-Calls" not in r.headers
+    salida = capsys.readouterr().out
+    assert "PERFIL GET /una_a_una 200: 2 llamadas" in salida
+    assert "   2 x " in salida
+
+
+def test_resumir():
+    resumen = perfil.resumir([
+        ("lectura", "get notas", 1, 0.25),
+        ("consulta", "query notas", 4, 0.5),
+        ("lectura", "get notas", 0, 0.25),
+        ("escritura", "commit", 2, 1.0),
+    ])
+    assert resumen["llamadas"] == 4
+    assert resumen["lecturas"] == 5
+    assert resumen["escrituras"] == 2
+    assert resumen["segundos"] == 2.0
+    assert resumen["formas"]["get notas"] == {"llamadas": 2, "documentos": 1, "segundos": 0.5}
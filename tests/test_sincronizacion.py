@@ -0,0 +1,111 @@
+"""
+Sincronización incremental (GET /api/notas/<id_usuario>/cambios) y marcas
+de notas eliminadas.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+os.environ.setdefault("BACKEND_DATOS", "memoria")
+
+from app import app  # noqa: E402
+from firestore import db  # noqa: E402
+import mantenimiento  # noqa: E402
+
+
+def _crear_nota(cliente, id_usuario, titulo="Nota"):
+    r = cliente.post("/api/notas/nueva", json={
+        "id_usuario": id_usuario, "id_plantilla": "plantilla_basica",
+        "titulo": titulo, "contenido": "Texto", "categoria_nombre": "General"})
+    return r.json["id_nota"]
+
+
+def _cambios(cliente, id_usuario, desde=None):
+    consulta = {"desde": desde} if desde else {}
+    return cliente.get(f"/api/notas/{id_usuario}/cambios", query_string=consulta)
+
+
+def test_primera_sincronizacion_devuelve_todo():
+    cliente = app.test_client()
+    ids = {_crear_nota(cliente, "sync_todo") for _ in range(3)}
+    r = _cambios(cliente, "sync_todo")
+    assert r.status_code == 200
+    assert {n["id"] for n in r.json["notas"]} == ids
+    assert r.json["eliminadas"] == []
+    assert r.json["hasta"]
+
+
+def test_sincronizacion_incremental():
+    cliente = app.test_client()
+    sin_tocar = _crear_nota(cliente, "sync_delta")
+    modificada = _crear_nota(cliente, "sync_delta")
+    borrada = _crear_nota(cliente, "sync_delta")
+    hasta = _cambios(cliente, "sync_delta").json["hasta"]
+
+    cliente.put(f"/api/nota/{modificada}", json={"titulo": "Cambiada"})
+    cliente.delete(f"/api/nota/{borrada}")
+    nueva = _crear_nota(cliente, "sync_delta")
+
+    r = _cambios(cliente, "sync_delta", hasta)
+    assert r.status_code == 200
+    ids = {n["id"] for n in r.json["notas"]}
+    assert ids == {modificada, nueva}
+    assert sin_tocar not in ids
+    assert r.json["eliminadas"] == [borrada]
+
+    # Sin cambios nuevos no se devuelve nada y 'hasta' no retrocede
+    r = _cambios(cliente, "sync_delta", r.json["hasta"])
+    assert r.json["notas"] == [] and r.json["eliminadas"] == []
+    assert r.json["hasta"]
+
+
+def test_eliminadas_solo_del_usuario():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "sync_otro_usuario")
+    hasta = _cambios(cliente, "sync_otro_usuario").json["hasta"]
+    cliente.delete(f"/api/nota/{id_nota}")
+    # Las marcas de un usuario no se envían a otro
+    assert _cambios(cliente, "sync_ajeno", hasta).json["eliminadas"] == []
+
+
+def test_desde_invalido_y_caducado():
+    cliente = app.test_client()
+    assert _cambios(cliente, "sync_errores", "ayer").status_code == 400
+    antiguo = (datetime.now(timezone.utc) - timedelta(days=365)).isoformat()
+    assert _cambios(cliente, "sync_errores", antiguo).status_code == 410
+
+
+def test_etag_de_cambios():
+    cliente = app.test_client()
+    _crear_nota(cliente, "sync_etag")
+    r = _cambios(cliente, "sync_etag")
+    etag = r.headers["ETag"]
+    r = cliente.get("/api/notas/sync_etag/cambios", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    _crear_nota(cliente, "sync_etag")
+    r = cliente.get("/api/notas/sync_etag/cambios", headers={"If-None-Match": etag})
+    assert r.status_code == 200 and len(r.json["notas"]) == 2
+
+
+def test_nota_antigua_sin_fecha_modificacion():
+    # Notas guardadas antes de fecha_modificacion: la primera sincronización
+    # las incluye
+    db.collection("notas").document("sync_antigua").set({
+        "id_usuario": "sync_antiguo", "titulo": "Antigua", "contenido": "",
+        "id_plantilla": "plantilla_basica"})
+    r = _cambios(app.test_client(), "sync_antiguo")
+    assert r.status_code == 200
+    assert [n["id"] for n in r.json["notas"]] == ["sync_antigua"]
+
+
+def test_purgar_eliminadas():
+    cliente = app.test_client()
+    id_nota = _crear_nota(cliente, "sync_purga")
+    cliente.delete(f"/api/nota/{id_nota}")
+    antigua = datetime.now(timezone.utc) - timedelta(days=400)
+    db.collection("notas_eliminadas").document("sync_purga_antigua").set(
+        {"id_usuario": "sync_purga", "fecha_eliminacion": antigua})
+
+    resultado = mantenimiento.purgar_eliminadas()
+    assert resultado["purgadas"] >= 1
+    assert not db.collection("notas_eliminadas").document("sync_purga_antigua").get().exists
+    assert db.collection("notas_eliminadas").document(id_nota).get().exists